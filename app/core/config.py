@@ -32,7 +32,45 @@ class Settings(BaseSettings):
     IOT_CERT_CA: str = Field(validation_alias="IOT_CERT_CA", default="")
     IOT_CERT_CRT: str = Field(validation_alias="IOT_CERT_CRT", default="")
     IOT_PRIVATE_KEY: str = Field(validation_alias="IOT_PRIVATE_KEY", default="")
-    FILE_FOLDER: str = Field(validation_alias="FILE_FOLDER", default="device-files/")
+    FILE_FOLDER: str = Field(validation_alias="FILE_FOLDER", default="device-files/")  # 韌體產物，多個 instance 時必須是共用的 volume
+    BUILD_JOB_HEARTBEAT: int = Field(validation_alias="BUILD_JOB_HEARTBEAT", default=30)  # seconds，排隊 / 編譯中的工作更新 updated_at
+    BUILD_JOB_STALE_AFTER: int = Field(validation_alias="BUILD_JOB_STALE_AFTER", default=180)  # seconds 沒有 heartbeat 就視為中斷
+    FIRMWARE_PATCH_MODE: bool = Field(validation_alias="FIRMWARE_PATCH_MODE", default=False)  # 編譯一次 template，之後只 patch .bin
+    FIRMWARE_BUILD_WORKERS: int = Field(validation_alias="FIRMWARE_BUILD_WORKERS", default=0)  # 0 = 可用的 CPU 核心數
+    FIRMWARE_BUILD_PATH: str = Field(validation_alias="FIRMWARE_BUILD_PATH", default="build-cache/sketch")  # 保留 .o 做增量編譯，每個 slot 一個子目錄
+    FIRMWARE_WORKSPACE_PATH: str = Field(validation_alias="FIRMWARE_WORKSPACE_PATH", default="build-cache/workspace")  # 每個 slot 的原始碼複本與輸出目錄
+    FIRMWARE_BUILD_CACHE_PATH: str = Field(validation_alias="FIRMWARE_BUILD_CACHE_PATH", default="build-cache/core")  # core / library 快取
+    DYNAMODB_POOL_SIZE: int = Field(validation_alias="DYNAMODB_POOL_SIZE", default=32)  # worker threads / http connections
+    DYNAMODB_BILLING_MODE: str = Field(validation_alias="DYNAMODB_BILLING_MODE", default="PROVISIONED")  # PROVISIONED / PAY_PER_REQUEST (新建的資料表)
+    DYNAMODB_SCHEMA_CACHE: Optional[str] = Field(validation_alias="DYNAMODB_SCHEMA_CACHE", default="")  # 本機 fingerprint 檔，只在檔案系統會保留時有用；空值 = 只用 DynamoDB 的 schema_meta
+    DYNAMODB_MAX_ATTEMPTS: int = Field(validation_alias="DYNAMODB_MAX_ATTEMPTS", default=5)  # adaptive retry mode
+    UPSTREAM_POOL_CONNECTIONS: int = Field(validation_alias="UPSTREAM_POOL_CONNECTIONS", default=4)  # host pools kept alive
+    UPSTREAM_POOL_MAXSIZE: int = Field(validation_alias="UPSTREAM_POOL_MAXSIZE", default=32)  # connections per host
+    UPSTREAM_POOL_BLOCK: bool = Field(validation_alias="UPSTREAM_POOL_BLOCK", default=True)  # wait instead of opening extra connections
+    STATE_CACHE_TTL: int = Field(validation_alias="STATE_CACHE_TTL", default=300)  # seconds
+    STATE_CACHE_MAXSIZE: int = Field(validation_alias="STATE_CACHE_MAXSIZE", default=10000)
+    STATE_CACHE_RELOAD_INTERVAL: int = Field(validation_alias="STATE_CACHE_RELOAD_INTERVAL", default=5)  # min seconds between reloads on miss
+    RECORD_CACHE_MAXSIZE: int = Field(validation_alias="RECORD_CACHE_MAXSIZE", default=5000)
+    RECORD_CACHE_TTL: int = Field(validation_alias="RECORD_CACHE_TTL", default=300)  # seconds，其他 worker 收到刪除事件後最多再回傳這麼久
+    SCAN_EVENT_TTL_DAYS: int = Field(validation_alias="SCAN_EVENT_TTL_DAYS", default=30)  # 重送的 record 事件在這段時間內不會重複計數
+    TOKEN_CACHE_MAXSIZE: int = Field(validation_alias="TOKEN_CACHE_MAXSIZE", default=10000)  # 已驗證的 access token
+    ARGON2_TIME_COST: int = Field(validation_alias="ARGON2_TIME_COST", default=3)  # 用 benchmarks/argon2_calibrate.py 校正
+    ARGON2_MEMORY_COST: int = Field(validation_alias="ARGON2_MEMORY_COST", default=65536)  # KiB
+    ARGON2_PARALLELISM: int = Field(validation_alias="ARGON2_PARALLELISM", default=4)
+    PASSWORD_HASH_WORKERS: int = Field(validation_alias="PASSWORD_HASH_WORKERS", default=2)  # argon2 process 數量
+    UPSTREAM_CONCURRENCY: int = Field(validation_alias="UPSTREAM_CONCURRENCY", default=16)  # in-flight upstream calls per request
+    HISTORY_PAGING_RETRY: int = Field(validation_alias="HISTORY_PAGING_RETRY", default=600)  # seconds，資料服務忽略分頁參數後，多久再試一次
+    PRESENCE_MQTT_ENABLED: bool = Field(validation_alias="PRESENCE_MQTT_ENABLED", default=False)  # 訂閱裝置上下線事件，連線檢查改查記憶體
+    PRESENCE_MQTT_HOST: str = Field(validation_alias="PRESENCE_MQTT_HOST", default="")  # 空值 = IOT_ENDPOINT
+    PRESENCE_MQTT_PORT: int = Field(validation_alias="PRESENCE_MQTT_PORT", default=8883)
+    PRESENCE_MQTT_TLS: bool = Field(validation_alias="PRESENCE_MQTT_TLS", default=True)  # 用 IOT_CERT_* 做 client certificate 驗證
+    PRESENCE_MQTT_CLIENT_ID: str = Field(validation_alias="PRESENCE_MQTT_CLIENT_ID", default="")  # 空值 = 依 hostname / pid 產生
+    PRESENCE_TOPICS: str = Field(validation_alias="PRESENCE_TOPICS", default="$aws/events/presence/+/+,biocherish/+/heartbeat,biocherish/+/status")  # 逗號分隔
+    PRESENCE_TTL: int = Field(validation_alias="PRESENCE_TTL", default=180)  # seconds，heartbeat 超過就視為離線
+    SNAPSHOT_MAX_STALENESS: int = Field(validation_alias="SNAPSHOT_MAX_STALENESS", default=3600)  # seconds，bottle snapshot 上次和上游確認後，多久內可以直接回 304
+    DEVICE_ONLINE_WINDOW: int = Field(validation_alias="DEVICE_ONLINE_WINDOW", default=600)  # seconds，沒有 presence 時，裝置送出紀錄後多久內視為在線
+    BOTTLE_STREAM_KEEPALIVE: int = Field(validation_alias="BOTTLE_STREAM_KEEPALIVE", default=15)  # seconds，SSE 沒有事件時送註解行
+    BOTTLE_STREAM_QUEUE_SIZE: int = Field(validation_alias="BOTTLE_STREAM_QUEUE_SIZE", default=64)  # 每條連線最多暫存的事件，滿了改送 resync
 
 
 @lru_cache
@@ -1,8 +1,16 @@
 from boto3.resources.base import ServiceResource
+from typing import Optional
+import hashlib
+import json
 import logging
+import os
 
 logger = logging.getLogger(__name__)
 
+# 記錄已套用的 schema fingerprint，所有 instance 共用 (本機檔案在 container 重建後就不見了)
+SCHEMA_TABLE = "schema_meta"
+SCHEMA_MARKER_ID = "schema"
+
 
 tables = [
     {
@@ -175,27 +183,144 @@ tables = [
         "KeySchema": [{"AttributeName": "detect_record_state_id", "KeyType": "HASH"}],
         "AttributeDefinitions": [{"AttributeName": "detect_record_state_id", "AttributeType": "S"}],
         "ProvisionedThroughput": {"ReadCapacityUnits": 5, "WriteCapacityUnits": 5}
+    },
+    {
+        "TableName": "build_job",
+        "KeySchema": [{"AttributeName": "id", "KeyType": "HASH"}],
+        "AttributeDefinitions": [{"AttributeName": "id", "AttributeType": "S"}],
+        "ProvisionedThroughput": {"ReadCapacityUnits": 5, "WriteCapacityUnits": 5}
+    },
+    {
+        # "{device_id}#{detect_record_id}" -> 這筆紀錄的 created / deleted 事件是否已計入 total_scans
+        "TableName": "scan_event",
+        "KeySchema": [{"AttributeName": "id", "KeyType": "HASH"}],
+        "AttributeDefinitions": [{"AttributeName": "id", "AttributeType": "S"}],
+        "ProvisionedThroughput": {"ReadCapacityUnits": 5, "WriteCapacityUnits": 5}
+    },
+    {
+        "TableName": SCHEMA_TABLE,
+        "KeySchema": [{"AttributeName": "id", "KeyType": "HASH"}],
+        "AttributeDefinitions": [{"AttributeName": "id", "AttributeType": "S"}],
+        "ProvisionedThroughput": {"ReadCapacityUnits": 1, "WriteCapacityUnits": 1}
     }
 ]
 
+# 資料表 -> TTL 欄位 (epoch 秒)，過期的 item 由 DynamoDB 自動刪除
+ttl_attributes = {
+    "access_token": "expires_at",
+    "scan_event": "expires_at",
+}
+
+
+def enable_ttl(dynamodb: ServiceResource, table_name: str, attribute: str):
+    client = dynamodb.meta.client
+    ttl = client.describe_time_to_live(TableName=table_name)["TimeToLiveDescription"]
+    if ttl.get("TimeToLiveStatus") in ("ENABLED", "ENABLING"):
+        return
+    client.update_time_to_live(
+        TableName=table_name,
+        TimeToLiveSpecification={"Enabled": True, "AttributeName": attribute},
+    )
+    logger.info(f"資料表 {table_name} 已啟用 TTL ({attribute})。")
+
+
+def table_definition(table_def: dict, billing_mode: str) -> dict:
+    if billing_mode != "PAY_PER_REQUEST":
+        return table_def
+    # on-demand 不能帶 ProvisionedThroughput (GSI 也一樣)
+    table_def = {k: v for k, v in table_def.items() if k != "ProvisionedThroughput"}
+    table_def["BillingMode"] = "PAY_PER_REQUEST"
+    if "GlobalSecondaryIndexes" in table_def:
+        table_def["GlobalSecondaryIndexes"] = [
+            {k: v for k, v in index.items() if k != "ProvisionedThroughput"}
+            for index in table_def["GlobalSecondaryIndexes"]
+        ]
+    return table_def
+
+
+def schema_fingerprint(billing_mode: str, target: str = "") -> str:
+    # target = region / endpoint，換資料庫時不能沿用舊的 fingerprint
+    raw = json.dumps([tables, ttl_attributes, billing_mode, target], sort_keys=True)
+    return hashlib.sha256(raw.encode()).hexdigest()
 
-def init_tables(dynamodb: ServiceResource):
+
+def schema_cached(billing_mode: str, cache_path: Optional[str], target: str = "") -> bool:
+    if not cache_path or not os.path.exists(cache_path):
+        return False
+    with open(cache_path, "r", encoding="utf-8") as f:
+        return f.read().strip() == schema_fingerprint(billing_mode, target)
+
+
+def _write_schema_cache(cache_path: Optional[str], fingerprint: str):
+    if not cache_path:
+        return
+    directory = os.path.dirname(cache_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(cache_path, "w", encoding="utf-8") as f:
+        f.write(fingerprint)
+
+
+def schema_marker_matches(dynamodb: ServiceResource, fingerprint: str) -> bool:
+    # 一次 GetItem；schema_meta 還不存在 (第一次部署) 就視為不符
+    client = dynamodb.meta.client
     try:
-        for table_def in tables:
-            if table_def["TableName"] in dynamodb.meta.client.list_tables()["TableNames"]:
-                logger.info(f"資料表 {table_def['TableName']} 已存在，跳過建立。")
-                continue
-
-            # table = dynamodb.create_table(
-            #     TableName=table_def["TableName"],
-            #     KeySchema=table_def["KeySchema"],
-            #     AttributeDefinitions=table_def["AttributeDefinitions"],
-            #     ProvisionedThroughput=table_def["ProvisionedThroughput"]
-            # )
-            table = dynamodb.create_table(**table_def)
-
-            logger.info(f"正在建立資料表 {table_def['TableName']}...")
-            table.wait_until_exists()
-            logger.info(f"資料表 {table_def['TableName']} 建立完成。")
-    except dynamodb.meta.client.exceptions.ResourceInUseException:
-        logger.info()
\ No newline at end of file
+        item = dynamodb.Table(SCHEMA_TABLE).get_item(Key={"id": SCHEMA_MARKER_ID}, ConsistentRead=True).get("Item")
+    except client.exceptions.ResourceNotFoundException:
+        return False
+    return bool(item) and item.get("fingerprint") == fingerprint
+
+
+def _list_tables(client) -> set:
+    names = set()
+    for page in client.get_paginator("list_tables").paginate():
+        names.update(page["TableNames"])
+    return names
+
+
+def init_tables(dynamodb: ServiceResource, billing_mode: str = "PROVISIONED", cache_path: Optional[str] = None, target: str = ""):
+    """建立缺少的資料表並啟用 TTL。
+
+    上次成功時的 schema fingerprint 存在 schema_meta 表，相同就只花一次 GetItem 跳過檢查；
+    cache_path (本機檔案) 有設定且相同時則完全不呼叫 DynamoDB API。
+    缺少的資料表會一次全部送出建立，再一起等待完成。
+    """
+    fingerprint = schema_fingerprint(billing_mode, target)
+    if schema_cached(billing_mode, cache_path, target):
+        logger.info("資料表 schema 未變動，跳過檢查。")
+        return
+    if schema_marker_matches(dynamodb, fingerprint):
+        logger.info("資料表 schema 未變動 (schema_meta)，跳過檢查。")
+        _write_schema_cache(cache_path, fingerprint)
+        return
+
+    client = dynamodb.meta.client
+    existing = _list_tables(client)
+
+    pending = []
+    for table_def in tables:
+        name = table_def["TableName"]
+        if name in existing:
+            logger.info(f"資料表 {name} 已存在，跳過建立。")
+            continue
+        try:
+            client.create_table(**table_definition(table_def, billing_mode))
+            logger.info(f"正在建立資料表 {name}...")
+        except client.exceptions.ResourceInUseException:
+            # 其他 instance 同時在建立
+            logger.info(f"資料表 {name} 正在由其他程序建立。")
+        pending.append(name)
+
+    # 建立是在 DynamoDB 端並行進行，這裡只需要依序等到全部完成
+    waiter = client.get_waiter("table_exists")
+    for name in pending:
+        waiter.wait(TableName=name)
+    if pending:
+        logger.info(f"資料表 {', '.join(pending)} 建立完成。")
+
+    # 舊的資料表也要補開 TTL
+    for table_name, attribute in ttl_attributes.items():
+        enable_ttl(dynamodb, table_name, attribute)
+
+    dynamodb.Table(SCHEMA_TABLE).put_item(Item={"id": SCHEMA_MARKER_ID, "fingerprint": fingerprint})
+    _write_schema_cache(cache_path, fingerprint)
@@ -1,8 +1,11 @@
+import threading
+
 import boto3
+from botocore.config import Config
 from fastapi import Depends
 from app.core.config import get_settings
 from typing import Annotated
-from app.core.createTable import init_tables
+from app.core.createTable import init_tables, schema_cached
 import logging
 
 logger = logging.getLogger(__name__)
@@ -10,25 +13,50 @@ logger = logging.getLogger(__name__)
 # get settings
 settings = get_settings()
 
-if settings.DATABASE_URL:
-    dynamodb = boto3.resource(
-        'dynamodb',
-        endpoint_url=settings.DATABASE_URL,
-        region_name=settings.AWS_REGION,
-        aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-        aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY
-    )
-else:
-    dynamodb = boto3.resource(
-        'dynamodb',
+
+def resource_kwargs() -> dict:
+    kwargs = dict(
         region_name=settings.AWS_REGION,
         aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-        aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY
+        aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
+        config=Config(
+            max_pool_connections=settings.DYNAMODB_POOL_SIZE,
+            retries={"mode": "adaptive", "max_attempts": settings.DYNAMODB_MAX_ATTEMPTS},
+        ),
     )
+    if settings.DATABASE_URL:
+        kwargs["endpoint_url"] = settings.DATABASE_URL
+    return kwargs
+
+
+_dynamodb = None
+_lock = threading.Lock()
+
+
+def get_dynamodb():
+    # 建立 resource 要載入 service model (~100ms)，等到真的用到才建立
+    global _dynamodb
+    if _dynamodb is None:
+        with _lock:
+            if _dynamodb is None:
+                _dynamodb = boto3.resource('dynamodb', **resource_kwargs())
+    return _dynamodb
 
 
 async def on_startup():
+    target = f"{settings.AWS_REGION}|{settings.DATABASE_URL}"
+    if schema_cached(settings.DYNAMODB_BILLING_MODE, settings.DYNAMODB_SCHEMA_CACHE, target):
+        # schema 沒變動就不用建立 resource，交給 prewarm 在背景處理
+        logger.info("資料表 schema 未變動，跳過檢查。")
+        return
+
+    dynamodb = get_dynamodb()
     if not dynamodb:
         logger.error("Could not connect to DynamoDB")
         raise Exception("Could not connect to DynamoDB")
-    init_tables(dynamodb)
\ No newline at end of file
+    init_tables(
+        dynamodb,
+        billing_mode=settings.DYNAMODB_BILLING_MODE,
+        cache_path=settings.DYNAMODB_SCHEMA_CACHE,
+        target=target,
+    )
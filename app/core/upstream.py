@@ -0,0 +1,48 @@
+import logging
+import threading
+from typing import TYPE_CHECKING, Optional
+
+from app.core.config import Settings, get_settings
+
+if TYPE_CHECKING:
+    import requests
+
+logger = logging.getLogger(__name__)
+
+_session: Optional["requests.Session"] = None
+_lock = threading.Lock()
+
+
+def build_session(settings: Settings) -> "requests.Session":
+    # requests 到第一次呼叫上游時才載入，縮短啟動時間
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    # 每個 host 一個 connection pool，連線用完放回去 (keep-alive)
+    adapter = HTTPAdapter(
+        pool_connections=settings.UPSTREAM_POOL_CONNECTIONS,
+        pool_maxsize=settings.UPSTREAM_POOL_MAXSIZE,
+        pool_block=settings.UPSTREAM_POOL_BLOCK,
+    )
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def get_session(settings: Optional[Settings] = None) -> "requests.Session":
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                _session = build_session(settings or get_settings())
+                logger.info("Upstream session created.")
+    return _session
+
+
+async def on_shutdown():
+    global _session
+    with _lock:
+        if _session is not None:
+            _session.close()
+            _session = None
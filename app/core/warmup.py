@@ -0,0 +1,54 @@
+import asyncio
+import importlib
+import logging
+from typing import Optional
+
+from fastapi.concurrency import run_in_threadpool
+
+from app.core.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+PREWARM_DYNAMODB_THREADS = 4
+
+_ready = False
+_task: Optional[asyncio.Task] = None
+
+
+async def prewarm():
+    """把延後建立的 client 與模組先準備好；完成前 /ready 回 503，request 仍可正常處理 (會自己 lazy 建立)。"""
+    global _ready
+    from app.core.db import get_dynamodb
+    from app.core.repository import prewarm as prewarm_tables
+    from app.core.upstream import get_session
+    from app.lib.password import argon2_params, get_executor, warm
+
+    settings = get_settings()
+    loop = asyncio.get_running_loop()
+    try:
+        await asyncio.gather(
+            run_in_threadpool(get_dynamodb),
+            prewarm_tables(min(PREWARM_DYNAMODB_THREADS, settings.DYNAMODB_POOL_SIZE)),
+            run_in_threadpool(get_session, settings),
+            run_in_threadpool(importlib.import_module, "jose.jwt"),
+            *(
+                loop.run_in_executor(get_executor(settings), warm, argon2_params(settings))
+                for _ in range(settings.PASSWORD_HASH_WORKERS)
+            ),
+        )
+    except Exception:
+        logger.exception("prewarm 失敗")
+        return
+    _ready = True
+    logger.info("prewarm 完成")
+
+
+def is_ready() -> bool:
+    return _ready
+
+
+async def on_startup():
+    # 不擋住啟動，背景進行
+    global _task
+    if _task is None:
+        _task = asyncio.create_task(prewarm())
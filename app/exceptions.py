@@ -42,8 +42,22 @@ def unauthorized_exception_handler(req: Request, ex: UnAuthorizedException):
         detail="Your don't have permission to access this resource",
     )
 
+class UploadTooLarge(HTTPException):
+  def __init__(self, msg: str = "Request body exceeds upload limit", status_code: int = 413):
+    super().__init__(status_code=status_code)
+    self.msg = msg
+
+def upload_too_large_handler(req: Request, ex: UploadTooLarge):
+    logging.warning(f"UploadTooLarge: {req.url.path}")
+    return JSONResponse(
+        status_code=ex.status_code,
+        content={"message": ex.msg},
+        headers={"Connection": "close"},
+    )
+
 exceptions = [
     (UserDoesNotExistsException, user_exception_handler),
     (CredentialsException, credentials_exception_handler),
     (UnAuthorizedException, unauthorized_exception_handler),
+    (UploadTooLarge, upload_too_large_handler),
 ]
\ No newline at end of file
@@ -1,17 +1,25 @@
+import asyncio
 import datetime
+from typing import Dict, Optional, Tuple
 from uuid import uuid4
 
+from botocore.exceptions import ClientError
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
-from jose import JWTError, jwt
 
 from app.core.config import get_settings
+from app.core.repository import access_table, transact_write, user_table
+from app.lib.password import argon2_params, get_executor, hash_sync, verify_sync
+from app.lib.token_cache import get_token_cache
+from app.lib.token_cleanup import schedule_prune
+from app.models.user import AccessToken
 
 oauth2_scheme = HTTPBearer()
 settings = get_settings()
 
 
 def generate_access_token(userId: str):
+    from jose import jwt
     return jwt.encode(
         {
             "user_id": userId,
@@ -23,6 +31,7 @@ def generate_access_token(userId: str):
     )
     
 def generate_refresh_token(userId: str):
+    from jose import jwt
     return jwt.encode(
         {
             "user_id": userId,
@@ -34,7 +43,68 @@ def generate_refresh_token(userId: str):
         algorithm=settings.JWT_ALGORITHM,
     )
 
+class TokenVersionConflict(Exception):
+    """token_version 已經被其他登入 / 登出 / refresh 改動。"""
+
+
+async def issue_tokens(user_id: str, token_version: int, new_user: Optional[Dict] = None, retry: bool = True) -> Tuple[str, str]:
+    """發新的 access / refresh token：token_version +1 與寫入 access_token 在同一個 TransactWriteItems。
+
+    token_version 是呼叫端讀到的目前版本，被改動過時整筆交易取消。
+    retry=True 時以 consistent read 重讀一次版本再試，否則丟出 TokenVersionConflict。
+    new_user 有值時 (第一次 Google 登入) 直接以新版本建立使用者。
+    """
+    access_token = generate_access_token(userId=user_id)
+    refresh_token = generate_refresh_token(userId=user_id)
+    new_version = token_version + 1
+
+    if new_user is not None:
+        user_write = {"Put": {
+            "TableName": user_table.name,
+            "Item": {**new_user, "token_version": new_version},
+            "ConditionExpression": "attribute_not_exists(id)",
+        }}
+    else:
+        user_write = {"Update": {
+            "TableName": user_table.name,
+            "Key": {"id": user_id},
+            "UpdateExpression": "SET token_version = :new",
+            "ConditionExpression": "token_version = :current",
+            "ExpressionAttributeValues": {":new": new_version, ":current": token_version},
+        }}
+
+    try:
+        await transact_write([
+            user_write,
+            {"Put": {
+                "TableName": access_table.name,
+                "Item": AccessToken(
+                    id=str(uuid4()),
+                    user_id=user_id,
+                    refresh_token=refresh_token,
+                    token_version=new_version,
+                    expires_at=int(datetime.datetime.now().timestamp()) + settings.JWT_REFRESH_TOKEN_EXPIRE_DAYS * 86400,
+                ).dict(),
+                "ConditionExpression": "attribute_not_exists(id)",
+            }},
+        ])
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "TransactionCanceledException":
+            raise
+        if not retry or new_user is not None:
+            raise TokenVersionConflict() from e
+        user = (await user_table.get_item(Key={"id": user_id}, ConsistentRead=True)).get("Item")
+        if not user:
+            raise TokenVersionConflict() from e
+        return await issue_tokens(user_id, user.get("token_version", 0), retry=False)
+
+    # 舊版本的 access_token 已經不能再用，順便清掉
+    schedule_prune(user_id, new_version)
+    return access_token, refresh_token
+
+
 def verify_jwt_token(token: str):
+    from jose import JWTError, jwt
     try:
         return jwt.decode(
             token,
@@ -44,22 +114,26 @@ def verify_jwt_token(token: str):
     except JWTError:
         return None
 
-def verify_password(hashed_password: str, plain_password: str) -> bool:
-    from argon2 import PasswordHasher
-    ph = PasswordHasher()
-    try:
-        ph.verify(hashed_password, plain_password)
-        return True
-    except:
-        return False
+async def verify_password(hashed_password: str, plain_password: str) -> Tuple[bool, Optional[str]]:
+    """回傳 (是否正確, 新的 hash)；Settings 的 argon2 參數變動後，舊 hash 在登入成功時會拿到新 hash。"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        get_executor(settings), verify_sync, argon2_params(settings), hashed_password, plain_password
+    )
 
-def hash_password(plain_password: str) -> str:
-    from argon2 import PasswordHasher
-    ph = PasswordHasher()
-    return ph.hash(plain_password)
+async def hash_password(plain_password: str) -> str:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        get_executor(settings), hash_sync, argon2_params(settings), plain_password
+    )
 
 
 def require_user(token: HTTPAuthorizationCredentials = Depends(oauth2_scheme)):
+    cache = get_token_cache(settings)
+    payload = cache.get(token.credentials)
+    if payload is not None:
+        return payload
+
     try:
         payload = verify_jwt_token(token.credentials)
     except Exception:
@@ -83,4 +157,35 @@ def require_user(token: HTTPAuthorizationCredentials = Depends(oauth2_scheme)):
             headers={"WWW-Authenticate": "Bearer"},
         )
 
+    # 只快取驗證通過的 access token，到 exp 為止
+    cache.put(token.credentials, payload)
     return payload
+
+
+# 資料服務自己的 token 帶這個 scope，可以代替任何裝置送事件
+DATA_SERVICE_SCOPE = "data-service"
+
+
+def device_allowed(caller: Dict, device_id: str) -> bool:
+    """裝置 token 只能操作自己 (device_id / sub claim)，資料服務的 token 要帶 DATA_SERVICE_SCOPE。"""
+    if DATA_SERVICE_SCOPE in str(caller.get("scope", "")).split():
+        return True
+    claimed = caller.get("device_id", caller.get("sub"))
+    return claimed is not None and str(claimed) == device_id
+
+
+def require_device(token: HTTPAuthorizationCredentials = Depends(oauth2_scheme)):
+    # 資料服務 / 裝置以 DEVICE_SECRET_KEY 簽發的 JWT 呼叫
+    from jose import JWTError, jwt
+    try:
+        return jwt.decode(
+            token.credentials,
+            settings.DEVICE_SECRET_KEY,
+            algorithms=[settings.DEVICE_ALGORITHM],
+        )
+    except JWTError:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid or expired token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
@@ -0,0 +1,158 @@
+import asyncio
+import json
+import threading
+import time
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+from app.core.config import Settings
+from app.lib.presence import get_presence
+from app.models.bottle import BottleStatus
+
+
+def status_delta(bottle_id: str, snapshot: Dict) -> Dict:
+    """snapshot (curr_* 欄位) -> 和 GET /bottle/ 相同格式的部分欄位。"""
+    delta = {
+        "id": str(bottle_id),
+        "bottle_status": str(BottleStatus(int(snapshot.get("curr_bottle_status", BottleStatus.UNKNOWN)))),
+        "bottle_status_text": snapshot.get("curr_bottle_status_text") or "未知",
+        "env_status": str(BottleStatus(int(snapshot.get("curr_env_status", BottleStatus.UNKNOWN)))),
+        "env_status_text": snapshot.get("curr_env_status_text") or "未知",
+        "imageurl": snapshot.get("curr_image_path"),
+        "scanned_at": int(snapshot.get("scanned_at", 0) * 1000),
+    }
+    if snapshot.get("last_seen"):
+        # 裝置剛送出紀錄
+        delta["isConnected"] = True
+    return delta
+
+
+def format_event(event: str, data: Dict) -> bytes:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, separators=(',', ':'))}\n\n".encode("utf-8")
+
+
+class Subscription:
+    """一條 SSE 連線；queue 滿了代表 client 跟不上，清空後只留一個 resync。"""
+
+    __slots__ = ("user_id", "queue")
+
+    def __init__(self, user_id: str, maxsize: int):
+        self.user_id = user_id
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+
+    def put(self, event: str, data: Dict):
+        try:
+            self.queue.put_nowait((event, data))
+        except asyncio.QueueFull:
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(("resync", {}))
+
+
+class BottleEventHub:
+    """行程內的 pub/sub：user_id -> 訂閱中的連線，device_id -> 要通知的使用者與 bottle。
+
+    只在 event loop 內呼叫 (record 事件的 route、MQTT presence 的 callback)；
+    閒置的連線只佔一個 queue，沒有額外的 thread。
+    """
+
+    def __init__(self, settings: Settings):
+        self.queue_size = settings.BOTTLE_STREAM_QUEUE_SIZE
+        self._subscribers: Dict[str, Set[Subscription]] = {}
+        # user_id -> {device_id: bottle_id}；device_id -> {user_id}
+        self._user_devices: Dict[str, Dict[str, str]] = {}
+        self._device_users: Dict[str, Set[str]] = {}
+
+        self.published = 0
+
+    def subscribe(self, user_id: str, bottles: Iterable[Tuple[str, str]]) -> Subscription:
+        """bottles: (device_id, bottle_id)，用來把裝置的上下線事件轉給這個使用者。"""
+        subscription = Subscription(user_id, self.queue_size)
+        self._subscribers.setdefault(user_id, set()).add(subscription)
+        for device_id, bottle_id in bottles:
+            self._track(user_id, str(device_id), str(bottle_id))
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        user_id = subscription.user_id
+        subscriptions = self._subscribers.get(user_id)
+        if subscriptions is None:
+            return
+        subscriptions.discard(subscription)
+        if subscriptions:
+            return
+        del self._subscribers[user_id]
+        for device_id in self._user_devices.pop(user_id, {}):
+            users = self._device_users.get(device_id)
+            if users is not None:
+                users.discard(user_id)
+                if not users:
+                    del self._device_users[device_id]
+
+    def _track(self, user_id: str, device_id: str, bottle_id: str):
+        self._user_devices.setdefault(user_id, {})[device_id] = bottle_id
+        self._device_users.setdefault(device_id, set()).add(user_id)
+
+    def publish(self, user_id: str, event: str, data: Dict):
+        for subscription in self._subscribers.get(user_id, ()):
+            subscription.put(event, data)
+            self.published += 1
+
+    def publish_status(self, bottle: Dict, snapshot: Dict):
+        user_id = bottle.get("user_id")
+        if user_id not in self._subscribers:
+            return
+        # 訂閱之後才建立的 bottle 也要收到上下線事件
+        self._track(user_id, str(bottle["device_id"]), str(bottle["id"]))
+        self.publish(user_id, "status", status_delta(bottle["id"], snapshot))
+
+    def on_presence(self, device_id: str, online: bool):
+        for user_id in list(self._device_users.get(device_id, ())):
+            bottle_id = self._user_devices[user_id][device_id]
+            self.publish(user_id, "connection", {"id": bottle_id, "isConnected": online})
+
+    def stats(self) -> Dict:
+        return {
+            "users": len(self._subscribers),
+            "connections": sum(len(subscriptions) for subscriptions in self._subscribers.values()),
+            "devices": len(self._device_users),
+            "published": self.published,
+        }
+
+
+_hub: Optional[BottleEventHub] = None
+_hub_lock = threading.Lock()
+
+
+def get_hub(settings: Settings) -> BottleEventHub:
+    global _hub
+    if _hub is None:
+        with _hub_lock:
+            if _hub is None:
+                _hub = BottleEventHub(settings)
+                get_presence(settings).add_listener(_hub.on_presence)
+    return _hub
+
+
+async def stream_events(hub: BottleEventHub, subscription: Subscription, expires_at: Optional[float], keepalive: float):
+    """SSE body：沒有事件時定期送註解行，讓 proxy 不會切斷、也能及早發現 client 已離線。
+
+    access token 過期就結束，client 用新的 token 重新連線。
+    """
+    try:
+        yield b"retry: 3000\n\n"
+        while True:
+            timeout = keepalive
+            if expires_at:
+                remaining = expires_at - time.time()
+                if remaining <= 0:
+                    yield format_event("expired", {})
+                    return
+                timeout = min(timeout, remaining)
+            try:
+                event, data = await asyncio.wait_for(subscription.queue.get(), timeout=timeout)
+            except asyncio.TimeoutError:
+                yield b": keepalive\n\n"
+                continue
+            yield format_event(event, data)
+    finally:
+        hub.unsubscribe(subscription)
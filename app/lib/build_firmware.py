@@ -1,58 +1,138 @@
 import glob
 import os
 import subprocess
-from app.core.config import Settings
+import threading
+import hashlib
+from typing import Dict, Iterator, Optional
+from app.core.config import Settings, get_settings
+from app.lib.firmware_patch import patch_firmware, secrets_template
 import time
 import shutil
+import queue
+import zipfile
+from contextlib import contextmanager
 
 # --- 設定區 ---
 SKETCH_NAME = "zhen_plus_camera"
 DOCKER_IMAGE = "esp32-builder"
 
+# 每個 slot 有自己的 workspace (sketch 複本 + build path + 輸出目錄)，slot 數量 = 可同時編譯的數量
+_slots: "queue.Queue[int] | None" = None
+_slots_lock = threading.Lock()
+_template_lock = threading.Lock()
+
+_ZIP_IGNORE = shutil.ignore_patterns('.git', '.github', '__pycache__', 'build', 'device-files', '*.zip', 'node_modules')
+_zip_cache_lock = threading.Lock()
+_zip_cache: "list | None" = None
+
+def secrets_values(WIFI_SSID: str = "", WIFI_PASSWORD: str = "", AWS_IOT_ENDPOINT: str = "", DEVICE_ID: str = "", CERT_CA: str = "", CERT_CRT: str = "", CERT_PRIVATE: str = "") -> Dict[str, str]:
+    # key 與 secrets.h 裡的變數名稱相同
+    return {
+        "WIFI_SSID": WIFI_SSID.replace(' ', '').replace('\n', ''),
+        "WIFI_PASSWORD": WIFI_PASSWORD.replace(' ', '').replace('\n', ''),
+        "AWS_IOT_ENDPOINT": AWS_IOT_ENDPOINT.replace(' ', '').replace('\n', ''),
+        "DEVICE_ID": DEVICE_ID.replace(' ', '').replace('\n', ''),
+        "AWS_CERT_CA": f"\n{CERT_CA.strip()}\n",
+        "AWS_CERT_CRT": f"\n{CERT_CRT.strip()}\n",
+        "AWS_CERT_PRIVATE": f"\n{CERT_PRIVATE.strip()}\n",
+    }
+
 def put_data(WIFI_SSID: str = "", WIFI_PASSWORD: str = "", AWS_IOT_ENDPOINT: str = "", DEVICE_ID: str = "", CERT_CA: str = "", CERT_CRT: str = "", CERT_PRIVATE: str = "") -> str:
-    WIFI_SSID = WIFI_SSID.replace(' ', '').replace('\n', '')
-    WIFI_PASSWORD = WIFI_PASSWORD.replace(' ', '').replace('\n', '')
-    AWS_IOT_ENDPOINT = AWS_IOT_ENDPOINT.replace(' ', '').replace('\n', '')
-    DEVICE_ID = DEVICE_ID.replace(' ', '').replace('\n', '')
-    CERT_CA = CERT_CA.strip()
-    CERT_CRT = CERT_CRT.strip()
-    CERT_PRIVATE = CERT_PRIVATE.strip()
+    values = secrets_values(WIFI_SSID, WIFI_PASSWORD, AWS_IOT_ENDPOINT, DEVICE_ID, CERT_CA, CERT_CRT, CERT_PRIVATE)
     # (保持原樣，產生 secrets.h 內容)
     return f"""#ifndef SECRETS_H  
 #define SECRETS_H
 #include <pgmspace.h>
 
-const char WIFI_SSID[] = "{WIFI_SSID}";
-const char WIFI_PASSWORD[] = "{WIFI_PASSWORD}";
-const char AWS_IOT_ENDPOINT[] = "{AWS_IOT_ENDPOINT}";
-const char DEVICE_ID[] = "{DEVICE_ID}";
+const char WIFI_SSID[] = "{values['WIFI_SSID']}";
+const char WIFI_PASSWORD[] = "{values['WIFI_PASSWORD']}";
+const char AWS_IOT_ENDPOINT[] = "{values['AWS_IOT_ENDPOINT']}";
+const char DEVICE_ID[] = "{values['DEVICE_ID']}";
 
-static const char AWS_CERT_CA[] PROGMEM = R"EOF(
-{CERT_CA}
-)EOF";
+static const char AWS_CERT_CA[] PROGMEM = R"EOF({values['AWS_CERT_CA']})EOF";
 
-static const char AWS_CERT_CRT[] PROGMEM = R"EOF(
-{CERT_CRT}
-)EOF";
+static const char AWS_CERT_CRT[] PROGMEM = R"EOF({values['AWS_CERT_CRT']})EOF";
 
-static const char AWS_CERT_PRIVATE[] PROGMEM = R"EOF(
-{CERT_PRIVATE}
-)EOF";
+static const char AWS_CERT_PRIVATE[] PROGMEM = R"EOF({values['AWS_CERT_PRIVATE']})EOF";
 #endif
 """
 
-def run_build(device_id: str, secrets_content: str, settings=Settings()):
+def available_cores() -> int:
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+def _build_slots(settings: Settings) -> "queue.Queue[int]":
+    global _slots
+    with _slots_lock:
+        if _slots is None:
+            _slots = queue.Queue()
+            for slot in range(settings.FIRMWARE_BUILD_WORKERS or available_cores()):
+                _slots.put(slot)
+    return _slots
+
+def _link_or_copy(src: str, dst: str):
+    # hard link 不用複製內容；跨檔案系統時退回一般複製
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+@contextmanager
+def _workspace(settings: Settings):
+    """借用一個 slot，回傳 (workspace, build path)，用完歸還。"""
+    slots = _build_slots(settings)
+    slot = slots.get()
+    try:
+        yield (
+            os.path.join(settings.FIRMWARE_WORKSPACE_PATH, str(slot)),
+            os.path.join(settings.FIRMWARE_BUILD_PATH, str(slot)),
+        )
+    finally:
+        slots.put(slot)
+
+def _prepare_workspace(workspace: str, secrets_content: str) -> str:
+    sketch_dir = os.path.join(workspace, SKETCH_NAME)
+    if os.path.exists(sketch_dir):
+        shutil.rmtree(sketch_dir)
+
+    if os.path.exists(SKETCH_NAME):
+        # secrets.h 一定要另外寫新檔，不能寫進 hard link (會改到原始碼目錄)
+        shutil.copytree(
+            SKETCH_NAME,
+            sketch_dir,
+            ignore=shutil.ignore_patterns('.git', '.github', '__pycache__', 'build', 'device-files', '*.zip', 'node_modules', 'secrets.h'),
+            copy_function=_link_or_copy,
+        )
+    else:
+        os.makedirs(sketch_dir)
+
+    with open(os.path.join(sketch_dir, "secrets.h"), "w", encoding="utf-8") as f:
+        f.write(secrets_content)
+    return sketch_dir
+
+def run_build(device_id: str, secrets_content: str, settings: Optional[Settings] = None):
+    settings = settings or get_settings()
+    with _workspace(settings) as (workspace, build_path):
+        return _run_build(device_id, secrets_content, workspace, build_path, settings)
+
+def _run_build(device_id: str, secrets_content: str, workspace: str, build_path: str, settings: Settings):
     # 0. 準備目標資料夾路徑
     target_dir = os.path.join(settings.FILE_FOLDER, device_id)
     os.makedirs(target_dir, exist_ok=True) # 自動建立 device-files/{device_id}/
 
-    # 1. 確保原始碼目錄存在並寫入 secrets.h
-    if not os.path.exists(SKETCH_NAME):
-        os.makedirs(SKETCH_NAME)
-    
-    with open(f"{SKETCH_NAME}/secrets.h", "w", encoding="utf-8") as f:
-        f.write(secrets_content)
-    print(f"[{device_id}] 已更新 secrets.h")
+    # 持久化的 build path / core 快取：只有 include secrets.h 的檔案會重新編譯，其餘沿用上次的 .o
+    os.makedirs(build_path, exist_ok=True)
+    os.makedirs(settings.FIRMWARE_BUILD_CACHE_PATH, exist_ok=True)
+
+    # 1. 在這個 slot 的 workspace 建立原始碼複本並寫入 secrets.h
+    sketch_dir = _prepare_workspace(workspace, secrets_content)
+    output_dir = os.path.join(workspace, "build")
+    if os.path.exists(output_dir):
+        shutil.rmtree(output_dir)
+    os.makedirs(output_dir)
+    print(f"[{device_id}] 已更新 secrets.h ({workspace})")
 
     # 3. 使用 Docker 同時進行編譯與合併
     # 我們將合併指令也寫入 Docker 執行序列
@@ -60,13 +140,15 @@ def run_build(device_id: str, secrets_content: str, settings=Settings()):
     
     # 這裡我們用 bash 串聯多個指令：編譯 -> 合併
     docker_shell_cmd = (
-        f"arduino-cli compile --fqbn esp32:esp32:esp32cam --output-dir ./build {SKETCH_NAME} && "
+        f"arduino-cli compile --fqbn esp32:esp32:esp32cam "
+        f"--build-path {build_path} --build-cache-path {settings.FIRMWARE_BUILD_CACHE_PATH} "
+        f"--output-dir {output_dir} {sketch_dir} && "
         f"python3 -m esptool --chip esp32 merge_bin "
-        f"-o ./build/{output_filename} "
+        f"-o {output_dir}/{output_filename} "
         f"--flash_mode dio --flash_size 4MB "
-        f"0x1000 ./build/{SKETCH_NAME}.ino.bootloader.bin "
-        f"0x8000 ./build/{SKETCH_NAME}.ino.partitions.bin "
-        f"0x10000 ./build/{SKETCH_NAME}.ino.bin"
+        f"0x1000 {output_dir}/{SKETCH_NAME}.ino.bootloader.bin "
+        f"0x8000 {output_dir}/{SKETCH_NAME}.ino.partitions.bin "
+        f"0x10000 {output_dir}/{SKETCH_NAME}.ino.bin"
     )
 
     is_running_in_modal = os.environ.get("MODAL_IMAGE_ID") is not None
@@ -91,11 +173,10 @@ def run_build(device_id: str, secrets_content: str, settings=Settings()):
         subprocess.run(compile_and_merge_cmd, check=True)
 
     # 4. 將產出的檔案從 build 移動到指定的 device-files 目錄
-    source_path = os.path.join("build", output_filename)
+    source_path = os.path.join(output_dir, output_filename)
     target_path = os.path.join(settings.FILE_FOLDER, device_id, output_filename)
     
     if os.path.exists(source_path):
-        import shutil
         shutil.move(source_path, target_path)
         print(f"✅ 完成！檔案已搬移至: {target_path}")
         return os.path.abspath(target_path)
@@ -103,70 +184,138 @@ def run_build(device_id: str, secrets_content: str, settings=Settings()):
         print("❌ 錯誤：Docker 跑完了，但沒看到合併後的檔案。")
         return None
 
-def build_zip(device_id: str, secrets_content: str, settings=Settings()):
-    print(f"📦 [Zip] 開始打包程序: Device ID {device_id}")
+def sketch_fingerprint() -> str:
+    # 原始碼 (不含 secrets.h) 有變動時需要重新編譯 template
+    digest = hashlib.sha256()
+    for root, dirs, files in sorted(os.walk(SKETCH_NAME)):
+        dirs.sort()
+        for name in sorted(files):
+            if name == "secrets.h":
+                continue
+            path = os.path.join(root, name)
+            digest.update(path.encode())
+            with open(path, "rb") as f:
+                digest.update(f.read())
+    return digest.hexdigest()[:16]
 
-    original_sketch_path = os.path.abspath(SKETCH_NAME)
-    temp_root = f"/tmp/build_{device_id}"
-    temp_sketch_path = os.path.join(temp_root, SKETCH_NAME)
-    
-    output_dir = os.path.join(settings.FILE_FOLDER, device_id)
-    zip_base_name = os.path.join(output_dir, device_id)
+def build_patched_firmware(device_id: str, values: Dict[str, str], settings: Optional[Settings] = None):
+    """用預留 secrets 區塊的 template 韌體直接 patch 出裝置的 .bin，不需要重新編譯。
 
-    try:
-        # 1. 清理與複製
-        if os.path.exists(temp_root):
-            shutil.rmtree(temp_root)
-        
-        shutil.copytree(
-            original_sketch_path, 
-            temp_sketch_path,
-            ignore=shutil.ignore_patterns('.git', '.github', '__pycache__', 'build', 'device-files', '*.zip', 'node_modules')
-        )
+    template 依原始碼 fingerprint 快取在 FILE_FOLDER/_template/，第一次 (或原始碼變動後) 才會編譯。
+    """
+    settings = settings or get_settings()
+    template_id = f"_template_{sketch_fingerprint()}"
+    template_path = os.path.join(settings.FILE_FOLDER, template_id, f"{template_id}.bin")
 
-        # 2. 寫入 secrets.h
-        secrets_file_path = os.path.join(temp_sketch_path, "secrets.h")
-        with open(secrets_file_path, "w", encoding="utf-8") as f:
-            f.write(secrets_content)
-
-        # ==========================================
-        # 🕒 關鍵修正：強制更新檔案時間戳記
-        # ==========================================
-        print("🕒 正在修正所有檔案與資料夾的時間戳記...")
-        now = time.time()
-        
-        # 1. 先修正主資料夾本身
-        os.utime(temp_sketch_path, (now, now))
-        
-        # 2. 遍歷修正內容（包含 root 目錄本身）
-        for root, dirs, files in os.walk(temp_sketch_path):
-            for item in dirs + files:
-                full_path = os.path.join(root, item)
-                try:
-                    os.utime(full_path, (now, now))
-                except Exception:
-                    pass # 防止極少數權限問題導致中斷
-        # ==========================================
-
-        # 3. 壓縮
-        os.makedirs(output_dir, exist_ok=True)
-
-        shutil.make_archive(
-            base_name=zip_base_name, 
-            format='zip', 
-            root_dir=temp_root, 
-            base_dir=SKETCH_NAME
-        )
-        
-        final_zip_path = f"{zip_base_name}.zip"
-        print(f"✅ [Zip] 打包成功: {final_zip_path}")
-        return os.path.abspath(final_zip_path)
+    if not os.path.exists(template_path):
+        with _template_lock:
+            if not os.path.exists(template_path):
+                print(f"[{template_id}] 編譯 template 韌體...")
+                if not run_build(template_id, secrets_template(), settings):
+                    return None
+                # 原始碼已變動，zip 下載的 template 也要重新讀取
+                invalidate_zip_template()
 
-    except Exception as e:
-        print(f"❌ [Zip] 打包失敗: {str(e)}")
-        raise e
+    with open(template_path, "rb") as f:
+        firmware = patch_firmware(f.read(), values)
 
-    finally:
-        if os.path.exists(temp_root):
-            shutil.rmtree(temp_root)
-            print("🧹 [Zip] 暫存區已清理")
+    target_dir = os.path.join(settings.FILE_FOLDER, device_id)
+    os.makedirs(target_dir, exist_ok=True)
+    target_path = os.path.join(target_dir, f"{device_id}.bin")
+    tmp_path = f"{target_path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(firmware)
+    os.replace(tmp_path, target_path)
+    print(f"✅ 完成！已由 template patch 產生: {target_path}")
+    return os.path.abspath(target_path)
+
+def save_secrets(device_id: str, secrets_content: str, settings: Optional[Settings] = None):
+    settings = settings or get_settings()
+    # zip 下載時才組合，裝置目錄只保留 secrets.h
+    target_dir = os.path.join(settings.FILE_FOLDER, device_id)
+    os.makedirs(target_dir, exist_ok=True)
+    target_path = os.path.join(target_dir, "secrets.h")
+    tmp_path = f"{target_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(secrets_content)
+    os.replace(tmp_path, target_path)
+    return os.path.abspath(target_path)
+
+def _sketch_entries():
+    # 回傳 (zip 內路徑, 實際路徑)，資料夾以 / 結尾
+    entries = []
+    for root, dirs, files in os.walk(SKETCH_NAME):
+        ignored = _ZIP_IGNORE(root, dirs + files)
+        dirs[:] = sorted(d for d in dirs if d not in ignored)
+        entries.append((f"{root}/", root))
+        for name in sorted(files):
+            if name in ignored or name == "secrets.h":
+                continue
+            path = os.path.join(root, name)
+            entries.append((path, path))
+    return entries
+
+def _zip_template():
+    """原始碼 (不含 secrets.h) 第一次下載時讀進記憶體，之後直接沿用；原始碼更新 (重新編譯 template) 時才清掉。"""
+    global _zip_cache
+    if _zip_cache is not None:
+        return _zip_cache
+
+    with _zip_cache_lock:
+        if _zip_cache is None:
+            files = []
+            for arcname, path in _sketch_entries():
+                if arcname.endswith("/"):
+                    files.append((arcname, b""))
+                else:
+                    with open(path, "rb") as f:
+                        files.append((arcname, f.read()))
+            _zip_cache = files
+            print(f"📦 [Zip] 已載入原始碼 template ({len(files)} 個項目)")
+        return _zip_cache
+
+def invalidate_zip_template():
+    global _zip_cache
+    with _zip_cache_lock:
+        _zip_cache = None
+
+class _ZipStream:
+    # 不支援 seek/tell，zipfile 會改用 data descriptor 寫入，可以邊壓縮邊送出
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+def _zip_info(arcname: str, date_time) -> zipfile.ZipInfo:
+    info = zipfile.ZipInfo(arcname, date_time=date_time)
+    if arcname.endswith("/"):
+        info.external_attr = (0o40755 << 16) | 0x10
+    else:
+        info.external_attr = 0o644 << 16
+        info.compress_type = zipfile.ZIP_DEFLATED
+    return info
+
+def stream_zip(secrets_content: str) -> Iterator[bytes]:
+    """產生原始碼 zip 串流：template 檔案 + 這台裝置的 secrets.h，時間戳記一律設為下載當下。"""
+    entries = _zip_template()
+    # Arduino IDE 會因為舊的時間戳記沿用快取，所以每個項目都用現在時間
+    date_time = time.localtime()[:6]
+
+    stream = _ZipStream()
+    with zipfile.ZipFile(stream, "w") as zf:
+        for arcname, data in entries:
+            zf.writestr(_zip_info(arcname, date_time), data)
+            yield stream.pop()
+        zf.writestr(_zip_info(f"{SKETCH_NAME}/secrets.h", date_time), secrets_content)
+        yield stream.pop()
+    yield stream.pop()
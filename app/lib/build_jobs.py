@@ -0,0 +1,146 @@
+import asyncio
+import logging
+import os
+import socket
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, Optional
+from uuid import uuid4
+
+from botocore.exceptions import ClientError
+
+from app.core.config import Settings
+from app.core.repository import build_job_table
+from app.lib.build_firmware import available_cores, build_patched_firmware, run_build, save_secrets
+from app.models.bottle import BuildJob, Status
+
+logger = logging.getLogger(__name__)
+
+# 編譯在這個 process 內的 asyncio task 執行；重新啟動後狀態停在 pending / in_progress 的工作靠 heartbeat 判斷
+INSTANCE_ID = f"{socket.gethostname()}:{os.getpid()}"
+ACTIVE_STATUSES = (Status.PENDING, Status.IN_PROGRESS)
+
+
+class BuildQueue:
+    """韌體編譯排程：API 只負責排入工作，編譯在固定大小的 worker pool 跑，狀態寫入 build_job。
+
+    工作排隊與編譯期間每 BUILD_JOB_HEARTBEAT 秒更新 updated_at；
+    process 結束後 heartbeat 停止，get_build_job 會把超過 BUILD_JOB_STALE_AFTER 的工作標成失敗。
+    產生的 .bin / secrets.h 寫在本機 FILE_FOLDER，多個 instance 時必須是共用的 volume。
+    """
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="firmware-build")
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._tasks = set()
+
+    async def submit(self, user_id: str, device_id: str, secrets_content: str, secrets: Dict[str, str], settings: Settings) -> BuildJob:
+        job = BuildJob(id=str(uuid4()), user_id=user_id, device_id=device_id, instance=INSTANCE_ID)
+        await build_job_table.put_item(Item=job.dict())
+
+        task = asyncio.create_task(self._run(job, secrets_content, secrets, settings))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return job
+
+    async def _set_status(self, job_id: str, status: Status, error: Optional[str] = None):
+        await build_job_table.update_item(
+            Key={"id": job_id},
+            UpdateExpression="SET #status = :status, #error = :error, updated_at = :now",
+            ExpressionAttributeNames={"#status": "status", "#error": "error"},
+            ExpressionAttributeValues={
+                ":status": status.value,
+                ":error": error,
+                ":now": int(datetime.now().timestamp()),
+            },
+        )
+
+    async def _heartbeat(self, job_id: str, interval: int):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await build_job_table.update_item(
+                    Key={"id": job_id},
+                    UpdateExpression="SET updated_at = :now",
+                    ConditionExpression="#status IN (:pending, :running)",
+                    ExpressionAttributeNames={"#status": "status"},
+                    ExpressionAttributeValues={
+                        ":now": int(datetime.now().timestamp()),
+                        ":pending": Status.PENDING.value,
+                        ":running": Status.IN_PROGRESS.value,
+                    },
+                )
+            except ClientError as e:
+                if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                    logger.warning(f"build job {job_id} heartbeat 失敗: {e}")
+
+    async def _run(self, job: BuildJob, secrets_content: str, secrets: Dict[str, str], settings: Settings):
+        heartbeat = asyncio.create_task(self._heartbeat(job.id, settings.BUILD_JOB_HEARTBEAT))
+        try:
+            await self._build(job, secrets_content, secrets, settings)
+        finally:
+            heartbeat.cancel()
+
+    async def _build(self, job: BuildJob, secrets_content: str, secrets: Dict[str, str], settings: Settings):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.workers)
+
+        loop = asyncio.get_running_loop()
+        async with self._slots:
+            try:
+                await self._set_status(job.id, Status.IN_PROGRESS)
+                if settings.FIRMWARE_PATCH_MODE:
+                    res_bin_path = await loop.run_in_executor(self._executor, build_patched_firmware, job.device_id, secrets, settings)
+                else:
+                    res_bin_path = await loop.run_in_executor(self._executor, run_build, job.device_id, secrets_content, settings)
+                if not res_bin_path:
+                    raise Exception("請先建立專案目錄並放入程式碼。")
+                await loop.run_in_executor(self._executor, save_secrets, job.device_id, secrets_content, settings)
+            except Exception as e:
+                logger.exception(f"[{job.device_id}] 韌體編譯失敗")
+                await self._set_status(job.id, Status.FAILED, error=str(e))
+                return
+        await self._set_status(job.id, Status.COMPLETED)
+        logger.info(f"[{job.device_id}] 韌體編譯完成 (job {job.id})")
+
+
+_queue: Optional[BuildQueue] = None
+
+
+def get_build_queue(settings: Settings) -> BuildQueue:
+    global _queue
+    if _queue is None:
+        _queue = BuildQueue(settings.FIRMWARE_BUILD_WORKERS or available_cores())
+    return _queue
+
+
+async def get_build_job(job_id: str, settings: Settings) -> Optional[BuildJob]:
+    item = (await build_job_table.get_item(Key={"id": job_id})).get("Item", None)
+    if not item:
+        return None
+    job = BuildJob(**item)
+    if job.status in ACTIVE_STATUSES and datetime.now().timestamp() - job.updated_at > settings.BUILD_JOB_STALE_AFTER:
+        job = await _fail_orphaned(job)
+    return job
+
+
+async def _fail_orphaned(job: BuildJob) -> BuildJob:
+    # heartbeat 停了：負責的 process 已經結束 (重新部署 / crash)，工作不會再完成
+    error = f"編譯中斷：負責的伺服器 ({job.instance or '未知'}) 已停止，請重新建立。"
+    now = int(datetime.now().timestamp())
+    try:
+        await build_job_table.update_item(
+            Key={"id": job.id},
+            UpdateExpression="SET #status = :failed, #error = :error, updated_at = :now",
+            ConditionExpression="updated_at = :seen",
+            ExpressionAttributeNames={"#status": "status", "#error": "error"},
+            ExpressionAttributeValues={":failed": Status.FAILED.value, ":error": error, ":now": now, ":seen": job.updated_at},
+        )
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+            raise
+        # 同時有 heartbeat 或狀態更新，以資料庫為準
+        item = (await build_job_table.get_item(Key={"id": job.id}, ConsistentRead=True)).get("Item")
+        return BuildJob(**item) if item else job
+    return job.model_copy(update={"status": Status.FAILED, "error": error, "updated_at": now})
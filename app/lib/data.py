@@ -1,11 +1,17 @@
 from app.core.config import Settings
-from typing import Optional, Dict
-
+from app.core.upstream import get_session
+from app.lib.state_cache import get_record_cache, get_state_cache
+from typing import Optional, Dict, List, Tuple
+
+import asyncio
+import anyio
+import base64
+import json
 import os
-import requests
+import time
 
 def device_is_connected(device_id: str, settings: Settings) -> bool:
-    response = requests.get(f'{settings.DATA_URL}/iot/devices/{device_id}/connection')
+    response = get_session(settings).get(f'{settings.DATA_URL}/iot/devices/{device_id}/connection')
     if response.status_code != 200:
         return False
     data = response.json()
@@ -14,34 +20,18 @@ def device_is_connected(device_id: str, settings: Settings) -> bool:
     return False
 
 def find_bottle_and_env_state(bottle_id: int, env_id: int, settings: Settings):
-    detect_record_states = requests.get(f'{settings.DATA_URL}/db/device_record_states')
-    detect_record_states = detect_record_states.json()
-    detect_record_states = detect_record_states.get("detect_record_states", [])
-
-    bottle_state, env_state = {}, {}
-
-    for drs in detect_record_states:
-        if drs['detect_record_state_id'] == bottle_id:
-            bottle_state = drs
-        if drs['detect_record_state_id'] == env_id:
-            env_state = drs
-    return bottle_state, env_state
+    state = get_state_cache(settings)
+    return state.get(bottle_id), state.get(env_id)
 
 def find_all_bottle_and_env_state(settings: Settings):
-    detect_record_states = requests.get(f'{settings.DATA_URL}/db/device_record_states')
-    detect_record_states = detect_record_states.json()
-    detect_record_states = detect_record_states.get("detect_record_states", [])
-
-    return detect_record_states
+    return get_state_cache(settings)
 
 def find_bottle_state(state, bottle_id: int):
-    bottle_state = {}
+    return state.get(bottle_id)
 
-    for drs in state:
-        if drs['detect_record_state_id'] == bottle_id:
-            bottle_state = drs
-            return bottle_state
-    return {}
+def find_bottle_states(bottle_ids: List[str], settings: Settings) -> List[Dict]:
+    state = get_state_cache(settings)
+    return [state.get(bottle_id) for bottle_id in bottle_ids]
 
 
 
@@ -59,10 +49,8 @@ def find_bottle_state(state, bottle_id: int):
 #     return None
 
 def get_last_detect_record(device_id: str, settings: Settings):
-    detect_record = requests.get(f'{settings.DATA_URL}/db/devices/{device_id}/detect_records')
-    detect_record = detect_record.json()
-    detect_record = detect_record.get("detect_records", [])
-    detect_record = detect_record[-1] if detect_record else None
+    detect_record, _ = get_bottle_detect_state_page(device_id, 1, None, settings)
+    detect_record = detect_record[0] if detect_record else None
 
     if detect_record:
         bottle_state, env_state = find_bottle_and_env_state(detect_record['bottleStateID'], detect_record.get('envStateID', ''), settings)
@@ -72,17 +60,125 @@ def get_last_detect_record(device_id: str, settings: Settings):
 
     return None
 
+async def get_last_detect_records_and_device_infos(device_ids: List[str], settings: Settings) -> List[Tuple[Optional[Dict], Dict]]:
+    # 每個 device 的兩個請求同時送出，同時進行的呼叫數量以 UPSTREAM_CONCURRENCY 為上限
+    limiter = anyio.CapacityLimiter(settings.UPSTREAM_CONCURRENCY)
+
+    async def call(fn, device_id):
+        return await anyio.to_thread.run_sync(fn, device_id, settings, limiter=limiter)
+
+    records, infos = await asyncio.gather(
+        asyncio.gather(*[call(get_last_detect_record, device_id) for device_id in device_ids]),
+        asyncio.gather(*[call(get_device_info, device_id) for device_id in device_ids]),
+    )
+    return list(zip(records, infos))
+
+async def devices_are_connected(device_ids: List[str], settings: Settings) -> Dict[str, Optional[bool]]:
+    # presence 不知道的裝置才逐一問上游，同時進行的呼叫數量以 UPSTREAM_CONCURRENCY 為上限；查詢失敗回傳 None
+    limiter = anyio.CapacityLimiter(settings.UPSTREAM_CONCURRENCY)
+
+    async def call(device_id):
+        try:
+            return await anyio.to_thread.run_sync(device_is_connected, device_id, settings, limiter=limiter)
+        except Exception:
+            return None
+
+    results = await asyncio.gather(*[call(device_id) for device_id in device_ids])
+    return dict(zip(device_ids, results))
+
 def get_bottle_detect_state_history(device_id: str, s: Optional[int], e: Optional[int], settings: Settings):
     params = {}
     if s is not None:
         params['s'] = s
     if e is not None:
         params['e'] = e
-    detect_records = requests.get(f'{settings.DATA_URL}/db/devices/{device_id}/detect_records', params=params)
+    detect_records = get_session(settings).get(f'{settings.DATA_URL}/db/devices/{device_id}/detect_records', params=params)
     detect_records = detect_records.json()
     detect_records = detect_records.get("detect_records", [])
     return detect_records
 
+def encode_history_cursor(record: Dict) -> str:
+    raw = json.dumps([record['detectTime'], record['detect_record_id']]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_history_cursor(cursor: str) -> Tuple[float, str]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        detect_time, detect_record_id = json.loads(raw)
+        return float(detect_time), str(detect_record_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+# 資料服務不支援 order / limit / before 時改成整份歷史在本地分頁；
+# 偵測到之後 HISTORY_PAGING_RETRY 秒內不再嘗試 (monotonic 時間)
+_page_params_retry_at = 0.0
+
+
+def _history_key(record: Dict) -> Tuple[float, str]:
+    return (record['detectTime'], record['detect_record_id'])
+
+
+def _is_requested_page(scans: List[Dict], limit: int, position: Optional[Tuple[float, str]]) -> bool:
+    """回應是否真的是要求的那一頁：筆數不超過 limit + 1、由新到舊、都在游標之前。"""
+    if len(scans) > limit + 1:
+        return False
+    keys = [_history_key(x) for x in scans]
+    if any(a <= b for a, b in zip(keys, keys[1:])):
+        return False
+    return not position or all(key < position for key in keys)
+
+
+def _page_params_supported() -> bool:
+    return time.monotonic() >= _page_params_retry_at
+
+
+def _page_from_full_history(device_id: str, limit: int, position: Optional[Tuple[float, str]], offset: Optional[int], settings: Settings) -> List[Dict]:
+    scans = get_bottle_detect_state_history(device_id, None, None, settings)
+    scans.sort(key=_history_key, reverse=True)
+    if position:
+        scans = [x for x in scans if _history_key(x) < position]
+    elif offset:
+        scans = scans[offset:]
+    return scans[:limit + 1]
+
+
+def get_bottle_detect_state_page(device_id: str, limit: int, cursor: Optional[str], settings: Settings, offset: Optional[int] = None) -> Tuple[List[Dict], Optional[str]]:
+    """由新到舊取一頁 (多要一筆用來判斷是否還有下一頁)。
+
+    資料服務忽略分頁參數時 (回傳筆數過多、順序不對或游標之後的紀錄)，
+    改成抓整份歷史在本地排序分頁，和分頁功能上線前的成本相同。
+    offset (舊版 s/e) 無法從回應判斷有沒有被套用，所以改要最新的 offset + limit + 1 筆再在本地切。
+    """
+    global _page_params_retry_at
+    position = decode_history_cursor(cursor) if cursor else None
+    skip = 0 if position else (offset or 0)
+
+    scans = None
+    if _page_params_supported():
+        params = {"order": "desc", "limit": skip + limit + 1}
+        if position:
+            params['before'], params['before_id'] = position
+
+        response = get_session(settings).get(f'{settings.DATA_URL}/db/devices/{device_id}/detect_records', params=params)
+        scans = response.json().get("detect_records", [])
+        if _is_requested_page(scans, skip + limit, position):
+            scans = scans[skip:]
+        else:
+            _page_params_retry_at = time.monotonic() + settings.HISTORY_PAGING_RETRY
+            scans = None
+
+    if scans is None:
+        scans = _page_from_full_history(device_id, limit, position, offset, settings)
+
+    next_cursor = encode_history_cursor(scans[limit - 1]) if len(scans) > limit else None
+    scans = scans[:limit]
+
+    record_cache = get_record_cache(settings)
+    for scan in scans:
+        record_cache.put(device_id, scan)
+
+    return scans, next_cursor
+
 def split_all_detect_state_history(all_scans, s: Optional[int], e: Optional[int], settings: Settings):
     all_scans.sort(key=lambda x: x['detectTime'], reverse=True)
 
@@ -91,26 +187,53 @@ def split_all_detect_state_history(all_scans, s: Optional[int], e: Optional[int]
 
     return scans
 
+def get_detect_record(device_id: str, detect_record_id: str, settings: Settings) -> Optional[Dict]:
+    record_cache = get_record_cache(settings)
+    record = record_cache.get(device_id, detect_record_id)
+    if record is not None:
+        return record
+
+    response = get_session(settings).get(f'{settings.DATA_URL}/db/devices/{device_id}/detect_records/{detect_record_id}')
+    if response.status_code in (404, 405):
+        # 資料服務沒有單筆查詢 (或真的沒有這筆)：和原本一樣抓整份歷史找，順便填進快取
+        return _record_from_full_history(device_id, detect_record_id, settings)
+    if response.status_code != 200:
+        return None
+    record = response.json()
+    if not record or record.get('detect_record_id') != detect_record_id:
+        return None
+
+    record_cache.put(device_id, record)
+    return record
+
+def _record_from_full_history(device_id: str, detect_record_id: str, settings: Settings) -> Optional[Dict]:
+    record_cache = get_record_cache(settings)
+    found = None
+    for record in get_bottle_detect_state_history(device_id, None, None, settings):
+        record_cache.put(device_id, record)
+        if record.get('detect_record_id') == detect_record_id:
+            found = record
+    return dict(found) if found else None
+
 def find_detect_record(device_id: str, detect_record_id: str, settings: Settings):
-    all_records = get_bottle_detect_state_history(device_id, None, None, settings)
-    for record in all_records:
-        if record['detect_record_id'] == detect_record_id:
-            bottle_state, env_state = find_bottle_and_env_state(record['bottleStateID'], record.get('envStateID', ''), settings)
-            record['detect_record_state'] = bottle_state
-            record['env_record_state'] = env_state
-            return record
-    return None
+    record = get_detect_record(device_id, detect_record_id, settings)
+    if not record:
+        return None
+    bottle_state, env_state = find_bottle_and_env_state(record['bottleStateID'], record.get('envStateID', ''), settings)
+    record['detect_record_state'] = bottle_state
+    record['env_record_state'] = env_state
+    return record
 
 def find_all_detect_record_with_detect_record_state(device_id: str, detect_record_id: str, settings: Settings):
     all_records = get_bottle_detect_state_history(device_id, 0, None, settings)
     for record in all_records:
         if record['detect_record_id'] == detect_record_id:
-            bottle_state = find_bottle_state(record['bottleStateID'], settings)
+            bottle_state = find_bottle_state(get_state_cache(settings), record['bottleStateID'])
             record['detect_record_state'] = bottle_state
     return all_records
 
 def get_device_info(device_id: str, settings: Settings):
-    device_info = requests.get(
+    device_info = get_session(settings).get(
         f'{settings.DATA_URL}/db/devices/{device_id}'
     )
     device_info = device_info.json()
@@ -126,7 +249,7 @@ def update_device_info(data: Dict, settings: Settings):
     device_info['detectFreq'] = data.get("detectFreq", device_info.get("detectFreq", 30))
     device_info['name'] = data.get("name", device_info.get("name", ""))
 
-    response = requests.put(
+    response = get_session(settings).put(
         f'{settings.DATA_URL}/db/devices/{data["device_id"]}',
         json=device_info
     )
@@ -144,7 +267,7 @@ def manual_scan_bottle(file, temperature: Optional[int], humidity: Optional[int]
         "humidity": humidity if humidity else 0,
     }
 
-    response = requests.post(
+    response = get_session(settings).post(
         f'{settings.DATA_URL}/db/manual_detect_records',
         files=files,
         data=data,
@@ -152,11 +275,14 @@ def manual_scan_bottle(file, temperature: Optional[int], humidity: Optional[int]
     response = response.json()
     print(response)
 
+    # 新的掃描會寫入新的 state，讓下一次查詢重新載入
+    get_state_cache(settings).invalidate()
+
     return response
 
 def create_new_device(device_id: str, name: str, freq: int, settings: Settings) -> Dict:
 
-    response = requests.post(
+    response = get_session(settings).post(
         f'{settings.DATA_URL}/db/devices',
         json={
             "device_id": device_id,
@@ -192,7 +318,7 @@ def update_device_all_info(device_id: str, name: str, freq: int, endpoint: str,
     device_info.pop('device_id', None)
     device_info.pop('lastEditTime', None)
 
-    response = requests.put(
+    response = get_session(settings).put(
         f'{settings.DATA_URL}/db/devices/{device_id}',
         json=device_info
     )
@@ -200,14 +326,14 @@ def update_device_all_info(device_id: str, name: str, freq: int, endpoint: str,
 
 def manual_device_shot(device_id: str, settings: Settings) -> bool:
 
-    response = requests.post(
+    response = get_session(settings).post(
         f'{settings.DATA_URL}/iot/devices/{device_id}/manual_trigger'
     )
     print(response)
     return response.status_code == 200
 
 def device_connect_check(device_id: str, settings: Settings) -> bool:
-    response = requests.get(f'{settings.DATA_URL}/iot/devices/{device_id}/connection')
+    response = get_session(settings).get(f'{settings.DATA_URL}/iot/devices/{device_id}/connection')
     if response.status_code != 200:
         return False
     data = response.json()
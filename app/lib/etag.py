@@ -0,0 +1,33 @@
+import hashlib
+import json
+from typing import Optional
+
+from fastapi import Response
+
+# 回應依使用者而不同，只允許 client 自己快取，每次都要帶 If-None-Match 回來確認
+CACHE_CONTROL = "private, no-cache"
+
+
+def make_etag(*parts) -> str:
+    """由資料的版本欄位 (detect_record_id、edited_at ...) 算出 strong ETag，不需要先組出 response body。"""
+    raw = json.dumps(parts, default=str, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    return '"' + hashlib.sha1(raw).hexdigest() + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    # If-None-Match 用 weak comparison (RFC 9110 13.1.2)：忽略 W/ 前綴
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": CACHE_CONTROL})
+
+
+def etag_headers(etag: str) -> dict:
+    return {"ETag": etag, "Cache-Control": CACHE_CONTROL}
@@ -1,9 +1,76 @@
 import os
+import tempfile
 from fastapi import UploadFile
 from fastapi.responses import JSONResponse
 from app.core.config import Settings
 from datetime import datetime
-import requests
+from uuid import uuid4
+from typing import BinaryIO, Iterable, Optional
+
+MAX_IMAGE_SIZE = 5 * 1024 * 1024
+MAX_UPLOAD_BODY = MAX_IMAGE_SIZE + 64 * 1024  # 整個 multipart body：圖片加上 boundary / 欄位
+CHUNK_SIZE = 64 * 1024  # 每次讀寫的大小，同時上傳很多張也只佔固定記憶體
+
+# 依檔頭判斷格式，不相信 client 送來的 content type (ESP32 常送 application/octet-stream)
+IMAGE_SIGNATURES = {
+    b"\xff\xd8\xff": "image/jpeg",
+    b"\x89PNG\r\n\x1a\n": "image/png",
+}
+
+
+class FileTooLarge(Exception):
+    pass
+
+
+def sniff_image_type(head: bytes) -> Optional[str]:
+    for signature, content_type in IMAGE_SIGNATURES.items():
+        if head.startswith(signature):
+            return content_type
+    return None
+
+
+def peek_image_type(file: UploadFile) -> Optional[str]:
+    file.file.seek(0)
+    head = file.file.read(16)
+    file.file.seek(0)
+    return sniff_image_type(head)
+
+
+def upload_size(file: UploadFile) -> int:
+    # chunked upload 沒有 size；body 已經 spool 到暫存檔，seek 到結尾就知道大小，不用讀進記憶體
+    if file.size is not None:
+        return file.size
+    position = file.file.tell()
+    size = file.file.seek(0, os.SEEK_END)
+    file.file.seek(position)
+    return size
+
+
+def write_atomic(chunks: Iterable[bytes], path: str, max_size: Optional[int] = None) -> int:
+    """逐段寫到同目錄的暫存檔，完成後 rename 到 path；超過 max_size 會刪掉暫存檔並丟出 FileTooLarge。"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=".upload-")
+    size = 0
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for chunk in chunks:
+                size += len(chunk)
+                if max_size is not None and size > max_size:
+                    raise FileTooLarge(path)
+                f.write(chunk)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return size
+
+
+def _read_chunks(stream: BinaryIO) -> Iterable[bytes]:
+    while True:
+        chunk = stream.read(CHUNK_SIZE)
+        if not chunk:
+            return
+        yield chunk
+
 
 def upload_file_check(file: UploadFile, settings: Settings) -> JSONResponse | None:
     if not os.path.exists(settings.UPLOAD_DIRECTORY):
@@ -14,12 +81,12 @@ def upload_file_check(file: UploadFile, settings: Settings) -> JSONResponse | No
             status_code=400,
             content={"message": "Bad Request: Missing image file"},
         )
-    if file.content_type not in ["image/jpeg", "image/png"]:
+    if peek_image_type(file) is None:
         return JSONResponse(
             status_code=400,
             content={"message": "Bad Request: Invalid image file type"},
         )
-    if file.size > 5 * 1024 * 1024:
+    if upload_size(file) > MAX_IMAGE_SIZE:
         return JSONResponse(
             status_code=400,
             content={"message": "Bad Request: Image file size exceeds limit"},
@@ -43,11 +110,11 @@ def download_file_with_url(uri: str) -> bytes | JSONResponse:
         )
 
 def download_file_requests(url, save_path):
+    import requests
     response = requests.get(url, stream=True)
     response.raise_for_status()  # Check if the download was successful
 
-    with open(save_path, 'wb') as f:
-        f.write(response.content)
+    write_atomic(response.iter_content(chunk_size=CHUNK_SIZE), save_path)
     print(f"File successfully downloaded and saved to {save_path}")
 
 
@@ -63,32 +130,37 @@ def upload_file(user_id: str, file: UploadFile, prefix: str, settings: Settings)
 
     folder_name = datetime.now().strftime("%Y%m%d_%H%M%S")
     scan_folder = os.path.join(user_folder, folder_name)
-    os.makedirs(scan_folder)
+    os.makedirs(scan_folder, exist_ok=True)
  
     if not file:
         return JSONResponse(
             status_code=400,
             content={"message": "Bad Request: Missing image file"},
         )
-    if file.content_type not in ["image/jpeg", "image/png"]:
+    if peek_image_type(file) is None:
         return JSONResponse(
             status_code=400,
             content={"message": "Bad Request: Invalid image file type"},
         )
-    if file.size > 5 * 1024 * 1024:
+    if file.size is not None and file.size > MAX_IMAGE_SIZE:
         return JSONResponse(
             status_code=400,
             content={"message": "Bad Request: Image file size exceeds limit"},
         )
 
     try:
-        file_path = os.path.join(scan_folder, f"{prefix}_{file.filename}")
-        with open(file_path, "wb") as f:
-            f.write(file.file.read())
+        # filename 來自 client，只取檔名避免寫到 scan_folder 外面；同一秒內的上傳以 uuid 區分
+        file_path = os.path.join(scan_folder, f"{prefix}_{uuid4().hex}_{os.path.basename(file.filename or 'image')}")
+        file.file.seek(0)
+        write_atomic(_read_chunks(file.file), file_path, MAX_IMAGE_SIZE)
+    except FileTooLarge:
+        return JSONResponse(
+            status_code=400,
+            content={"message": "Bad Request: Image file size exceeds limit"},
+        )
     except Exception as e:
         return JSONResponse(
             status_code=500,
             content={"message": f"Internal Server Error: Failed to save image file. {str(e)}"},
         )
     return file_path
-        
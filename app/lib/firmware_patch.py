@@ -0,0 +1,104 @@
+import functools
+import hashlib
+import operator
+import struct
+from typing import Dict, List, Tuple
+
+# 與 secrets_template() 產生的 struct 一致，順序與大小都不能改
+SECRETS_MAGIC = b"BIOCHERISH-SECR\x00"
+SECRETS_LAYOUT: List[Tuple[str, int]] = [
+    ("WIFI_SSID", 64),
+    ("WIFI_PASSWORD", 128),
+    ("AWS_IOT_ENDPOINT", 128),
+    ("DEVICE_ID", 128),
+    ("AWS_CERT_CA", 4096),
+    ("AWS_CERT_CRT", 4096),
+    ("AWS_CERT_PRIVATE", 4096),
+]
+SECRETS_SIZE = len(SECRETS_MAGIC) + sum(size for _, size in SECRETS_LAYOUT)
+
+APP_OFFSET = 0x10000  # merge_bin 時 app 的位置
+ESP_IMAGE_MAGIC = 0xE9
+ESP_CHECKSUM_MAGIC = 0xEF
+ESP_HEADER_SIZE = 24  # 8 bytes common header + 16 bytes extended header
+
+
+def secrets_template() -> str:
+    fields = "\n".join(f"    char {name}[{size}];" for name, size in SECRETS_LAYOUT)
+    defines = "\n".join(f"#define {name} (biocherish_secrets()->{name})" for name, _ in SECRETS_LAYOUT)
+    magic = "".join(f"\\x{b:02x}" for b in SECRETS_MAGIC[:-1])
+    return f"""#ifndef SECRETS_H
+#define SECRETS_H
+#include <pgmspace.h>
+
+// 預留固定大小的區塊，部署時直接 patch .bin 內的內容
+struct BiocherishSecrets {{
+    char MAGIC[{len(SECRETS_MAGIC)}];
+{fields}
+}};
+
+__attribute__((used)) static const BiocherishSecrets BIOCHERISH_SECRETS PROGMEM = {{ "{magic}" }};
+
+static inline const BiocherishSecrets* biocherish_secrets() {{
+    const BiocherishSecrets* p = &BIOCHERISH_SECRETS;
+    asm volatile("" : "+r"(p));  // 避免編譯器把內容當常數折疊掉
+    return p;
+}}
+
+{defines}
+#endif
+"""
+
+
+def pack_secrets(values: Dict[str, str]) -> bytes:
+    region = bytearray(SECRETS_MAGIC)
+    for name, size in SECRETS_LAYOUT:
+        raw = values.get(name, "").encode("utf-8")
+        if len(raw) >= size:
+            raise ValueError(f"{name} 超過預留長度 {size - 1} bytes")
+        region += raw.ljust(size, b"\x00")
+    return bytes(region)
+
+
+def _image_layout(image: bytearray, offset: int) -> Tuple[List[Tuple[int, int]], int, bool]:
+    """回傳 (segment 資料範圍, checksum 位置, 是否附加 SHA256)。"""
+    magic, segment_count = image[offset], image[offset + 1]
+    if magic != ESP_IMAGE_MAGIC:
+        raise ValueError(f"0x{offset:x} 不是 ESP32 app image")
+    append_digest = image[offset + ESP_HEADER_SIZE - 1] == 1
+
+    segments = []
+    pos = offset + ESP_HEADER_SIZE
+    for _ in range(segment_count):
+        _, length = struct.unpack_from("<II", image, pos)
+        pos += 8
+        segments.append((pos, pos + length))
+        pos += length
+
+    # checksum 放在 16 bytes 對齊的最後一個 byte
+    checksum_pos = pos + (15 - (pos - offset) % 16)
+    return segments, checksum_pos, append_digest
+
+
+def _xor(data: bytes) -> int:
+    return functools.reduce(operator.xor, data, 0)
+
+
+def patch_firmware(template: bytes, values: Dict[str, str], app_offset: int = APP_OFFSET) -> bytes:
+    image = bytearray(template)
+    segments, checksum_pos, append_digest = _image_layout(image, app_offset)
+
+    start = image.find(SECRETS_MAGIC, app_offset)
+    if start == -1 or not any(s <= start and start + SECRETS_SIZE <= e for s, e in segments):
+        raise ValueError("韌體內找不到預留的 secrets 區塊")
+    if image.find(SECRETS_MAGIC, start + 1) != -1:
+        raise ValueError("韌體內有多個 secrets 區塊")
+
+    # checksum 是所有 segment 資料的 XOR，只需要扣掉舊區塊、加上新區塊
+    region = pack_secrets(values)
+    image[checksum_pos] ^= _xor(image[start:start + SECRETS_SIZE]) ^ _xor(region)
+    image[start:start + SECRETS_SIZE] = region
+
+    if append_digest:
+        image[checksum_pos + 1:checksum_pos + 33] = hashlib.sha256(image[app_offset:checksum_pos + 1]).digest()
+    return bytes(image)
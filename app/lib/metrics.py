@@ -0,0 +1,18 @@
+from typing import Dict
+
+from app.core.config import Settings
+from app.lib.bottle_events import get_hub
+from app.lib.presence import get_presence
+from app.lib.state_cache import get_record_cache, get_state_cache
+from app.lib.token_cache import get_token_cache
+
+
+def collect_metrics(settings: Settings) -> Dict:
+    """各個行程內快取的命中率與大小；每個 worker 各自一份，用來調整 TTL / 上限。"""
+    return {
+        "token_cache": get_token_cache(settings).stats(),
+        "state_cache": get_state_cache(settings).stats(),
+        "record_cache": get_record_cache(settings).stats(),
+        "presence": get_presence(settings).stats(),
+        "bottle_stream": get_hub(settings).stats(),
+    }
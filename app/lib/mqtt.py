@@ -0,0 +1,142 @@
+import asyncio
+import logging
+import ssl
+import struct
+from typing import Callable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# MQTT 3.1.1 只用到訂閱需要的封包，不另外引入 client 套件
+CONNECT = 0x10
+CONNACK = 0x20
+PUBLISH = 0x30
+PUBACK = 0x40
+SUBSCRIBE = 0x82
+SUBACK = 0x90
+PINGREQ = 0xC0
+
+
+def _string(value: str) -> bytes:
+    raw = value.encode("utf-8")
+    return struct.pack("!H", len(raw)) + raw
+
+
+def _remaining_length(length: int) -> bytes:
+    out = bytearray()
+    while True:
+        byte, length = length % 128, length // 128
+        out.append(byte | (0x80 if length else 0))
+        if not length:
+            return bytes(out)
+
+
+def packet(packet_type: int, body: bytes = b"") -> bytes:
+    return bytes([packet_type]) + _remaining_length(len(body)) + body
+
+
+async def read_packet(reader: asyncio.StreamReader) -> Tuple[int, bytes]:
+    header = (await reader.readexactly(1))[0]
+    length, multiplier = 0, 1
+    while True:
+        byte = (await reader.readexactly(1))[0]
+        length += (byte & 0x7F) * multiplier
+        if not byte & 0x80:
+            break
+        multiplier *= 128
+    return header, await reader.readexactly(length) if length else b""
+
+
+def parse_publish(header: int, body: bytes) -> Tuple[str, bytes, int, Optional[int]]:
+    """回傳 (topic, payload, qos, packet id)。"""
+    qos = (header >> 1) & 0x03
+    (topic_length,) = struct.unpack_from("!H", body)
+    topic = body[2:2 + topic_length].decode("utf-8")
+    pos = 2 + topic_length
+    packet_id = None
+    if qos:
+        (packet_id,) = struct.unpack_from("!H", body, pos)
+        pos += 2
+    return topic, body[pos:], qos, packet_id
+
+
+class MQTTSubscriber:
+    """只負責訂閱的 MQTT 3.1.1 client，斷線時自動重連。
+
+    on_message(topic, payload) 在 event loop 內呼叫；on_state(connected) 在連上 / 斷線時呼叫。
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        client_id: str,
+        topics: List[str],
+        on_message: Callable[[str, bytes], None],
+        on_state: Optional[Callable[[bool], None]] = None,
+        ssl_context: Optional[ssl.SSLContext] = None,
+        keepalive: int = 60,
+    ):
+        self.host = host
+        self.port = port
+        self.client_id = client_id
+        self.topics = topics
+        self.on_message = on_message
+        self.on_state = on_state or (lambda connected: None)
+        self.ssl_context = ssl_context
+        self.keepalive = keepalive
+
+    async def run(self):
+        backoff = 1
+        while True:
+            try:
+                await self._session()
+                backoff = 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"MQTT 連線中斷 ({self.host}:{self.port}): {e!r}，{backoff} 秒後重連")
+            finally:
+                self.on_state(False)
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 60)
+
+    async def _session(self):
+        reader, writer = await asyncio.open_connection(
+            self.host, self.port, ssl=self.ssl_context,
+            server_hostname=self.host if self.ssl_context else None,
+        )
+        try:
+            # clean session：重連後重新訂閱即可，不需要 broker 保留狀態
+            writer.write(packet(CONNECT, _string("MQTT") + bytes([4, 0x02]) + struct.pack("!H", self.keepalive) + _string(self.client_id)))
+            header, body = await asyncio.wait_for(read_packet(reader), timeout=10)
+            if header & 0xF0 != CONNACK or len(body) < 2 or body[1] != 0:
+                raise ConnectionError(f"CONNACK 失敗: {body!r}")
+
+            writer.write(packet(SUBSCRIBE, struct.pack("!H", 1) + b"".join(_string(topic) + b"\x01" for topic in self.topics)))
+            header, body = await asyncio.wait_for(read_packet(reader), timeout=10)
+            if header & 0xF0 != SUBACK or any(code == 0x80 for code in body[2:]):
+                raise ConnectionError(f"SUBSCRIBE 被拒絕: {body!r}")
+
+            logger.info(f"MQTT 已訂閱 {', '.join(self.topics)}")
+            self.on_state(True)
+
+            ping = asyncio.create_task(self._ping(writer))
+            try:
+                while True:
+                    # 每 keepalive / 2 秒 ping 一次，超過 1.5 倍 keepalive 沒收到任何封包就當作斷線
+                    header, body = await asyncio.wait_for(read_packet(reader), timeout=self.keepalive * 1.5)
+                    if header & 0xF0 == PUBLISH:
+                        topic, payload, qos, packet_id = parse_publish(header, body)
+                        if qos == 1:
+                            writer.write(packet(PUBACK, struct.pack("!H", packet_id)))
+                        self.on_message(topic, payload)
+            finally:
+                ping.cancel()
+        finally:
+            writer.close()
+
+    async def _ping(self, writer: asyncio.StreamWriter):
+        while True:
+            await asyncio.sleep(self.keepalive / 2)
+            writer.write(packet(PINGREQ))
+            await writer.drain()
@@ -0,0 +1,67 @@
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import Optional, Tuple
+
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerificationError
+
+from app.core.config import Settings
+
+# 在 worker process 執行的部分只依賴 argon2，spawn 出來的 process 不需要載入整個 app
+Argon2Params = Tuple[int, int, int]  # (time_cost, memory_cost KiB, parallelism)
+
+_executor: Optional[ProcessPoolExecutor] = None
+_lock = threading.Lock()
+
+
+def argon2_params(settings: Settings) -> Argon2Params:
+    return (settings.ARGON2_TIME_COST, settings.ARGON2_MEMORY_COST, settings.ARGON2_PARALLELISM)
+
+
+@lru_cache
+def _hasher(params: Argon2Params) -> PasswordHasher:
+    time_cost, memory_cost, parallelism = params
+    return PasswordHasher(time_cost=time_cost, memory_cost=memory_cost, parallelism=parallelism)
+
+
+def hash_sync(params: Argon2Params, plain_password: str) -> str:
+    return _hasher(params).hash(plain_password)
+
+
+def verify_sync(params: Argon2Params, hashed_password: str, plain_password: str) -> Tuple[bool, Optional[str]]:
+    """回傳 (是否正確, 新的 hash)；只有密碼正確且參數已調整時才會重算 hash。"""
+    ph = _hasher(params)
+    try:
+        ph.verify(hashed_password, plain_password)
+    except (VerificationError, InvalidHashError):
+        return False, None
+    if ph.check_needs_rehash(hashed_password):
+        return True, ph.hash(plain_password)
+    return True, None
+
+
+def warm(params: Argon2Params) -> None:
+    _hasher(params)
+
+
+def get_executor(settings: Settings) -> ProcessPoolExecutor:
+    # argon2 是 CPU + 記憶體密集，放在固定數量的 process，不佔用 request threadpool
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = ProcessPoolExecutor(
+                    max_workers=settings.PASSWORD_HASH_WORKERS,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+    return _executor
+
+
+async def on_shutdown():
+    global _executor
+    with _lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
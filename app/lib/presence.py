@@ -0,0 +1,177 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+import ssl
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from app.core.config import Settings, get_settings
+from app.lib.mqtt import MQTTSubscriber
+
+logger = logging.getLogger(__name__)
+
+AWS_PRESENCE_PREFIX = "$aws/events/presence/"
+ONLINE_PAYLOADS = {"online", "connected", "1", "true"}
+
+_task: Optional[asyncio.Task] = None
+
+
+def parse_presence(topic: str, payload: bytes) -> Optional[Tuple[str, bool, bool, Optional[float]]]:
+    """topic -> (device_id, 是否在線, 是否為 heartbeat, 事件時間)；不認得的 topic 回傳 None。
+
+    $aws/events/presence/{connected|disconnected}/{clientId}  AWS IoT lifecycle event (含非正常斷線)
+    .../{device_id}/heartbeat                                 裝置定期送出
+    .../{device_id}/status                                    online / offline，offline 設成 last will
+    """
+    parts = topic.split("/")
+    if topic.startswith(AWS_PRESENCE_PREFIX) and len(parts) == 5:
+        try:
+            timestamp = json.loads(payload or b"{}").get("timestamp")
+        except ValueError:
+            timestamp = None
+        return parts[4], parts[3] == "connected", False, timestamp / 1000 if timestamp else None
+    if len(parts) >= 2 and parts[-1] == "heartbeat":
+        return parts[-2], True, True, None
+    if len(parts) >= 2 and parts[-1] == "status":
+        return parts[-2], payload.decode("utf-8", "ignore").strip().lower() in ONLINE_PAYLOADS, False, None
+    return None
+
+
+class PresenceRegistry:
+    """device_id -> 是否在線，由 MQTT 事件更新，查詢完全在記憶體內。
+
+    訂閱沒有連上時 (live = False) 一律回傳 None，呼叫端改用上游查詢。
+    heartbeat 只在 ttl 秒內有效；lifecycle / status 事件則持續到下一個事件為止。
+    """
+
+    def __init__(self, settings: Settings):
+        self.ttl = settings.PRESENCE_TTL
+        self.live = False
+        # device_id -> (online, 有效期限 (monotonic), 事件時間)
+        self._devices: Dict[str, Tuple[bool, float, float]] = {}
+        self._lock = threading.Lock()
+        self._listeners: List[Callable[[str, bool], None]] = []
+
+        self.hits = 0
+        self.misses = 0
+
+    def mark(self, device_id: str, online: bool, heartbeat: bool = False, timestamp: Optional[float] = None):
+        timestamp = timestamp or time.time()
+        now = time.monotonic()
+        expires = now + self.ttl if heartbeat else float("inf")
+        with self._lock:
+            current = self._devices.get(device_id)
+            # lifecycle 事件可能亂序 (例如重連時舊連線的 disconnected 比較晚到)
+            if current and current[2] > timestamp:
+                return
+            self._devices[device_id] = (online, expires, timestamp)
+        # heartbeat 過期後再收到 heartbeat 也算重新上線
+        if current is None or (current[0] and current[1] > now) != online:
+            for listener in self._listeners:
+                listener(device_id, online)
+
+    def add_listener(self, listener: Callable[[str, bool], None]):
+        # 上線狀態改變時呼叫 listener(device_id, online)，在 MQTT 的 event loop 內執行
+        self._listeners.append(listener)
+
+    def seed(self, device_id: str, online: bool):
+        # 上游查到的結果，ttl 後再重新確認
+        with self._lock:
+            if device_id not in self._devices:
+                self._devices[device_id] = (online, time.monotonic() + self.ttl, 0)
+
+    def get(self, device_id: str) -> Optional[bool]:
+        return self.online([device_id])[device_id]
+
+    def online(self, device_ids: List[str]) -> Dict[str, Optional[bool]]:
+        """一次查多台裝置；None 表示不知道 (還沒收到事件或訂閱沒連上)。"""
+        now = time.monotonic()
+        res = {}
+        with self._lock:
+            for device_id in device_ids:
+                entry = self._devices.get(device_id) if self.live else None
+                if entry is not None and entry[1] <= now:
+                    # heartbeat 過期視為離線；上游 seed 的 (事件時間為 0) 過期則重新查
+                    entry = (False,) + entry[1:] if entry[2] else None
+                if entry is None:
+                    self.misses += 1
+                    res[device_id] = None
+                else:
+                    self.hits += 1
+                    res[device_id] = entry[0]
+        return res
+
+    def set_live(self, live: bool):
+        self.live = live
+
+    def on_message(self, topic: str, payload: bytes):
+        event = parse_presence(topic, payload)
+        if event:
+            device_id, online, heartbeat, timestamp = event
+            self.mark(device_id, online, heartbeat, timestamp)
+
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        with self._lock:
+            online = sum(1 for entry in self._devices.values() if entry[0])
+        return {
+            "live": self.live,
+            "devices": len(self._devices),
+            "online": online,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+_registry: Optional[PresenceRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_presence(settings: Settings) -> PresenceRegistry:
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = PresenceRegistry(settings)
+    return _registry
+
+
+def _ssl_context(settings: Settings) -> Optional[ssl.SSLContext]:
+    if not settings.PRESENCE_MQTT_TLS:
+        return None
+    # AWS IoT 用 X.509 client certificate 驗證
+    context = ssl.create_default_context(cafile=settings.IOT_CERT_CA or None)
+    if settings.IOT_CERT_CRT and settings.IOT_PRIVATE_KEY:
+        context.load_cert_chain(settings.IOT_CERT_CRT, settings.IOT_PRIVATE_KEY)
+    return context
+
+
+def build_subscriber(settings: Settings) -> MQTTSubscriber:
+    registry = get_presence(settings)
+    return MQTTSubscriber(
+        host=settings.PRESENCE_MQTT_HOST or settings.IOT_ENDPOINT,
+        port=settings.PRESENCE_MQTT_PORT,
+        client_id=settings.PRESENCE_MQTT_CLIENT_ID or f"biocherish-api-{socket.gethostname()}-{os.getpid()}",
+        topics=[topic.strip() for topic in settings.PRESENCE_TOPICS.split(",") if topic.strip()],
+        on_message=registry.on_message,
+        on_state=registry.set_live,
+        ssl_context=_ssl_context(settings),
+    )
+
+
+async def on_startup():
+    global _task
+    settings = get_settings()
+    if settings.PRESENCE_MQTT_ENABLED and _task is None:
+        _task = asyncio.create_task(build_subscriber(settings).run())
+
+
+async def on_shutdown():
+    global _task
+    if _task is not None:
+        _task.cancel()
+        _task = None
@@ -0,0 +1,11 @@
+from typing import Any
+
+from fastapi.responses import JSONResponse
+from pydantic_core import to_json
+
+
+class ModelJSONResponse(JSONResponse):
+    """content 可以直接放 Pydantic model (或含 model 的 dict / list)，由 pydantic-core 一次序列化成 bytes。"""
+
+    def render(self, content: Any) -> bytes:
+        return to_json(content)
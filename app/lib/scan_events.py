@@ -0,0 +1,71 @@
+from datetime import datetime
+from typing import Dict
+
+from botocore.exceptions import ClientError
+
+from app.core.config import Settings
+from app.core.repository import bottle_table, scan_event_table, transact_write
+from app.models.bottle import RecordEventType
+
+CREATED = "created"
+DELETED = "deleted"
+
+
+def _marker(bottle: Dict, record_id: str, event: RecordEventType, settings: Settings) -> Dict:
+    state = CREATED if event == RecordEventType.CREATED else DELETED
+    now = int(datetime.now().timestamp())
+    put = {
+        "TableName": scan_event_table.name,
+        "Item": {
+            "id": f"{bottle['device_id']}#{record_id}",
+            "bottle_id": str(bottle['id']),
+            "state": state,
+            "updated_at": now,
+            "expires_at": now + settings.SCAN_EVENT_TTL_DAYS * 86400,
+        },
+    }
+    if state == CREATED:
+        put["ConditionExpression"] = "attribute_not_exists(id)"
+    else:
+        # 沒有 marker 的是計數器上線前建立的紀錄，刪除時一樣要減一
+        put["ConditionExpression"] = "attribute_not_exists(id) OR #state = :created"
+        put["ExpressionAttributeNames"] = {"#state": "state"}
+        put["ExpressionAttributeValues"] = {":created": CREATED}
+    return put
+
+
+async def count_scan_event(bottle: Dict, record_id: str, event: RecordEventType, settings: Settings) -> bool:
+    """每筆紀錄的 created / deleted 各只計入 total_scans 一次，回傳這次是否有計入。
+
+    marker 與計數器在同一個 TransactWriteItems；重送的事件 marker 條件不成立，整筆取消。
+    """
+    marker = _marker(bottle, record_id, event, settings)
+    inc = 1 if event == RecordEventType.CREATED else -1
+    try:
+        await transact_write([
+            {"Put": marker},
+            {"Update": {
+                "TableName": bottle_table.name,
+                "Key": {"id": bottle['id']},
+                "UpdateExpression": "ADD total_scans :inc",
+                "ConditionExpression": "attribute_exists(total_scans) AND total_scans >= :min",
+                "ExpressionAttributeValues": {":inc": inc, ":min": 0 if inc > 0 else 1},
+            }},
+        ])
+        return True
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "TransactionCanceledException":
+            raise
+        reasons = e.response.get("CancellationReasons") or []
+        if reasons and reasons[0].get("Code") == "ConditionalCheckFailed":
+            # 已經處理過的事件
+            return False
+
+    # 計數器條件不成立：舊資料還沒有 total_scans (交給 /bottle/{id}/total 回填) 或已經是 0。
+    # 仍然記下 marker，之後重送的事件才會被擋下
+    try:
+        await scan_event_table.put_item(**{k: v for k, v in marker.items() if k != "TableName"})
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+            raise
+    return False
@@ -0,0 +1,157 @@
+import asyncio
+import time
+from decimal import Decimal
+from typing import Dict, List, Optional
+
+from botocore.exceptions import ClientError
+from fastapi.concurrency import run_in_threadpool
+
+from app.core.config import Settings
+from app.core.repository import bottle_table
+from app.lib.data import find_bottle_and_env_state, get_last_detect_record, get_last_detect_records_and_device_infos
+from app.models.bottle import BottleStatus
+
+
+def _decimal(value) -> Optional[Decimal]:
+    # DynamoDB 不收 float
+    return Decimal(str(value)) if value is not None else None
+
+
+def record_detect_time(record: Dict) -> float:
+    return float(record.get("detectTime", record.get("time", 0)) or 0)
+
+
+def seen_recently(bottle: Dict, window: int) -> bool:
+    # last_seen 只代表當時在線，太久沒有新的紀錄就不能再當成在線
+    return time.time() - float(bottle.get("last_seen", 0) or 0) <= window
+
+
+def snapshot_from_record(record: Optional[Dict], bottle_state: Optional[Dict], env_state: Optional[Dict]) -> Dict:
+    """把一筆偵測紀錄轉成 bottle item 上的 curr_* 欄位；record 為 None 表示還沒有任何紀錄。"""
+    if not record:
+        return {
+            "curr_detect_record_id": None,
+            "curr_bottle_status": BottleStatus.UNKNOWN.value,
+            "curr_bottle_status_text": None,
+            "curr_env_status": BottleStatus.UNKNOWN.value,
+            "curr_env_status_text": None,
+            "curr_image_path": None,
+            "curr_temperature": None,
+            "curr_humidity": None,
+            "curr_detect_time": 0,
+        }
+
+    bt_status = BottleStatus(bottle_state["isAbnormal"]) if bottle_state else BottleStatus.UNKNOWN
+    env_status = BottleStatus(env_state["isAbnormal"]) if env_state else BottleStatus.UNKNOWN
+    detect_time = record_detect_time(record)
+    return {
+        "curr_detect_record_id": record.get("detect_record_id"),
+        "curr_bottle_status": bt_status.value,
+        "curr_bottle_status_text": bottle_state.get("type") if bottle_state else None,
+        "curr_env_status": env_status.value,
+        "curr_env_status_text": env_state.get("type") if env_state else None,
+        "curr_image_path": record.get("origPhotoUrl", record.get("orgPhotoUrl")),
+        "curr_temperature": _decimal(record.get("temperature")),
+        "curr_humidity": _decimal(record.get("humidity")),
+        "curr_detect_time": _decimal(detect_time),
+        "scanned_at": int(detect_time),
+    }
+
+
+async def write_snapshot(bottle_id: str, snapshot: Dict, extra: Optional[Dict] = None) -> bool:
+    """只有比目前 snapshot 新 (或還沒有 snapshot) 才寫入，避免事件亂序時被舊資料蓋掉。"""
+    values = {**snapshot, **(extra or {}), "snapshot_verified_at": int(time.time())}
+    names = {f"#{i}": key for i, key in enumerate(values)}
+    try:
+        await bottle_table.update_item(
+            Key={"id": bottle_id},
+            UpdateExpression="SET " + ", ".join(f"{name} = :{name[1:]}" for name in names),
+            ConditionExpression="attribute_exists(id) AND (attribute_not_exists(curr_detect_time) OR curr_detect_time <= :t)",
+            ExpressionAttributeNames=names,
+            ExpressionAttributeValues={
+                **{f":{name[1:]}": values[key] for name, key in names.items()},
+                ":t": values["curr_detect_time"],
+            },
+        )
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+            raise
+        return False
+    return True
+
+
+async def mark_snapshot_verified(bottle_id: str, detect_record_id: str):
+    # 上游最新一筆和 snapshot 相同：snapshot 仍然可信，重新計算 SNAPSHOT_MAX_STALENESS
+    try:
+        await bottle_table.update_item(
+            Key={"id": bottle_id},
+            UpdateExpression="SET snapshot_verified_at = :now",
+            ConditionExpression="curr_detect_record_id = :id",
+            ExpressionAttributeValues={":now": int(time.time()), ":id": detect_record_id},
+        )
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+            raise
+
+
+async def apply_record(bottle_id: str, record: Dict, settings: Settings, extra: Optional[Dict] = None) -> Optional[Dict]:
+    bottle_state, env_state = await run_in_threadpool(
+        find_bottle_and_env_state, record.get("bottleStateID"), record.get("envStateID", ""), settings
+    )
+    snapshot = snapshot_from_record(record, bottle_state, env_state)
+    return snapshot if await write_snapshot(bottle_id, snapshot, extra) else None
+
+
+async def rebuild_snapshot(bottle: Dict, settings: Settings) -> Dict:
+    """從上游最新一筆紀錄重建 snapshot (舊資料回填，或目前那筆被刪除時)。"""
+    record = await run_in_threadpool(get_last_detect_record, str(bottle["device_id"]), settings)
+    if record:
+        snapshot = snapshot_from_record(record, record.get("detect_record_state"), record.get("env_record_state"))
+    else:
+        snapshot = snapshot_from_record(None, None, None)
+    await write_snapshot(bottle["id"], snapshot)
+    return {**bottle, **snapshot}
+
+
+async def remove_record(bottle: Dict, detect_record_id: str, settings: Settings) -> Optional[Dict]:
+    """刪掉的是目前這筆才重建，回傳重建後的 bottle；其他情況回傳 None。"""
+    if bottle.get("curr_detect_record_id") != detect_record_id:
+        return None
+    try:
+        # 刪掉的是目前這筆，時間會倒退，先拿掉 curr_detect_time 再重建
+        await bottle_table.update_item(
+            Key={"id": bottle["id"]},
+            UpdateExpression="REMOVE curr_detect_time",
+            ConditionExpression="curr_detect_record_id = :id",
+            ExpressionAttributeValues={":id": detect_record_id},
+        )
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+            raise
+        return None
+    return await rebuild_snapshot(bottle, settings)
+
+
+async def ensure_snapshots(bottles: List[Dict], settings: Settings) -> List[Dict]:
+    # 只有還沒有 snapshot 的舊 bottle 會打上游，而且只會回填一次
+    legacy = [bottle for bottle in bottles if "curr_detect_time" not in bottle]
+    if not legacy:
+        return bottles
+
+    upstream = await get_last_detect_records_and_device_infos([bottle["device_id"] for bottle in legacy], settings)
+    snapshots = {}
+    for bottle, (record, device_info) in zip(legacy, upstream):
+        if record:
+            snapshot = snapshot_from_record(record, record.get("detect_record_state"), record.get("env_record_state"))
+        else:
+            snapshot = snapshot_from_record(None, None, None)
+        extra = {"last_seen": int(time.time())} if device_info.get("isConnected", False) else None
+        snapshots[bottle["id"]] = (snapshot, extra)
+
+    await asyncio.gather(*(
+        write_snapshot(bottle_id, snapshot, extra) for bottle_id, (snapshot, extra) in snapshots.items()
+    ))
+    return [
+        {**bottle, **snapshots[bottle["id"]][0], **(snapshots[bottle["id"]][1] or {})} if bottle["id"] in snapshots else bottle
+        for bottle in bottles
+    ]
@@ -0,0 +1,186 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from app.core.config import Settings
+from app.core.upstream import get_session
+
+logger = logging.getLogger(__name__)
+
+
+class DetectRecordStateCache:
+    """detect_record_state_id -> state 的記憶體快取 (TTL + LRU 上限)。
+
+    取不到時才整包下載 /db/device_record_states 重建索引，
+    且兩次重建之間至少間隔 reload_interval 秒。
+    回傳的 dict 是共用物件，呼叫端不要修改。
+    """
+
+    def __init__(self, settings: Settings):
+        self.settings = settings
+        self.ttl = settings.STATE_CACHE_TTL
+        self.maxsize = settings.STATE_CACHE_MAXSIZE
+        self.reload_interval = settings.STATE_CACHE_RELOAD_INTERVAL
+
+        self._items: "OrderedDict[str, tuple[Dict, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self._loaded_at = 0.0
+
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+        self.evictions = 0
+
+    def _lookup(self, state_id: str, now: float, count: bool = False) -> Optional[Dict]:
+        with self._lock:
+            entry = self._items.get(state_id)
+            if entry is not None and entry[1] <= now:
+                del self._items[state_id]
+                entry = None
+            if count:
+                if entry is None:
+                    self.misses += 1
+                else:
+                    self.hits += 1
+            if entry is None:
+                return None
+            self._items.move_to_end(state_id)
+            return entry[0]
+
+    def get(self, state_id: str) -> Dict:
+        if not state_id:
+            return {}
+
+        state = self._lookup(state_id, time.monotonic(), count=True)
+        if state is not None:
+            return state
+
+        with self._reload_lock:
+            # 其他執行緒可能剛重建完
+            state = self._lookup(state_id, time.monotonic())
+            if state is not None:
+                return state
+            if time.monotonic() - self._loaded_at >= self.reload_interval:
+                self.reload()
+                state = self._lookup(state_id, time.monotonic())
+        return state or {}
+
+    def reload(self):
+        response = get_session(self.settings).get(f'{self.settings.DATA_URL}/db/device_record_states')
+        states = response.json().get("detect_record_states", [])
+
+        now = time.monotonic()
+        expires_at = now + self.ttl
+        with self._lock:
+            for drs in states:
+                state_id = drs.get('detect_record_state_id')
+                if not state_id:
+                    continue
+                self._items[state_id] = (drs, expires_at)
+                self._items.move_to_end(state_id)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+                self.evictions += 1
+            self._loaded_at = now
+            self.reloads += 1
+        logger.info(f"detect_record_states 快取已重建，共 {len(states)} 筆。")
+
+    def invalidate(self, state_id: Optional[str] = None):
+        with self._lock:
+            if state_id is None:
+                self._items.clear()
+                self._loaded_at = 0.0
+            else:
+                self._items.pop(state_id, None)
+
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._items),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "reloads": self.reloads,
+            "evictions": self.evictions,
+        }
+
+
+class DetectRecordCache:
+    """(device_id, detect_record_id) -> detect record 的 TTL + LRU 快取。
+
+    偵測紀錄寫入後不會再變動，但刪除事件只會送到其中一個 worker 的 invalidate，
+    其他 worker 靠 TTL 在 ttl 秒內不再回傳已刪除的紀錄。
+    """
+
+    def __init__(self, settings: Settings):
+        self.maxsize = settings.RECORD_CACHE_MAXSIZE
+        self.ttl = settings.RECORD_CACHE_TTL
+        self._items: "OrderedDict[Tuple[str, str], tuple[Dict, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, device_id: str, detect_record_id: str) -> Optional[Dict]:
+        key = (device_id, detect_record_id)
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is not None and entry[1] <= time.monotonic():
+                del self._items[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._items.move_to_end(key)
+        # 呼叫端會在 record 上掛 state，給副本
+        return dict(entry[0])
+
+    def put(self, device_id: str, record: Dict):
+        key = (device_id, record['detect_record_id'])
+        with self._lock:
+            self._items[key] = (dict(record), time.monotonic() + self.ttl)
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def invalidate(self, device_id: str, detect_record_id: str):
+        with self._lock:
+            self._items.pop((device_id, detect_record_id), None)
+
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._items),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+_cache: Optional[DetectRecordStateCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_state_cache(settings: Settings) -> DetectRecordStateCache:
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = DetectRecordStateCache(settings)
+    return _cache
+
+
+_record_cache: Optional[DetectRecordCache] = None
+
+
+def get_record_cache(settings: Settings) -> DetectRecordCache:
+    global _record_cache
+    if _record_cache is None:
+        with _cache_lock:
+            if _record_cache is None:
+                _record_cache = DetectRecordCache(settings)
+    return _record_cache
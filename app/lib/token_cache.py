@@ -0,0 +1,72 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from app.core.config import Settings
+
+
+class VerifiedTokenCache:
+    """已驗證過的 access token 快取 (LRU 上限)，key 為 token 的 sha256。
+
+    每個 entry 在 token 的 exp 到期，到期前同一個 token 不需要再驗一次簽章。
+    """
+
+    def __init__(self, settings: Settings):
+        self.maxsize = settings.TOKEN_CACHE_MAXSIZE
+        self._items: "OrderedDict[bytes, Tuple[Dict, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token: str) -> Optional[Dict]:
+        key = self._key(token)
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is None or entry[1] <= time.time():
+                if entry is not None:
+                    self._items.pop(key, None)
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._items.move_to_end(key)
+        return dict(entry[0])
+
+    def put(self, token: str, payload: Dict):
+        exp = payload.get("exp")
+        if not isinstance(exp, (int, float)):
+            return
+        key = self._key(token)
+        with self._lock:
+            self._items[key] = (dict(payload), float(exp))
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._items),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+_cache: Optional[VerifiedTokenCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_token_cache(settings: Settings) -> VerifiedTokenCache:
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = VerifiedTokenCache(settings)
+    return _cache
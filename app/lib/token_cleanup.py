@@ -0,0 +1,72 @@
+import asyncio
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional, Set
+
+from boto3.dynamodb.conditions import Key
+
+from app.core.repository import access_table, user_table
+
+logger = logging.getLogger(__name__)
+
+# 背景執行中的清除工作，保留 reference 避免被 GC，關閉時一起取消
+_tasks: Set[asyncio.Task] = set()
+
+
+async def _paginate(method, **kwargs) -> List[Dict]:
+    items = []
+    while True:
+        res = await method(**kwargs)
+        items.extend(res.get("Items", []))
+        if "LastEvaluatedKey" not in res:
+            return items
+        kwargs["ExclusiveStartKey"] = res["LastEvaluatedKey"]
+
+
+async def prune_access_tokens(user_id: str, current: Optional[int] = None) -> int:
+    """刪除這個使用者已被取代 (token_version 小於目前版本) 或已過期的 access_token，回傳刪除筆數。
+
+    current 是使用者目前的 token_version，沒給就從 user 表讀；沒有 token_version 視為 0。
+    只查 UserIdIndex 上這個使用者的資料，不掃整張表；從不登入的使用者留給 TTL 清除。
+    """
+    if current is None:
+        user = (await user_table.get_item(Key={"id": user_id}, ProjectionExpression="token_version")).get("Item") or {}
+        current = user.get("token_version", 0)
+
+    now = int(datetime.now().timestamp())
+    tokens = await _paginate(
+        access_table.query,
+        IndexName="UserIdIndex",
+        KeyConditionExpression=Key("user_id").eq(user_id),
+        ProjectionExpression="id, token_version, expires_at",
+    )
+    stale = [
+        {"id": token["id"]}
+        for token in tokens
+        if token.get("token_version", 0) < current
+        or token.get("expires_at", now + 1) <= now
+    ]
+    await access_table.batch_delete(stale)
+    return len(stale)
+
+
+async def _prune(user_id: str, current: Optional[int]):
+    try:
+        deleted = await prune_access_tokens(user_id, current)
+        if deleted:
+            logger.info(f"已清除使用者 {user_id} 的 {deleted} 筆過期 / 被取代的 access_token")
+    except Exception:
+        logger.exception(f"清除使用者 {user_id} 的 access_token 失敗")
+
+
+def schedule_prune(user_id: str, current: Optional[int] = None):
+    """登入 / refresh / 登出改動 token_version 之後呼叫，在背景清除，不拖慢回應。"""
+    task = asyncio.create_task(_prune(user_id, current))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+
+
+async def on_shutdown():
+    for task in list(_tasks):
+        task.cancel()
+    _tasks.clear()
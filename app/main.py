@@ -1,12 +1,25 @@
 import logging
 
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse
 
 from app.exceptions import exceptions
-from app.middlewares.response import middlewares
+from app.lib.response import ModelJSONResponse
+from app.lib.file import MAX_UPLOAD_BODY
+from app.lib.metrics import collect_metrics
+from app.middlewares.response import TimestampJSONMiddleware, middlewares
+from app.middlewares.upload import UploadSizeLimitMiddleware
 from app.routes.router import router
 from starlette.middleware.cors import CORSMiddleware
+from app.core.config import get_settings
 from app.core.db import on_startup
+from app.core.upstream import on_shutdown as close_upstream
+from app.core.warmup import is_ready
+from app.core.warmup import on_startup as start_prewarm
+from app.lib.password import on_shutdown as close_password_pool
+from app.lib.presence import on_shutdown as stop_presence
+from app.lib.presence import on_startup as start_presence
+from app.lib.token_cleanup import on_shutdown as stop_token_cleanup
 
 # initlize logging
 logging.basicConfig(
@@ -15,13 +28,17 @@ logging.basicConfig(
 )
 
 # initlize app
-bio_app = FastAPI(title="Bioinformatics API", version="1.0.0")
+bio_app = FastAPI(title="Bioinformatics API", version="1.0.0", default_response_class=ModelJSONResponse)
 
 
 # middleware
 for mware in middlewares:
     bio_app.middleware("http")(mware)
 
+# 先加的在內層：413 回應也會經過 TimestampJSONMiddleware
+bio_app.add_middleware(UploadSizeLimitMiddleware, max_size=MAX_UPLOAD_BODY)
+bio_app.add_middleware(TimestampJSONMiddleware)
+
 for cls, fn in exceptions:
     bio_app.exception_handler(cls)(fn)
 
@@ -40,9 +57,29 @@ bio_app.include_router(router, prefix=prefix)
 
 
 bio_app.add_event_handler("startup", on_startup)
+bio_app.add_event_handler("startup", start_prewarm)
+bio_app.add_event_handler("startup", start_presence)
+bio_app.add_event_handler("shutdown", close_upstream)
+bio_app.add_event_handler("shutdown", close_password_pool)
+bio_app.add_event_handler("shutdown", stop_token_cleanup)
+bio_app.add_event_handler("shutdown", stop_presence)
 
 
 # Health check endpoint
 # @bio_app.get("/health", tags=["Health"])
 # async def health_check():
 #     return {"status": "ok"}
+
+
+# Readiness：prewarm 完成前回 503
+@bio_app.get("/ready", tags=["Health"])
+async def readiness_check():
+    if not is_ready():
+        return JSONResponse(status_code=503, content={"status": "warming"})
+    return JSONResponse(status_code=200, content={"status": "ready"})
+
+
+# 這個 worker 的快取命中率，調整 TOKEN_CACHE_MAXSIZE / STATE_CACHE_TTL / RECORD_CACHE_TTL 等設定用
+@bio_app.get("/metrics", tags=["Health"])
+async def metrics():
+    return JSONResponse(status_code=200, content=collect_metrics(get_settings()))
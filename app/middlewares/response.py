@@ -20,35 +20,130 @@ async def add_process_time_header(request: Request, call_next):
             content={"detail": "Internal Server Error"},
         )
 
-async def add_timestamp_to_json_response(request: Request, call_next):
-    response = await call_next(request)
-    
-    if "application/json" in response.headers.get("content-type", ""):
-        body = [section async for section in response.body_iterator]
-        raw_data = b"".join(body).decode()
-        
-        try:
-            data = json.loads(raw_data)
-        except Exception:
-            data = raw_data 
-
-        if isinstance(data, dict):
-            # 轉換為 timestamp
-            data["timestamp"] = int(datetime.datetime.utcnow().timestamp())
-            
-            # 1. 備份舊的 Headers (包含 CORS 資料)
-            old_headers = dict(response.headers)
-            
-            # 2. 建立新 Response
-            response = JSONResponse(content=data, status_code=response.status_code)
-            
-            # 3. 重新把 Headers 塞回去 (排除 content-length，因為長度變了)
-            old_headers.pop("content-length", None)
-            response.init_headers(old_headers)
-    
-    return response
+TIMESTAMP_KEY = b'"timestamp"'
+
+
+def _has_top_level_timestamp(body: bytes) -> bool:
+    # 大部分回應根本沒有這個字，只有出現時才 parse 一次確認是不是最外層的 key
+    if TIMESTAMP_KEY not in body:
+        return False
+    try:
+        data = json.loads(body)
+    except ValueError:
+        return True
+    return isinstance(data, dict) and "timestamp" in data
+
+
+class TimestampJSONMiddleware:
+    """在 JSON object 回應的最後一個 `}` 前插入 "timestamp"，不重新 parse / 序列化 body。
+
+    回應本身已經有最外層的 "timestamp" 時保留原本的值，不再插入。
+    有 Content-Length 的回應 (JSONResponse 一次送完) 整段確認後再送；
+    串流回應邊送邊處理，只要出現過 "timestamp" 字樣就不插入。
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        start_message = None
+        buffered = False  # 有 Content-Length：等整個 body 收齊再決定
+        injection = None  # 確定是 JSON object 後才決定要插入的 bytes
+        pending = b""  # 還不能送出的 body (開頭判斷中 / 保留最後一段)
+        seen_key = False  # 串流回應中是否出現過 "timestamp"
+        tail = b""  # 上一段的結尾，"timestamp" 可能被切在兩段之間
+
+        async def send_start(length_delta: int):
+            headers = []
+            for key, value in start_message.get("headers", []):
+                if key == b"content-length":
+                    value = str(int(value) + length_delta).encode()
+                headers.append((key, value))
+            await send({**start_message, "headers": headers})
+
+        def make_injection(rest: bytes) -> bytes:
+            timestamp = int(datetime.datetime.utcnow().timestamp())
+            if rest.startswith(b"}"):
+                return b'"timestamp":%d' % timestamp
+            return b',"timestamp":%d' % timestamp
+
+        async def send_buffered(body: bytes):
+            head = body.lstrip()
+            if not head.startswith(b"{") or _has_top_level_timestamp(body):
+                await send_start(0)
+                return await send({"type": "http.response.body", "body": body, "more_body": False})
+            extra = make_injection(head[1:].lstrip())
+            end = body.rfind(b"}")
+            await send_start(len(extra))
+            await send({"type": "http.response.body", "body": body[:end] + extra + body[end:], "more_body": False})
+
+        async def send_wrapper(message):
+            nonlocal start_message, buffered, injection, pending, seen_key, tail
+
+            if message["type"] == "http.response.start":
+                headers = dict(message.get("headers", []))
+                if b"application/json" not in headers.get(b"content-type", b""):
+                    return await send(message)
+                start_message = message
+                buffered = b"content-length" in headers
+                return
+
+            if message["type"] != "http.response.body" or start_message is None:
+                return await send(message)
+
+            chunk = message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+            if buffered:
+                pending += chunk
+                if more_body:
+                    return
+                body, pending = pending, b""
+                return await send_buffered(body)
+
+            if TIMESTAMP_KEY in tail + chunk:
+                seen_key = True
+            tail = chunk[-len(TIMESTAMP_KEY):]
+
+            body = pending + chunk
+            pending = b""
+
+            if injection is None:
+                head = body.lstrip()
+                rest = head[1:].lstrip()
+                if more_body and (not head or (head.startswith(b"{") and not rest)):
+                    # 還看不出是不是 object / 空 object，先等下一段
+                    pending = body
+                    return
+
+                if not head.startswith(b"{"):
+                    # 不是 object (list / 空 body)，原樣送出
+                    await send_start(0)
+                    start_message = None
+                    return await send({**message, "body": body})
+
+                injection = make_injection(rest)
+                await send_start(len(injection))
+
+            if more_body:
+                # 最後一個 `}` 之後的資料先留著，結尾的 `}` 一定在裡面
+                end = body.rfind(b"}")
+                if end != -1:
+                    body, pending = body[:end], body[end:]
+                if body:
+                    await send({"type": "http.response.body", "body": body, "more_body": True})
+                return
+
+            end = body.rfind(b"}")
+            if end != -1 and not seen_key:
+                body = body[:end] + injection + body[end:]
+            await send({"type": "http.response.body", "body": body, "more_body": False})
+
+        await self.app(scope, receive, send_wrapper)
 
 middlewares = [
     add_process_time_header,
-    add_timestamp_to_json_response,
 ]
@@ -0,0 +1,45 @@
+from fastapi.responses import JSONResponse
+
+from app.exceptions import UploadTooLarge
+
+
+class UploadSizeLimitMiddleware:
+    """multipart 上傳在 route 之前就限制大小，超過的不會被整包 spool 到暫存檔。
+
+    Content-Length 超過直接回 413，不讀 body；沒有 Content-Length (chunked) 則邊收邊算，
+    超過時丟出 UploadTooLarge，由 exception handler 回 413。
+    """
+
+    def __init__(self, app, max_size: int):
+        self.app = app
+        self.max_size = max_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        headers = dict(scope.get("headers", []))
+        if not headers.get(b"content-type", b"").startswith(b"multipart/form-data"):
+            return await self.app(scope, receive, send)
+
+        content_length = headers.get(b"content-length")
+        if content_length and content_length.isdigit() and int(content_length) > self.max_size:
+            response = JSONResponse(
+                status_code=413,
+                content={"message": "Request body exceeds upload limit"},
+                headers={"Connection": "close"},
+            )
+            return await response(scope, receive, send)
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_size:
+                    raise UploadTooLarge()
+            return message
+
+        await self.app(scope, limited_receive, send)
@@ -1,6 +1,6 @@
 from datetime import datetime
 from enum import Enum
-from typing import Optional
+from typing import Dict, List, Optional
 from uuid import UUID
 
 from fastapi import UploadFile
@@ -21,6 +21,10 @@ class Status(str, Enum):
     COMPLETED = "completed"
     FAILED = "failed"
 
+class RecordEventType(str, Enum):
+    CREATED = "created"
+    DELETED = "deleted"
+
 
 # database models
 class Bottle(BaseModel):
@@ -36,6 +40,20 @@ class Bottle(BaseModel):
 
     device_id: str
 
+    total_scans: int = 0
+    records_deleted: int = 0  # 刪除事件次數，紀錄詳細頁的 ETag 版本
+
+    # 最新一筆偵測結果的 snapshot，由 /device/{id}/records 事件更新 (見 app/lib/snapshot.py)
+    curr_detect_record_id: Optional[str] = None
+    curr_bottle_status_text: Optional[str] = None
+    curr_env_status: BottleStatus = BottleStatus.UNKNOWN
+    curr_env_status_text: Optional[str] = None
+    curr_temperature: Optional[float] = None
+    curr_humidity: Optional[float] = None
+    curr_detect_time: int = 0  # 0 = 還沒有紀錄
+    snapshot_verified_at: int = 0  # snapshot 最後一次寫入或和上游確認的時間
+    last_seen: int = 0  # 裝置最後一次送出偵測紀錄的時間，0 = 不知道
+
     scanned_at: int = int(datetime.now().timestamp())
     edited_at: int = int(datetime.now().timestamp())
     updated_at: int = int(datetime.now().timestamp())
@@ -88,6 +106,17 @@ class DetectRecord(BaseModel):
     isError: bool = False
     time: int = int(datetime.now().timestamp())
 
+class BuildJob(BaseModel):
+    id: str
+    user_id: str
+    device_id: str
+    status: Status = Status.PENDING
+    error: Optional[str] = None
+    instance: Optional[str] = None  # 執行編譯的 host:pid
+
+    created_at: int = Field(default_factory=lambda: int(datetime.now().timestamp()))
+    updated_at: int = Field(default_factory=lambda: int(datetime.now().timestamp()))
+
 class DetectRecordState(BaseModel):
     detect_record_state_id: str
     isAbnormal: bool = False
@@ -143,6 +172,13 @@ class BottleHistory(BaseModel):
     detail: str
     scanned_at: int
 
+class BottleList(BaseModel):
+    bottles: List[BottleMainInfo]
+
+class BottleHistoryPage(BaseModel):
+    history: List[BottleHistory]
+    next: Optional[str] = None
+
 class CreateBottle(BaseModel):
     name: str
     frequency: int  # in minutes
@@ -167,4 +203,8 @@ class NewDeviceInfo(BaseModel):
     wifiPassword: str
 
 class ManualDeviceShot(BaseModel):
-    device_id: str
\ No newline at end of file
+    device_id: str
+
+class DetectRecordEvent(BaseModel):
+    event: RecordEventType
+    detect_record: Dict
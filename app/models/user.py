@@ -12,6 +12,7 @@ class AccessToken(BaseModel):
     user_id: str
     refresh_token: str
     token_version: int = 0
+    expires_at: Optional[int] = None  # DynamoDB TTL，與 refresh token 同時過期
     created_at: int = int(datetime.now().timestamp())
 
 class UserBase(BaseModel):
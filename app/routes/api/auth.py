@@ -4,20 +4,20 @@ import datetime
 import logging
 from urllib.parse import urlencode, urljoin
 
-import requests
 from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import JSONResponse, RedirectResponse
 from uuid import uuid4
 from boto3.dynamodb.conditions import Key, Attr
 from typing import Optional
 
 from app.core.config import Settings, get_settings
-from app.core.db import dynamodb
+from app.core.repository import access_table, user_table
 from app.exceptions import CredentialsException
-from app.lib.auth import (generate_access_token, generate_refresh_token,
-                          hash_password, require_user, verify_jwt_token, verify_password)
-from app.models.user import (AccessToken, User, UserLogin, UserRegister,
-                             VerfiyData)
+from app.lib.auth import (TokenVersionConflict, hash_password, issue_tokens,
+                          require_user, verify_jwt_token, verify_password)
+from app.lib.token_cleanup import schedule_prune
+from app.models.user import User, UserLogin, UserRegister, VerfiyData
 
 logger = logging.getLogger(__name__)
 
@@ -27,13 +27,9 @@ USERINFO_URL = "https://www.googleapis.com/oauth2/v3/userinfo"
 
 auth = APIRouter()
 
-# db
-user_table = dynamodb.Table("user")
-access_table = dynamodb.Table("access_token")
-
 
 @auth.get("/google/login")
-def google_login(app_redirect_url: Optional[str] = None, settings: Settings = Depends(get_settings)):
+async def google_login(app_redirect_url: Optional[str] = None, settings: Settings = Depends(get_settings)):
 
     target_state = app_redirect_url if app_redirect_url else settings.FRONTEND_URL
     params = {
@@ -56,7 +52,9 @@ def google_login(app_redirect_url: Optional[str] = None, settings: Settings = De
     # return RedirectResponse(url)
 
 @auth.get("/google/callback")
-def google_callback(code: str, state: str = None, settings: Settings = Depends(get_settings)):
+async def google_callback(code: str, state: str = None, settings: Settings = Depends(get_settings)):
+    import requests
+
     # 用 code 換 token
     data = {
         "code": code,
@@ -65,7 +63,7 @@ def google_callback(code: str, state: str = None, settings: Settings = Depends(g
         "redirect_uri": settings.GOOGLE_REDIRECT_URI,
         "grant_type": "authorization_code"
     }
-    token_res = requests.post(TOKEN_URL, data=data)
+    token_res = await run_in_threadpool(requests.post, TOKEN_URL, data=data)
     if token_res.status_code != status.HTTP_200_OK:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Failed to obtain token from Google")
 
@@ -73,48 +71,33 @@ def google_callback(code: str, state: str = None, settings: Settings = Depends(g
     access_token = tokens.get("access_token", "")
 
     # 取得使用者資訊
-    userinfo_res = requests.get(USERINFO_URL, headers={
+    userinfo_res = await run_in_threadpool(requests.get, USERINFO_URL, headers={
         "Authorization": f"Bearer {access_token}"
     })
     userinfo = userinfo_res.json()
     username = userinfo.get("name", userinfo["email"].split("@")[0])
 
-    user = user_table.query(
+    user = (await user_table.query(
         IndexName='GoogleIDIndex',
         KeyConditionExpression=Key('Google_ID').eq(userinfo["sub"]),
         FilterExpression=Attr('disabled').eq(False)
-    ).get("Items", [])
+    )).get("Items", [])
     user = user[0] if user else None
-    if not user:
-        # 自動註冊
-        user = User(
-            id=str(uuid4()),
-            Email=userinfo["email"],
-            Username=username,
-            Google_ID=userinfo["sub"],
-            Password=None
-        )
-        user_table.put_item(Item=user.dict())
-    id = user.get("id") if isinstance(user, dict) else user.id
-
-    access_token = generate_access_token(userId=str(id))
-    refresh_token = generate_refresh_token(userId=str(id))
-
-    new_token_version = user_table.update_item(
-        Key={"id": id},
-        UpdateExpression="SET token_version = token_version + :inc",
-        ExpressionAttributeValues={":inc": 1},
-        ReturnValues="UPDATED_NEW"
-    )["Attributes"]["token_version"]
-
-    access_table.put_item(
-        Item=AccessToken(
-            id=str(uuid4()),
-            user_id=id,
-            refresh_token=refresh_token,
-            token_version=new_token_version,
-        ).dict()
-    )
+    try:
+        if not user:
+            # 自動註冊，建立使用者與發 token 在同一筆交易
+            new_user = User(
+                id=str(uuid4()),
+                Email=userinfo["email"],
+                Username=username,
+                Google_ID=userinfo["sub"],
+                Password=None
+            )
+            access_token, refresh_token = await issue_tokens(new_user.id, new_user.token_version, new_user=new_user.dict())
+        else:
+            access_token, refresh_token = await issue_tokens(user["id"], user.get("token_version", 0))
+    except TokenVersionConflict:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Concurrent login, please try again")
 
     base_url = state if state else settings.FRONTEND_URL
     base_url = base_url.rstrip("/")
@@ -125,15 +108,15 @@ def google_callback(code: str, state: str = None, settings: Settings = Depends(g
     return RedirectResponse(redirect_url, status_code=302)
 
 @auth.post("/refresh")
-def verify_token(form_data: VerfiyData, settings: Settings = Depends(get_settings)):
+async def verify_token(form_data: VerfiyData, settings: Settings = Depends(get_settings)):
     token = form_data.token
     if not token:
         raise CredentialsException(msg="Invalid refresh token")
 
-    find_r = access_table.query(
+    find_r = (await access_table.query(
         IndexName='refreshTokenIndex',
         KeyConditionExpression=Key('refresh_token').eq(token),
-    ).get("Items", [])
+    )).get("Items", [])
 
     find_r = find_r[0] if find_r else None
     if not find_r:
@@ -145,31 +128,12 @@ def verify_token(form_data: VerfiyData, settings: Settings = Depends(get_setting
 
     user_id = payload.get("user_id")
 
-    user = user_table.get_item(Key={"id": user_id}).get("Item")
-
-    if user['token_version'] != find_r['token_version']:
+    # 使用者的 token_version 必須還等於這個 refresh token 的版本，否則已被撤銷
+    try:
+        access_token, refresh_token = await issue_tokens(user_id, find_r['token_version'], retry=False)
+    except TokenVersionConflict:
         raise CredentialsException(msg="Refresh token has been revoked")
 
-    # generate new tokens
-    refresh_token = generate_refresh_token(userId=user_id)
-    access_token = generate_access_token(userId=user_id)
-
-    new_token_version = user_table.update_item(
-        Key={"id": user_id},
-        UpdateExpression="SET token_version = token_version + :inc",
-        ExpressionAttributeValues={":inc": 1},
-        ReturnValues="UPDATED_NEW"
-    )["Attributes"]["token_version"]
-
-    access_table.put_item(
-        Item=AccessToken(
-            id=str(uuid4()),
-            user_id=user_id,
-            refresh_token=refresh_token,
-            token_version=new_token_version,
-        ).dict()
-    )
-
     return JSONResponse(
         status_code=status.HTTP_200_OK,
         content={
@@ -181,46 +145,42 @@ def verify_token(form_data: VerfiyData, settings: Settings = Depends(get_setting
 
 
 @auth.post("/login")
-def login(form_data: UserLogin, settings: Settings = Depends(get_settings)):
+async def login(form_data: UserLogin, settings: Settings = Depends(get_settings)):
     email = form_data.Email
     password = form_data.Password
 
     if not email or not password:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Email and password are required")
 
-    user = user_table.query(
+    user = (await user_table.query(
         IndexName='EmailIndex',
         KeyConditionExpression=Key('Email').eq(email),
         FilterExpression=Key('disabled').eq(False)
-    ).get("Items", [])
+    )).get("Items", [])
 
     user = user[0] if user else None
     if not user:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="User not found")
 
-    if not verify_password(user['Password'], password):
+    valid, new_hash = await verify_password(user['Password'], password)
+    if not valid:
         raise CredentialsException(msg="Invalid email or password")
 
     id = user['id']
 
+    if new_hash:
+        # argon2 參數調整過，用新參數更新舊 hash
+        await user_table.update_item(
+            Key={"id": id},
+            UpdateExpression="SET Password = :password",
+            ExpressionAttributeValues={":password": new_hash},
+        )
+
     # generate Token
-    access_token = generate_access_token(userId=str(id))
-    refresh_token = generate_refresh_token(userId=str(id))
-    new_token_version = user_table.update_item(
-        Key={"id": id},
-        UpdateExpression="SET token_version = token_version + :inc",
-        ExpressionAttributeValues={":inc": 1},
-        ReturnValues="UPDATED_NEW"
-    )["Attributes"]["token_version"]
-
-    access_table.put_item(
-        Item=AccessToken(
-            id=str(uuid4()),
-            user_id=id,
-            refresh_token=refresh_token,
-            token_version=new_token_version,
-        ).dict()
-    )
+    try:
+        access_token, refresh_token = await issue_tokens(id, user.get("token_version", 0))
+    except TokenVersionConflict:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Concurrent login, please try again")
 
     return JSONResponse(
         status_code=status.HTTP_200_OK,
@@ -232,7 +192,7 @@ def login(form_data: UserLogin, settings: Settings = Depends(get_settings)):
     )
 
 @auth.post("/register")
-def register(form_data: UserRegister, settings: Settings = Depends(get_settings)):
+async def register(form_data: UserRegister, settings: Settings = Depends(get_settings)):
     email = form_data.Email
     username = form_data.Username
     password = form_data.Password
@@ -250,10 +210,10 @@ def register(form_data: UserRegister, settings: Settings = Depends(get_settings)
         )
 
     # check if user exists
-    existing_user = user_table.query(
+    existing_user = (await user_table.query(
         IndexName='EmailIndex',
         KeyConditionExpression=Key('Email').eq(email)
-    ).get("Items", [])
+    )).get("Items", [])
 
     if existing_user:
         raise HTTPException(
@@ -261,7 +221,7 @@ def register(form_data: UserRegister, settings: Settings = Depends(get_settings)
         )
 
     # password hash
-    hashed_password = hash_password(password)
+    hashed_password = await hash_password(password)
 
     new_user = User(
         id=str(uuid4()),
@@ -270,7 +230,7 @@ def register(form_data: UserRegister, settings: Settings = Depends(get_settings)
         Password=hashed_password,
         disabled=False,
     )
-    user_table.put_item(Item=new_user.dict())
+    await user_table.put_item(Item=new_user.dict())
 
     return JSONResponse(
         status_code=status.HTTP_201_CREATED,
@@ -281,18 +241,20 @@ def register(form_data: UserRegister, settings: Settings = Depends(get_settings)
     )
 
 @auth.post("/logout")
-def logout(form_data: VerfiyData):
+async def logout(form_data: VerfiyData):
     payload = verify_jwt_token(form_data.token)
     if not payload:
         raise CredentialsException(msg="Invalid token")
 
     user_id = payload.get("user_id")
 
-    user_table.update_item(
+    await user_table.update_item(
         Key={"id": user_id},
         UpdateExpression="SET token_version = token_version + :inc",
         ExpressionAttributeValues={":inc": 1},
     )
+    # 登出後所有 access_token 都已失效
+    schedule_prune(user_id)
 
     return JSONResponse(
         status_code=status.HTTP_200_OK,
@@ -301,12 +263,12 @@ def logout(form_data: VerfiyData):
 
 
 @auth.get("/userinfo")
-def get_userinfo(user=Depends(require_user)):
+async def get_userinfo(user=Depends(require_user)):
     user_id = user.get("user_id", None)
     if not user_id:
         raise CredentialsException(msg="User not found")
 
-    UserItem = user_table.get_item(Key={"id": user_id})
+    UserItem = await user_table.get_item(Key={"id": user_id})
     UserItem = UserItem.get("Item", None)
 
     if not UserItem:
@@ -321,7 +283,7 @@ def get_userinfo(user=Depends(require_user)):
     )
 
 @auth.post("/updateinfo")
-def update_userinfo(form_data: UserRegister, user=Depends(require_user)):
+async def update_userinfo(form_data: UserRegister, user=Depends(require_user)):
     user_id = user.get("user_id", None)
     if not user_id:
         raise CredentialsException(msg="User not found")
@@ -338,9 +300,9 @@ def update_userinfo(form_data: UserRegister, user=Depends(require_user)):
         )
 
     # password hash
-    hashed_password = hash_password(password)
+    hashed_password = await hash_password(password)
 
-    user_table.update_item(
+    await user_table.update_item(
         Key={"id": user_id},
         UpdateExpression="SET Email = :email, Username = :username, Password = :password",
         ExpressionAttributeValues={
@@ -1,84 +1,122 @@
 from uuid import UUID, uuid4
 
 from fastapi import APIRouter, Depends, Header
-from fastapi.responses import JSONResponse
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
 from boto3.dynamodb.conditions import Key, Attr
 from datetime import datetime
 from typing import Optional
 
-from app.core.db import dynamodb
+from app.core.repository import bottle_table, deviceset_table
 from app.lib.auth import require_user
-from app.lib.data import device_is_connected, find_all_bottle_and_env_state, find_all_detect_record_with_detect_record_state, find_bottle_state, find_detect_record, get_bottle_detect_state_history, get_device_info, get_last_detect_record, split_all_detect_state_history
+from app.lib.bottle_events import get_hub, stream_events
+from app.lib.data import device_is_connected, devices_are_connected, find_all_bottle_and_env_state, find_all_detect_record_with_detect_record_state, find_bottle_state, find_bottle_states, find_detect_record, get_bottle_detect_state_history, get_bottle_detect_state_page, get_device_info, get_last_detect_record, split_all_detect_state_history
 from app.lib.device import generate_device_token
+from app.lib.etag import etag_headers, etag_matches, make_etag, not_modified
+from app.lib.presence import get_presence
+from app.lib.response import ModelJSONResponse
+from app.lib.snapshot import ensure_snapshots, mark_snapshot_verified, record_detect_time, seen_recently, snapshot_from_record, write_snapshot
 # table
 from app.models.bottle import Bottle, BottleSingleInfo, BottleStatus, DeviceSet, DisplayState, EnvDetailInfo
 # models
-from app.models.bottle import BottleMainInfo, BottleHistory, CreateBottle, BottleDetailInfo
+from app.models.bottle import BottleMainInfo, BottleHistory, BottleHistoryPage, BottleList, CreateBottle, BottleDetailInfo
 from app.core.config import Settings, get_settings
 
 bottle = APIRouter()
 
-bottle_table = dynamodb.Table("bottle")
-deviceset_table = dynamodb.Table("deviceset")
-detect_record_table = dynamodb.Table("detect_record")
-detect_record_state_table = dynamodb.Table("detect_record_state")
 
-
-@bottle.get("/")
-def get_bottle(user=Depends(require_user), settings: Settings = Depends(get_settings)):
+@bottle.get("/", response_model=BottleList)
+async def get_bottle(user=Depends(require_user), settings: Settings = Depends(get_settings), if_none_match: Optional[str] = Header(None)):
     user_id = user.get("user_id", None)
     if not user_id:
         return JSONResponse(
             status_code=401,
             content={"message": "Unauthorized"},
         )
-    bottles = bottle_table.query(
+    bottles = (await bottle_table.query(
         IndexName="UserIdIndex",
         KeyConditionExpression=Key('user_id').eq(user_id),
-    ).get("Items", [])
+    )).get("Items", [])
+
+    # 最新狀態都在 bottle item 上，只有還沒有 snapshot 的舊資料會回填一次
+    bottles = await ensure_snapshots(bottles, settings)
+    # 連線狀態以 MQTT presence 為主，不知道的先看裝置最近有沒有送出紀錄，再不知道才問上游
+    presence = get_presence(settings)
+    online = presence.online([str(bottle['device_id']) for bottle in bottles])
+    unknown = []
+    for bottle in bottles:
+        device_id = str(bottle['device_id'])
+        if online[device_id] is None:
+            if seen_recently(bottle, settings.DEVICE_ONLINE_WINDOW):
+                online[device_id] = True
+            else:
+                unknown.append(device_id)
+    for device_id, connected in (await devices_are_connected(unknown, settings)).items():
+        if connected is not None:
+            presence.seed(device_id, connected)
+        online[device_id] = bool(connected)
+
+    # 回應內容完全由 bottle item 與連線狀態決定，沒變就不用組 body
+    etag = make_etag("bottles", [
+        (str(bottle['id']), bottle['name'], bottle.get('edited_at'), bottle.get('curr_detect_record_id'), bottle.get('curr_detect_time'), online[str(bottle['device_id'])])
+        for bottle in bottles
+    ])
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
 
     res_ar = []
 
     for bottle in bottles:
-        last_detect_record = get_last_detect_record(bottle['device_id'], settings)
-        detect_record_state = last_detect_record.get('detect_record_state', {}) if last_detect_record else {}
-        env_record_state = last_detect_record.get('env_record_state', {}) if last_detect_record else {}
-
-        bt_status = BottleStatus(detect_record_state['isAbnormal']) if detect_record_state else BottleStatus.UNKNOWN
-
-        env_status = BottleStatus(env_record_state['isAbnormal']) if env_record_state else BottleStatus.UNKNOWN
-
-        print("Last Detect Record:", last_detect_record)
-
-        device_info = get_device_info(bottle.get("device_id"), settings)
-        
         res_ar.append(
             BottleMainInfo(
                 id=str(bottle['id']),
                 name=bottle['name'],
-                bottle_status=str(bt_status),
-                bottle_status_text=detect_record_state.get("type", "未知"),
-                env_status=str(env_status),
-                env_status_text=env_record_state.get("type", "未知"),
-                isConnected=device_info.get("isConnected", False),
-                imageurl=last_detect_record.get('origPhotoUrl', None) if last_detect_record else None,
+                bottle_status=str(BottleStatus(int(bottle.get('curr_bottle_status', BottleStatus.UNKNOWN)))),
+                bottle_status_text=bottle.get('curr_bottle_status_text') or "未知",
+                env_status=str(BottleStatus(int(bottle.get('curr_env_status', BottleStatus.UNKNOWN)))),
+                env_status_text=bottle.get('curr_env_status_text') or "未知",
+                isConnected=online[str(bottle['device_id'])],
+                imageurl=bottle.get('curr_image_path', None),
                 edited_at=int(bottle.get('edited_at', 0) * 1000),
                 scanned_at=int(bottle.get('scanned_at', 0) * 1000),
-            ).dict()
+            )
         )
-    print(res_ar)
 
-    return JSONResponse(
+    return ModelJSONResponse(
         status_code=200,
-        content={"bottles": res_ar},
+        content=BottleList(bottles=res_ar),
+        headers=etag_headers(etag),
+    )
+
+@bottle.get("/stream")
+async def stream_bottle_status(user=Depends(require_user), settings: Settings = Depends(get_settings)):
+    """Server-Sent Events：新的偵測結果送 `status`，裝置上下線送 `connection`，跟不上時送 `resync` (重新 GET /bottle/)。"""
+    user_id = user.get("user_id", None)
+    if not user_id:
+        return JSONResponse(
+            status_code=401,
+            content={"message": "Unauthorized"},
+        )
+    bottles = (await bottle_table.query(
+        IndexName="UserIdIndex",
+        KeyConditionExpression=Key('user_id').eq(user_id),
+        ProjectionExpression="id, device_id",
+    )).get("Items", [])
+
+    hub = get_hub(settings)
+    subscription = hub.subscribe(user_id, [(bottle['device_id'], bottle['id']) for bottle in bottles])
+    return StreamingResponse(
+        stream_events(hub, subscription, user.get("exp"), settings.BOTTLE_STREAM_KEEPALIVE),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
 
-@bottle.get("/{bottle_id}")
-def get_bottle_info(bottle_id: UUID, settings: Settings = Depends(get_settings), user=Depends(require_user)):
+@bottle.get("/{bottle_id}", response_model=BottleSingleInfo)
+async def get_bottle_info(bottle_id: UUID, settings: Settings = Depends(get_settings), user=Depends(require_user), if_none_match: Optional[str] = Header(None)):
 
-    bottle = bottle_table.get_item(
+    bottle = (await bottle_table.get_item(
         Key={"id": str(bottle_id)}
-    ).get("Item", None)
+    )).get("Item", None)
 
     if not bottle:
         return JSONResponse(
@@ -86,8 +124,15 @@ def get_bottle_info(bottle_id: UUID, settings: Settings = Depends(get_settings),
             content={"message": "Bottle not found"},
         )
 
+    # 偵測紀錄寫入後不會變動，bottle 上的 snapshot 指向同一筆就不用再問上游。
+    # snapshot 靠 record 事件更新，可能漏了事件；上次和上游確認超過 SNAPSHOT_MAX_STALENESS 就再問一次
+    snapshot_age = datetime.now().timestamp() - float(bottle.get('snapshot_verified_at', 0) or 0)
+    if bottle.get('curr_detect_record_id') and snapshot_age <= settings.SNAPSHOT_MAX_STALENESS:
+        etag = make_etag("bottle", str(bottle['id']), bottle['name'], bottle.get('edited_at'), bottle['curr_detect_record_id'], float(bottle['curr_detect_time']))
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag)
 
-    last_detect_record = get_last_detect_record(str(bottle['device_id']), settings)
+    last_detect_record = await run_in_threadpool(get_last_detect_record, str(bottle['device_id']), settings)
 
     detect_record_state = last_detect_record.get('detect_record_state', {}) if last_detect_record else {}
     env_record_state = last_detect_record.get('env_record_state', {}) if last_detect_record else {}
@@ -116,8 +161,6 @@ def get_bottle_info(bottle_id: UUID, settings: Settings = Depends(get_settings),
     env_status = BottleStatus(env_record_state['isAbnormal']) if env_record_state else BottleStatus.UNKNOWN
 
 
-    print(detect_record_state)
-
     res_bottle = BottleSingleInfo(
         detect_state_id=last_detect_record['detect_record_id'],
         name=bottle['name'],
@@ -141,13 +184,21 @@ def get_bottle_info(bottle_id: UUID, settings: Settings = Depends(get_settings),
         isError=last_detect_record.get('isError', False),
     )
 
-    return JSONResponse(
+    if last_detect_record['detect_record_id'] != bottle.get('curr_detect_record_id'):
+        # 漏掉的事件：順便修正 snapshot (只會往新的方向寫)
+        await write_snapshot(bottle['id'], snapshot_from_record(last_detect_record, detect_record_state, env_record_state))
+    else:
+        await mark_snapshot_verified(bottle['id'], last_detect_record['detect_record_id'])
+
+    etag = make_etag("bottle", str(bottle['id']), bottle['name'], bottle.get('edited_at'), last_detect_record['detect_record_id'], float(record_detect_time(last_detect_record)))
+    return ModelJSONResponse(
         status_code=200,
-        content=res_bottle.dict()
+        content=res_bottle,
+        headers=etag_headers(etag),
     )
 
 @bottle.get("/{bottle_id}/total")
-def get_bottle_total(bottle_id: UUID, user=Depends(require_user), settings: Settings = Depends(get_settings)):
+async def get_bottle_total(bottle_id: UUID, user=Depends(require_user), settings: Settings = Depends(get_settings)):
     user_id = user.get("user_id", None)
     if not user_id:
         return JSONResponse(
@@ -155,11 +206,11 @@ def get_bottle_total(bottle_id: UUID, user=Depends(require_user), settings: Sett
             content={"message": "Unauthorized"},
         )
 
-    bottle = bottle_table.query(
+    bottle = (await bottle_table.query(
         IndexName='UserIdIndex',
         KeyConditionExpression=Key('user_id').eq(str(user_id)),
         FilterExpression=Attr('id').eq(str(bottle_id))
-    ).get("Items", [])
+    )).get("Items", [])
     bottle = bottle[0] if bottle else None
 
     if not bottle:
@@ -168,34 +219,25 @@ def get_bottle_total(bottle_id: UUID, user=Depends(require_user), settings: Sett
             content={"message": "Bottle not found"},
         )
 
-    last_detect_record = get_bottle_detect_state_history(device_id=str(bottle['device_id']), s=0, e=None, settings=settings)
-
-    if len(last_detect_record) == 0:
-        return JSONResponse(
-            status_code=200,
-            content={"total_scans": 0},
-        )
-
+    total_scans = bottle.get("total_scans", None)
 
-    if not last_detect_record:
-        return JSONResponse(
-            status_code=404,
-            content={"message": "No scans found for this bottle"},
-        )
-
-    res = {
-        "total_scans": len(last_detect_record)
-    }
-
-    print(res)
+    if total_scans is None:
+        # 計數器上線前建立的瓶子，回填一次
+        total_scans = len(await run_in_threadpool(get_bottle_detect_state_history, device_id=str(bottle['device_id']), s=0, e=None, settings=settings))
+        total_scans = (await bottle_table.update_item(
+            Key={"id": bottle['id']},
+            UpdateExpression="SET total_scans = if_not_exists(total_scans, :total)",
+            ExpressionAttributeValues={":total": total_scans},
+            ReturnValues="UPDATED_NEW",
+        ))["Attributes"]["total_scans"]
 
     return JSONResponse(
         status_code=200,
-        content=res,
+        content={"total_scans": int(total_scans)},
     )
 
-@bottle.get("/{bottle_id}/history")
-def get_bottle_history(bottle_id: str, s: int, e: int, user=Depends(require_user), settings: Settings = Depends(get_settings)):
+@bottle.get("/{bottle_id}/history", response_model=BottleHistoryPage)
+async def get_bottle_history(bottle_id: str, limit: int = 20, cursor: Optional[str] = None, s: Optional[int] = None, e: Optional[int] = None, user=Depends(require_user), settings: Settings = Depends(get_settings), if_none_match: Optional[str] = Header(None)):
     user_id = user.get("user_id", None)
     if not user_id:
         return JSONResponse(
@@ -203,17 +245,27 @@ def get_bottle_history(bottle_id: str, s: int, e: int, user=Depends(require_user
             content={"message": "Unauthorized"},
         )
 
-    if s < 0 or e < 0 or s > e or (e - s) > 100:
+    # 舊版 App 以 s/e 分頁，換算成 offset + limit
+    offset = None
+    if s is not None or e is not None:
+        if s is None or e is None or s < 0 or e < 0 or s > e or (e - s) > 100:
+            return JSONResponse(
+                status_code=400,
+                content={"message": "Invalid range"},
+            )
+        offset, limit = s, e - s
+
+    if limit < 0 or limit > 100:
         return JSONResponse(
             status_code=400,
             content={"message": "Invalid range"},
         )
 
-    bottle = bottle_table.query(
+    bottle = (await bottle_table.query(
         IndexName='UserIdIndex',
         KeyConditionExpression=Key('user_id').eq(str(user_id)),
         FilterExpression=Attr('id').eq(str(bottle_id))
-    ).get("Items", [])
+    )).get("Items", [])
     bottle = bottle[0] if bottle else None
 
     if not bottle:
@@ -221,21 +273,34 @@ def get_bottle_history(bottle_id: str, s: int, e: int, user=Depends(require_user
             status_code=404,
             content={"message": "Bottle not found"},
         )
-    scans = get_bottle_detect_state_history(device_id=bottle.get("device_id", ""), s=0, e=None, settings=settings)
-
-    state = find_all_bottle_and_env_state(settings) 
-
+    if limit == 0:
+        return JSONResponse(
+            status_code=200,
+            content={"history": [], "next": None},
+        )
 
-    scans = split_all_detect_state_history(scans, s, e, settings)
+    # 新增紀錄會換掉 curr_detect_record_id，刪除會改 total_scans；兩者都有才能判斷
+    etag = None
+    if 'curr_detect_time' in bottle and 'total_scans' in bottle:
+        etag = make_etag("history", str(bottle['id']), bottle.get('curr_detect_record_id'), bottle['curr_detect_time'], bottle['total_scans'], limit, cursor, offset)
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag)
 
-    print(scans)
+    try:
+        scans, next_cursor = await run_in_threadpool(get_bottle_detect_state_page, bottle.get("device_id", ""), limit, cursor, settings, offset=offset)
+    except ValueError:
+        return JSONResponse(
+            status_code=400,
+            content={"message": "Invalid cursor"},
+        )
 
+    # state 快取沒命中時會打上游，放到 threadpool
+    bottle_states = await run_in_threadpool(find_bottle_states, [scan['bottleStateID'] for scan in scans], settings)
 
     res_ar = []
 
-    for scan in scans:
+    for scan, bottle_status in zip(scans, bottle_states):
         isError = scan.get('isError', False)
-        bottle_status = find_bottle_state(state, scan['bottleStateID'])
         bt_status = BottleStatus(bottle_status['isAbnormal']) if bottle_status else BottleStatus.UNKNOWN
         bt_status = BottleStatus.WARNING if isError else bt_status
 
@@ -247,15 +312,14 @@ def get_bottle_history(bottle_id: str, s: int, e: int, user=Depends(require_user
             detail=f"/home/{bottle_id}/history/{str(scan['detect_record_id'])}"
         ))
 
-    return JSONResponse(
+    return ModelJSONResponse(
         status_code=200,
-        content={
-            "history": [item.dict() for item in res_ar],
-        },
+        content=BottleHistoryPage(history=res_ar, next=next_cursor),
+        headers=etag_headers(etag) if etag else None,
     )
 
-@bottle.get("/{bottle_id}/history/{history_id}")
-def get_bottle_history_detail(bottle_id: str, history_id: str, user=Depends(require_user), settings: Settings = Depends(get_settings)):
+@bottle.get("/{bottle_id}/history/{history_id}", response_model=BottleSingleInfo)
+async def get_bottle_history_detail(bottle_id: str, history_id: str, user=Depends(require_user), settings: Settings = Depends(get_settings), if_none_match: Optional[str] = Header(None)):
     user_id = user.get("user_id", None)
     if not user_id:
         return JSONResponse(
@@ -263,11 +327,11 @@ def get_bottle_history_detail(bottle_id: str, history_id: str, user=Depends(requ
             content={"message": "UnauthorizeUploadFiled"},
         )
 
-    bottle = bottle_table.query(
+    bottle = (await bottle_table.query(
         IndexName='UserIdIndex',
         KeyConditionExpression=Key('user_id').eq(str(user_id)),
         FilterExpression=Attr('id').eq(str(bottle_id))
-    ).get("Items", [])
+    )).get("Items", [])
     bottle = bottle[0] if bottle else None
 
     if not bottle:
@@ -276,7 +340,12 @@ def get_bottle_history_detail(bottle_id: str, history_id: str, user=Depends(requ
             content={"message": "Bottle not found"},
         )
 
-    scan = find_detect_record(bottle['device_id'], history_id, settings)
+    # 紀錄寫入後不會變動；每次刪除都會增加 bottle 上的 records_deleted，所有 replica 都看得到
+    etag = make_etag("record", str(bottle['id']), bottle['name'], bottle.get('edited_at'), int(bottle.get('records_deleted', 0)), history_id)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+
+    scan = await run_in_threadpool(find_detect_record, bottle['device_id'], history_id, settings)
     
     if not scan:
         return JSONResponse(
@@ -327,13 +396,14 @@ def get_bottle_history_detail(bottle_id: str, history_id: str, user=Depends(requ
         isError=scan.get('isError', False),
     )
 
-    return JSONResponse(
+    return ModelJSONResponse(
         status_code=200,
-        content=res_bottle.dict(),
+        content=res_bottle,
+        headers=etag_headers(etag),
     )
 
 @bottle.post("/newBottle")
-def create_new_bottle(form_data: CreateBottle, user=Depends(require_user)):
+async def create_new_bottle(form_data: CreateBottle, user=Depends(require_user)):
     user_id = user.get("user_id", None)
     if not user_id:
         return JSONResponse(
@@ -347,11 +417,11 @@ def create_new_bottle(form_data: CreateBottle, user=Depends(require_user)):
             content={"message": "Bottle name is required"},
         )
     #check if bottle name is already in database for this user
-    existing_bottle = bottle_table.query(
+    existing_bottle = (await bottle_table.query(
         IndexName="UserIdIndex",
         KeyConditionExpression=Key('user_id').eq(user_id),
         FilterExpression=Attr('name').eq(form_data.name)
-    ).get("Items", [])
+    )).get("Items", [])
 
     if existing_bottle:
         return JSONResponse(
@@ -376,8 +446,8 @@ def create_new_bottle(form_data: CreateBottle, user=Depends(require_user)):
         name=form_data.name,
     )
 
-    bottle_table.put_item(Item=bottle.dict())
-    deviceset_table.put_item(Item=bottle_device.dict())
+    await bottle_table.put_item(Item=bottle.dict())
+    await deviceset_table.put_item(Item=bottle_device.dict())
 
     token_device_id = generate_device_token(bottle_device_id, bottle.id)
 
@@ -391,7 +461,7 @@ def create_new_bottle(form_data: CreateBottle, user=Depends(require_user)):
 
     
 @bottle.delete("/{bottle_id}")
-def delete_bottle(bottle_id: UUID, user=Depends(require_user)):
+async def delete_bottle(bottle_id: UUID, user=Depends(require_user)):
     user_id = user.get("user_id", None)
     if not user_id:
         return JSONResponse(
@@ -399,9 +469,9 @@ def delete_bottle(bottle_id: UUID, user=Depends(require_user)):
             content={"message": "Unauthorized"},
         )
 
-    bottle = bottle_table.get_item(
+    bottle = (await bottle_table.get_item(
         Key={"id": str(bottle_id)}
-    ).get("Item", None)
+    )).get("Item", None)
 
     if not bottle or bottle.get("user_id", None) != user_id:
         return JSONResponse(
@@ -410,7 +480,7 @@ def delete_bottle(bottle_id: UUID, user=Depends(require_user)):
         )
 
     # delete bottle
-    bottle_table.delete_item(
+    await bottle_table.delete_item(
         Key={"id": str(bottle_id)}
     )
 
@@ -1,5 +1,6 @@
 from fastapi import APIRouter, Depends, UploadFile
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 from boto3.dynamodb.conditions import Key, Attr
 from typing import Optional
 from uuid import uuid4
@@ -7,22 +8,27 @@ import os
 import datetime
 
 from app.core.config import Settings, get_settings
-from app.core.db import dynamodb
-from app.lib.build_firmware import build_zip, put_data, run_build
+from app.core.repository import bottle_table
+from app.lib.build_firmware import put_data, secrets_values, stream_zip
+from app.lib.bottle_events import get_hub
+from app.lib.build_jobs import get_build_job, get_build_queue
 from app.lib.data import create_new_device, device_connect_check, find_bottle_and_env_state, get_device_info, get_os_file_content, manual_device_shot, manual_scan_bottle, update_device_all_info, update_device_info
 from app.lib.device import generate_device_token
-from app.lib.auth import require_user
+from app.lib.auth import device_allowed, require_device, require_user
+from app.lib.presence import get_presence
+from app.lib.state_cache import get_record_cache
+from app.lib.response import ModelJSONResponse
+from app.lib.scan_events import count_scan_event
+from app.lib.snapshot import apply_record, remove_record
 from app.lib.file import download_file_requests, upload_file, upload_file_check
 # table
-from app.models.bottle import Bottle, BottleDetailInfo, BottleSingleInfo, BottleStatus, DetectRecord, DetectRecordState, DisplayState, EnvDetailInfo, GetDeviceInfo, ManualDeviceShot, NewDeviceInfo, Status
+from app.models.bottle import Bottle, BottleDetailInfo, BottleSingleInfo, BottleStatus, DetectRecord, DetectRecordEvent, DetectRecordState, DisplayState, EnvDetailInfo, GetDeviceInfo, ManualDeviceShot, NewDeviceInfo, RecordEventType, Status
 from app.models.bottle import UpdateBottle
 
 device = APIRouter()
 
-bottle_table = dynamodb.Table("bottle")
-
 @device.post("/getDevice")
-def get_device(data: GetDeviceInfo, user=Depends(require_user), settings: Settings = Depends(get_settings)):
+async def get_device(data: GetDeviceInfo, user=Depends(require_user), settings: Settings = Depends(get_settings)):
     user_id = user.get("user_id", None)
     if not user_id:
         return JSONResponse(
@@ -34,16 +40,16 @@ def get_device(data: GetDeviceInfo, user=Depends(require_user), settings: Settin
             status_code=400,
             content={"message": "device_id are required"},
         )
-    bottle = bottle_table.get_item(
+    bottle = (await bottle_table.get_item(
         Key={"id": data.bottle_id}
-    ).get("Item", None)
+    )).get("Item", None)
     if not bottle or bottle.get("user_id", None) != user_id:
         return JSONResponse(
             status_code=404,
             content={"message": "Bottle not found"},
         )
 
-    device_info = get_device_info(bottle.get("device_id", ""), settings)
+    device_info = await run_in_threadpool(get_device_info, bottle.get("device_id", ""), settings)
 
     return JSONResponse(
         status_code=200,
@@ -55,7 +61,7 @@ def get_device(data: GetDeviceInfo, user=Depends(require_user), settings: Settin
     )
 
 @device.put("/updateDevice")
-def update_device(freq: int, name: str, device_id: str, user=Depends(require_user), settings: Settings = Depends(get_settings)):
+async def update_device(freq: int, name: str, device_id: str, user=Depends(require_user), settings: Settings = Depends(get_settings)):
     user_id = user.get("user_id", None)
     if not user_id:
         return JSONResponse(
@@ -69,7 +75,7 @@ def update_device(freq: int, name: str, device_id: str, user=Depends(require_use
         "detectFreq": freq,
     }
 
-    success = update_device_info(data, settings)
+    success = await run_in_threadpool(update_device_info, data, settings)
 
     if not success:
         return JSONResponse(
@@ -82,20 +88,19 @@ def update_device(freq: int, name: str, device_id: str, user=Depends(require_use
         content={"message": "Device updated successfully"},
     )
 
-@device.post("/manualUpdate")
-def manual_update(file: UploadFile, temperature: Optional[float] = None, humidity: Optional[float] = None, user=Depends(require_user), settings: Settings = Depends(get_settings)):
+@device.post("/manualUpdate", response_model=BottleSingleInfo)
+async def manual_update(file: UploadFile, temperature: Optional[float] = None, humidity: Optional[float] = None, user=Depends(require_user), settings: Settings = Depends(get_settings)):
     user_id = user.get("user_id", None)
     if not user_id:
         return JSONResponse(
             status_code=401,
             content={"message": "Unauthorized"},
         )
-    try:
-        upload_file_check(file, settings)
-    except JSONResponse as e:
-        return e
+    check = upload_file_check(file, settings)
+    if check is not None:
+        return check
 
-    res = manual_scan_bottle(file, temperature, humidity, settings)
+    res = await run_in_threadpool(manual_scan_bottle, file, temperature, humidity, settings)
 
     if not res:
         return JSONResponse(
@@ -108,27 +113,29 @@ def manual_update(file: UploadFile, temperature: Optional[float] = None, humidit
             content={"message": res.get("message", "Failed to record manual update")},
         )
 
-    try:
-        ori_image_path = upload_file(user_id, file, "original", settings)
-    except JSONResponse as e:
-        return e
+    ori_image_path = await run_in_threadpool(upload_file, user_id, file, "original", settings)
+    if isinstance(ori_image_path, JSONResponse):
+        return ori_image_path
 
     ai_image_path = ori_image_path.replace("original", "ai")
     
     try:
-        download_file_requests(res['orgPhotoUrl'], ai_image_path)
+        await run_in_threadpool(download_file_requests, res['orgPhotoUrl'], ai_image_path)
     except Exception as e:
         return JSONResponse(
             status_code=500,
             content={"message": f"Failed to download original image: {str(e)}"},
         )
-    detect_record_state, env_record_state = find_bottle_and_env_state(res['bottleStateID'], res.get('envStateID', ''), settings)
+    detect_record_state, env_record_state = await run_in_threadpool(find_bottle_and_env_state, res['bottleStateID'], res.get('envStateID', ''), settings)
 
     bt_status = BottleStatus(detect_record_state['isAbnormal']) if detect_record_state else BottleStatus.UNKNOWN
     env_status = BottleStatus(env_record_state['isAbnormal']) if env_record_state else BottleStatus.UNKNOWN
 
 
+    # 手動上傳不屬於任何 bottle，沒有名稱；時間與其他 route 一樣用毫秒
     res_bottle = BottleSingleInfo(
+        detect_state_id=res.get('detect_record_id'),
+        name=None,
         bottleState=BottleDetailInfo(
             bottle_status=str(bt_status),
             bottle_status_text=detect_record_state.get('type', "未知"),
@@ -142,19 +149,20 @@ def manual_update(file: UploadFile, temperature: Optional[float] = None, humidit
         displayState=DisplayState(
             temperature=temperature,
             humidity=humidity,
-            time=datetime.datetime.utcnow().timestamp(),
+            time=int(datetime.datetime.now().timestamp() * 1000),
         ),
         oriimageUri=ori_image_path,
         AIimageUri=ai_image_path,
+        isError=res.get('isError', False),
     )
 
-    return JSONResponse(
+    return ModelJSONResponse(
         status_code=200,
-        constent=res_bottle.dict()
+        content=res_bottle,
     )
 
 @device.post("/newDevice")
-def new_device(data: NewDeviceInfo,user=Depends(require_user), settings: Settings = Depends(get_settings)):
+async def new_device(data: NewDeviceInfo,user=Depends(require_user), settings: Settings = Depends(get_settings)):
     user_id = user.get("user_id", None)
     if not user_id:
         return JSONResponse(
@@ -164,9 +172,9 @@ def new_device(data: NewDeviceInfo,user=Depends(require_user), settings: Setting
 
     device_id = generate_device_token()
 
-    res = create_new_device(device_id, data.name, data.detectFreq, settings)
+    res = await run_in_threadpool(create_new_device, device_id, data.name, data.detectFreq, settings)
 
-    res2 = bottle_table.put_item(
+    res2 = await bottle_table.put_item(
         Item=Bottle(
             id=str(uuid4()),
             user_id=user_id,
@@ -188,7 +196,7 @@ def new_device(data: NewDeviceInfo,user=Depends(require_user), settings: Setting
     CRT = get_os_file_content(settings.IOT_CERT_CRT).decode('utf-8')
     PRIVATE = get_os_file_content(settings.IOT_PRIVATE_KEY).decode('utf-8')
 
-    secrets_h =  put_data(
+    secrets_args = dict(
         WIFI_SSID=data.wifiSSID,
         WIFI_PASSWORD=data.wifiPassword,
         AWS_IOT_ENDPOINT=settings.IOT_ENDPOINT,
@@ -197,29 +205,51 @@ def new_device(data: NewDeviceInfo,user=Depends(require_user), settings: Setting
         CERT_CRT=CRT,
         CERT_PRIVATE=PRIVATE,
     )
+    secrets_h = put_data(**secrets_args)
 
-    res = update_device_all_info(device_id, data.name, data.detectFreq, settings.IOT_ENDPOINT, CRT, PRIVATE, settings)
+    res = await run_in_threadpool(update_device_all_info, device_id, data.name, data.detectFreq, settings.IOT_ENDPOINT, CRT, PRIVATE, settings)
     if not res:
         return JSONResponse(
             status_code=500,
             content={"message": "Failed to update device info"},
         )
 
-    try:
-        res_bin_path = run_build(device_id, secrets_h, settings)
-        if not res_bin_path:
-            raise Exception("請先建立專案目錄並放入程式碼。")
-        res_zip_path = build_zip(device_id, secrets_h, settings)
-    except Exception as e:
+    # 編譯交給背景 worker，用 job_id 查詢進度
+    job = await get_build_queue(settings).submit(user_id, device_id, secrets_h, secrets_values(**secrets_args), settings)
+
+    return JSONResponse(
+        status_code=202,
+        content={
+            "device_id": device_id,
+            "job_id": job.id,
+        },
+    )
+
+@device.get("/builds/{job_id}")
+async def get_firmware_build(job_id: str, user=Depends(require_user), settings: Settings = Depends(get_settings)):
+    user_id = user.get("user_id", None)
+    if not user_id:
         return JSONResponse(
-            status_code=500,
-            content={"message": f"Failed to build firmware: {str(e)}"},
+            status_code=401,
+            content={"message": "Unauthorized"},
+        )
+
+    job = await get_build_job(job_id, settings)
+    if not job or job.user_id != user_id:
+        return JSONResponse(
+            status_code=404,
+            content={"message": "Build job not found"},
         )
 
     return JSONResponse(
         status_code=200,
         content={
-            "device_id": device_id,
+            "job_id": job.id,
+            "device_id": job.device_id,
+            "status": job.status.value,
+            "error": job.error,
+            "created_at": job.created_at,
+            "updated_at": job.updated_at,
         },
     )
 
@@ -240,11 +270,22 @@ async def download_device_firmware(device_id: str, settings: Settings = Depends(
 
 @device.get("/{device_id}/zip")
 async def download_device_firmware_zip(device_id: str, settings: Settings = Depends(get_settings), user=Depends(require_user)):
-    file_path = f"{settings.FILE_FOLDER}/{device_id}/{device_id}.zip"
-    
+    file_path = f"{settings.FILE_FOLDER}/{device_id}/secrets.h"
+
     if os.path.exists(file_path):
+        with open(file_path, "r", encoding="utf-8") as f:
+            secrets_content = f.read()
+        return StreamingResponse(
+            stream_zip(secrets_content),
+            media_type="application/zip",
+            headers={"Content-Disposition": f'attachment; filename="firmware_{device_id}.zip"'},
+        )
+
+    # 舊版建立的裝置沒有 secrets.h，只有當時打包好的 zip
+    legacy_path = f"{settings.FILE_FOLDER}/{device_id}/{device_id}.zip"
+    if os.path.exists(legacy_path):
         return FileResponse(
-            path=file_path,
+            path=legacy_path,
             filename=f"firmware_{device_id}.zip",
             media_type="application/zip"
         )
@@ -254,7 +295,7 @@ async def download_device_firmware_zip(device_id: str, settings: Settings = Depe
     )
 
 @device.post("/manualScan")
-def manual_scan(data: ManualDeviceShot, user=Depends(require_user), settings: Settings = Depends(get_settings)):
+async def manual_scan(data: ManualDeviceShot, user=Depends(require_user), settings: Settings = Depends(get_settings)):
     user_id = user.get("user_id", None)
     if not user_id:
         return JSONResponse(
@@ -262,7 +303,7 @@ def manual_scan(data: ManualDeviceShot, user=Depends(require_user), settings: Se
             content={"message": "Unauthorized"},
         )
     try:
-        res = manual_device_shot(data.device_id, settings)
+        res = await run_in_threadpool(manual_device_shot, data.device_id, settings)
     except JSONResponse as e:
         return e
 
@@ -277,21 +318,73 @@ def manual_scan(data: ManualDeviceShot, user=Depends(require_user), settings: Se
     )
 
 @device.get("/{device_id}/connect")
-def check_device_connect(device_id: str, settings: Settings = Depends(get_settings), user=Depends(require_user)):
+async def check_device_connect(device_id: str, settings: Settings = Depends(get_settings), user=Depends(require_user)):
     user_id = user.get("user_id", None)
     if not user_id:
         return JSONResponse(
             status_code=401,
             content={"message": "Unauthorized"},
         )
-    isConnected = device_connect_check(device_id, settings)
+    # 先查 MQTT presence；訂閱沒連上或還沒收到這台的事件才打上游
+    presence = get_presence(settings)
+    isConnected = presence.get(device_id)
     if isConnected is None:
+        isConnected = await run_in_threadpool(device_connect_check, device_id, settings)
+        if isConnected is None:
+            return JSONResponse(
+                status_code=500,
+                content={"message": "Failed to check device connection"},
+            )
+        presence.seed(device_id, isConnected)
+
+    return JSONResponse(
+        status_code=200,
+        content={"isConnected": isConnected},
+    )
+
+@device.post("/{device_id}/records")
+async def detect_record_event(device_id: str, data: DetectRecordEvent, caller=Depends(require_device), settings: Settings = Depends(get_settings)):
+    if not device_allowed(caller, device_id):
         return JSONResponse(
-            status_code=500,
-            content={"message": "Failed to check device connection"},
+            status_code=403,
+            content={"message": "Forbidden"},
+        )
+    bottle = (await bottle_table.query(
+        IndexName="DeviceIdIndex",
+        KeyConditionExpression=Key('device_id').eq(device_id),
+    )).get("Items", [])
+    bottle = bottle[0] if bottle else None
+
+    if not bottle:
+        return JSONResponse(
+            status_code=404,
+            content={"message": "Bottle not found"},
+        )
+
+    record_id = data.detect_record.get("detect_record_id")
+    if data.event == RecordEventType.CREATED:
+        # 裝置送來的紀錄代表裝置剛剛在線，超過 DEVICE_ONLINE_WINDOW 就不再算數
+        extra = {"last_seen": int(datetime.datetime.now().timestamp())} if data.detect_record.get("isFromDevice", True) else None
+        snapshot = await apply_record(bottle['id'], data.detect_record, settings, extra)
+        if snapshot:
+            get_hub(settings).publish_status(bottle, {**snapshot, **(extra or {})})
+    elif record_id:
+        get_record_cache(settings).invalidate(device_id, record_id)
+        # 紀錄詳細頁的 ETag 版本
+        await bottle_table.update_item(
+            Key={"id": bottle['id']},
+            UpdateExpression="ADD records_deleted :one",
+            ExpressionAttributeValues={":one": 1},
         )
+        rebuilt = await remove_record(bottle, record_id, settings)
+        if rebuilt:
+            get_hub(settings).publish_status(bottle, rebuilt)
+
+    # 沒有 detect_record_id 的事件無法去重，不計入 total_scans
+    if record_id:
+        await count_scan_event(bottle, record_id, data.event, settings)
 
     return JSONResponse(
         status_code=200,
-        content={"isConnected": isConnected},
-    )
\ No newline at end of file
+        content={"message": "Event recorded"},
+    )
@@ -0,0 +1,66 @@
+"""Pick argon2 parameters whose verify latency stays under a target on this host.
+
+    python -m benchmarks.argon2_calibrate --target-ms 250 --memory 19456,47104,65536 --parallelism 4
+
+For each memory cost, time_cost is raised until the median verify time exceeds the target.
+The strongest setting under the target (largest memory * time) is printed as .env lines.
+"""
+import argparse
+import statistics
+import time
+
+from argon2 import PasswordHasher
+
+PASSWORD = "calibration-password"
+
+
+def verify_ms(time_cost: int, memory_cost: int, parallelism: int, rounds: int) -> float:
+    ph = PasswordHasher(time_cost=time_cost, memory_cost=memory_cost, parallelism=parallelism)
+    hashed = ph.hash(PASSWORD)
+    samples = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        ph.verify(hashed, PASSWORD)
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def calibrate(target_ms: float, memory_costs, parallelism: int, rounds: int, max_time_cost: int):
+    best = None
+    for memory_cost in memory_costs:
+        chosen = None
+        for time_cost in range(1, max_time_cost + 1):
+            ms = verify_ms(time_cost, memory_cost, parallelism, rounds)
+            print(f"m={memory_cost:>7}KiB t={time_cost:>2} p={parallelism} verify={ms:7.1f}ms")
+            if ms > target_ms:
+                break
+            chosen = (time_cost, memory_cost, ms)
+        if chosen and (best is None or chosen[0] * chosen[1] > best[0] * best[1]):
+            best = chosen
+    return best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--target-ms", type=float, default=250)
+    parser.add_argument("--memory", type=str, default="19456,47104,65536", help="KiB, comma separated")
+    parser.add_argument("--parallelism", type=int, default=4)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--max-time-cost", type=int, default=10)
+    args = parser.parse_args()
+
+    best = calibrate(
+        args.target_ms,
+        [int(m) for m in args.memory.split(",")],
+        args.parallelism,
+        args.rounds,
+        args.max_time_cost,
+    )
+    if best is None:
+        print(f"no setting verifies under {args.target_ms}ms, lower --memory")
+    else:
+        time_cost, memory_cost, ms = best
+        print(f"\n# verify ~{ms:.1f}ms")
+        print(f"ARGON2_TIME_COST={time_cost}")
+        print(f"ARGON2_MEMORY_COST={memory_cost}")
+        print(f"ARGON2_PARALLELISM={args.parallelism}")
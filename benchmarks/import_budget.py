@@ -0,0 +1,67 @@
+"""Fail when importing app.main gets slower than a budget or pulls in modules that should load lazily.
+
+    python -m benchmarks.import_budget --budget-ms 1000 --runs 5
+
+Each run is a fresh `python -X importtime -c "import app.main"`; the median cumulative time is compared to the budget.
+Exit status is 1 on regression, so it can run in CI before deploying to Modal.
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+# 啟動時不應該載入的模組 (都改成第一次使用時才 import)
+LAZY_MODULES = ["requests", "jose"]
+
+
+def measure() -> dict:
+    res = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app.main"],
+        capture_output=True,
+        text=True,
+        env=os.environ.copy(),
+    )
+    if res.returncode != 0:
+        sys.stderr.write(res.stderr)
+        raise SystemExit("import app.main failed")
+
+    modules = {}
+    for line in res.stderr.splitlines():
+        match = LINE.match(line)
+        if match:
+            self_us, cumulative_us, _, name = match.groups()
+            modules[name] = (int(self_us), int(cumulative_us))
+    return modules
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--budget-ms", type=float, default=1000)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    runs = [measure() for _ in range(args.runs)]
+    totals = sorted(run["app.main"][1] / 1000 for run in runs)
+    median = statistics.median(totals)
+
+    slowest = sorted(runs[-1].items(), key=lambda item: item[1][0], reverse=True)[: args.top]
+    print("slowest modules (self time):")
+    for name, (self_us, cumulative_us) in slowest:
+        print(f"  {self_us / 1000:7.1f}ms  {cumulative_us / 1000:7.1f}ms  {name}")
+
+    print(f"import app.main: median={median:.1f}ms min={totals[0]:.1f}ms max={totals[-1]:.1f}ms budget={args.budget_ms:.0f}ms")
+
+    failed = False
+    eager = [name for name in LAZY_MODULES if name in runs[-1]]
+    if eager:
+        print(f"FAIL: imported at startup, should be lazy: {', '.join(eager)}")
+        failed = True
+    if median > args.budget_ms:
+        print("FAIL: over budget")
+        failed = True
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,134 @@
+"""Local stand-in for the AWS IoT broker: checks the presence registry and times batch lookups.
+
+    python -m benchmarks.presence_broker --devices 2000 --lookups 1000
+
+The broker speaks just enough MQTT 3.1.1 (CONNACK, SUBACK, PINGRESP, QoS 1 PUBLISH) for app.lib.mqtt.
+It publishes lifecycle events, heartbeats and last-will `offline` messages for synthetic devices,
+then verifies what the registry reports and how long `online()` takes for a dashboard-sized batch.
+Exit status is 1 if any device ends up with the wrong state.
+"""
+import argparse
+import asyncio
+import json
+import random
+import struct
+import sys
+import time
+
+from app.core.config import get_settings
+from app.lib.mqtt import CONNACK, CONNECT, PINGREQ, PUBACK, PUBLISH, SUBACK, SUBSCRIBE, MQTTSubscriber, packet, read_packet
+from app.lib.presence import PresenceRegistry
+
+PINGRESP = 0xD0
+
+
+class StandInBroker:
+    def __init__(self):
+        self.clients = []
+        self.subscribed = asyncio.Event()
+        self.acked = 0
+        self._packet_id = 0
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                header, body = await read_packet(reader)
+                kind = header & 0xF0
+                if kind == CONNECT:
+                    writer.write(packet(CONNACK, b"\x00\x00"))
+                elif kind == SUBSCRIBE & 0xF0:
+                    writer.write(packet(SUBACK, body[:2] + b"\x01" * len(self._topics(body))))
+                    self.clients.append(writer)
+                    self.subscribed.set()
+                elif kind == PINGREQ:
+                    writer.write(packet(PINGRESP))
+                elif kind == PUBACK:
+                    self.acked += 1
+        except asyncio.IncompleteReadError:
+            pass
+
+    @staticmethod
+    def _topics(body: bytes) -> list:
+        topics, pos = [], 2
+        while pos < len(body):
+            (length,) = struct.unpack_from("!H", body, pos)
+            topics.append(body[pos + 2:pos + 2 + length].decode())
+            pos += 2 + length + 1  # 後面一個 byte 是 QoS
+        return topics
+
+    def publish(self, topic: str, payload: bytes):
+        self._packet_id = self._packet_id % 65535 + 1
+        raw = topic.encode()
+        body = struct.pack("!H", len(raw)) + raw + struct.pack("!H", self._packet_id) + payload
+        for writer in self.clients:
+            writer.write(packet(PUBLISH | 0x02, body))
+
+
+async def main(args) -> bool:
+    broker = StandInBroker()
+    server = await asyncio.start_server(broker.handle, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+
+    registry = PresenceRegistry(get_settings())
+    subscriber = MQTTSubscriber(
+        host="127.0.0.1", port=port, client_id="presence-bench",
+        topics=["$aws/events/presence/+/+", "biocherish/+/heartbeat", "biocherish/+/status"],
+        on_message=registry.on_message, on_state=registry.set_live,
+    )
+    task = asyncio.create_task(subscriber.run())
+    await asyncio.wait_for(broker.subscribed.wait(), timeout=5)
+
+    devices = [f"device-{i}" for i in range(args.devices)]
+    expected = {}
+    now_ms = int(time.time() * 1000)
+    for i, device_id in enumerate(devices):
+        broker.publish(f"$aws/events/presence/connected/{device_id}", json.dumps({"clientId": device_id, "timestamp": now_ms}).encode())
+        kind = i % 4
+        if kind == 0:
+            broker.publish(f"biocherish/{device_id}/heartbeat", b"{}")
+            expected[device_id] = True
+        elif kind == 1:
+            # last will：broker 偵測到非正常斷線時送出
+            broker.publish(f"biocherish/{device_id}/status", b"offline")
+            expected[device_id] = False
+        elif kind == 2:
+            broker.publish(f"$aws/events/presence/disconnected/{device_id}", json.dumps({"clientId": device_id, "timestamp": now_ms + 1}).encode())
+            expected[device_id] = False
+        else:
+            # 重連時舊連線的 disconnected 晚到，不應該蓋掉較新的 connected
+            broker.publish(f"$aws/events/presence/disconnected/{device_id}", json.dumps({"clientId": device_id, "timestamp": now_ms - 1000}).encode())
+            expected[device_id] = True
+
+    published = broker._packet_id
+    deadline = time.monotonic() + 10
+    while broker.acked < published and time.monotonic() < deadline:
+        await asyncio.sleep(0.01)
+
+    lookups = []
+    for _ in range(args.lookups):
+        batch = random.sample(devices, min(args.batch, len(devices)))
+        start = time.perf_counter()
+        registry.online(batch)
+        lookups.append(time.perf_counter() - start)
+    lookups.sort()
+
+    states = registry.online(devices + ["device-unknown"])
+    wrong = [device_id for device_id in devices if states[device_id] != expected[device_id]]
+
+    task.cancel()
+    server.close()
+
+    print(f"published={published} acked={broker.acked} stats={registry.stats()}")
+    print(f"online() batch={args.batch}: p50={lookups[len(lookups) // 2] * 1e6:.1f}us p99={lookups[int(len(lookups) * 0.99)] * 1e6:.1f}us")
+    print(f"unknown device -> {states['device-unknown']}")
+    if wrong:
+        print(f"FAIL: {len(wrong)} devices in the wrong state, e.g. {wrong[:5]}")
+    return not wrong and states["device-unknown"] is None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--devices", type=int, default=2000)
+    parser.add_argument("--lookups", type=int, default=1000)
+    parser.add_argument("--batch", type=int, default=50)
+    sys.exit(0 if asyncio.run(main(parser.parse_args())) else 1)
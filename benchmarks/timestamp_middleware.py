@@ -0,0 +1,100 @@
+"""Compare the old buffering timestamp middleware with TimestampJSONMiddleware on a large history payload.
+
+    python -m benchmarks.timestamp_middleware --items 5000 --rounds 50
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import time
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+from app.middlewares.response import TimestampJSONMiddleware
+
+
+async def add_timestamp_to_json_response(request: Request, call_next):
+    # 舊版：整包讀出 -> json.loads -> JSONResponse 重新序列化
+    response = await call_next(request)
+
+    if "application/json" in response.headers.get("content-type", ""):
+        body = [section async for section in response.body_iterator]
+        raw_data = b"".join(body).decode()
+
+        try:
+            data = json.loads(raw_data)
+        except Exception:
+            data = raw_data
+
+        if isinstance(data, dict):
+            data["timestamp"] = int(datetime.datetime.utcnow().timestamp())
+            old_headers = dict(response.headers)
+            response = JSONResponse(content=data, status_code=response.status_code)
+            old_headers.pop("content-length", None)
+            response.init_headers(old_headers)
+
+    return response
+
+
+def build_app(items: int, legacy: bool) -> FastAPI:
+    app = FastAPI()
+    history = [
+        {
+            "id": f"record-{i:08d}",
+            "status": "good",
+            "status_text": "正常",
+            "detail": f"/home/bottle/history/record-{i:08d}",
+            "scanned_at": 1700000000000 + i,
+        }
+        for i in range(items)
+    ]
+
+    @app.get("/history")
+    def get_history():
+        return JSONResponse(status_code=200, content={"history": history, "next": None})
+
+    if legacy:
+        app.middleware("http")(add_timestamp_to_json_response)
+    else:
+        app.add_middleware(TimestampJSONMiddleware)
+    return app
+
+
+async def call(app) -> bytes:
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": "GET", "scheme": "http", "path": "/history", "raw_path": b"/history",
+        "root_path": "", "query_string": b"", "headers": [], "server": ("bench", 80), "client": ("bench", 1),
+    }
+    chunks = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+
+    await app(scope, receive, send)
+    return b"".join(chunks)
+
+
+async def run(label: str, app, rounds: int):
+    body = await call(app)  # warm up
+    assert "timestamp" in json.loads(body)
+    start = time.perf_counter()
+    for _ in range(rounds):
+        await call(app)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<8} body={len(body)}B avg={elapsed / rounds * 1000:.2f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--items", type=int, default=5000)
+    parser.add_argument("--rounds", type=int, default=50)
+    args = parser.parse_args()
+
+    asyncio.run(run("before", build_app(args.items, legacy=True), args.rounds))
+    asyncio.run(run("after", build_app(args.items, legacy=False), args.rounds))
@@ -0,0 +1,116 @@
+"""Count DynamoDB round trips per /auth/login and /auth/refresh, before and after issue_tokens().
+
+Runs against the configured DynamoDB (DATABASE_URL for DynamoDB Local) with tables from init_tables.
+
+    python -m benchmarks.token_roundtrips
+
+The baseline flow replays the DynamoDB calls the handlers made before issue_tokens():
+login = Query + UpdateItem (token_version + 1) + PutItem (access_token),
+refresh = Query + GetItem (revocation check) + UpdateItem + PutItem.
+Password / JWT checks don't touch DynamoDB and are skipped there.
+Background access_token pruning runs after each step and is not counted.
+"""
+import asyncio
+import collections
+import json
+from uuid import uuid4
+
+from botocore.client import BaseClient
+
+calls = collections.Counter()
+_make_api_call = BaseClient._make_api_call
+
+
+def _counting(self, operation_name, api_params):
+    calls[operation_name] += 1
+    return _make_api_call(self, operation_name, api_params)
+
+
+BaseClient._make_api_call = _counting
+
+from boto3.dynamodb.conditions import Key  # noqa: E402
+
+from app.core.config import get_settings  # noqa: E402
+from app.core.repository import access_table, user_table  # noqa: E402
+from app.lib import token_cleanup  # noqa: E402
+from app.lib.auth import generate_access_token, generate_refresh_token  # noqa: E402
+from app.lib.password import on_shutdown  # noqa: E402
+from app.models.user import AccessToken, UserLogin, UserRegister, VerfiyData  # noqa: E402
+from app.routes.api.auth import login, register, verify_token  # noqa: E402
+
+
+def report(label: str):
+    print(f"{label:<18} round trips={sum(calls.values())} {dict(calls)}")
+    calls.clear()
+
+
+async def settle():
+    # 等背景的 access_token 清除做完，不算進下一步
+    await asyncio.gather(*token_cleanup._tasks, return_exceptions=True)
+    calls.clear()
+
+
+async def _baseline_issue(user_id: str) -> str:
+    refresh_token = generate_refresh_token(userId=user_id)
+    generate_access_token(userId=user_id)
+    new_token_version = (await user_table.update_item(
+        Key={"id": user_id},
+        UpdateExpression="SET token_version = token_version + :inc",
+        ExpressionAttributeValues={":inc": 1},
+        ReturnValues="UPDATED_NEW"
+    ))["Attributes"]["token_version"]
+    await access_table.put_item(
+        Item=AccessToken(
+            id=str(uuid4()),
+            user_id=user_id,
+            refresh_token=refresh_token,
+            token_version=new_token_version,
+        ).dict()
+    )
+    return refresh_token
+
+
+async def baseline_login(email: str) -> str:
+    user = (await user_table.query(
+        IndexName='EmailIndex',
+        KeyConditionExpression=Key('Email').eq(email),
+        FilterExpression=Key('disabled').eq(False)
+    ))["Items"][0]
+    return await _baseline_issue(user["id"])
+
+
+async def baseline_refresh(token: str) -> str:
+    find_r = (await access_table.query(
+        IndexName='refreshTokenIndex',
+        KeyConditionExpression=Key('refresh_token').eq(token),
+    ))["Items"][0]
+    user = (await user_table.get_item(Key={"id": find_r["user_id"]}))["Item"]
+    if user["token_version"] != find_r["token_version"]:
+        raise RuntimeError("refresh token revoked")
+    return await _baseline_issue(find_r["user_id"])
+
+
+async def main():
+    settings = get_settings()
+    email = f"bench-{uuid4().hex[:8]}@example.com"
+    await register(UserRegister(Email=email, Username="bench", Password="bench", RePassword="bench"), settings)
+    await settle()
+
+    refresh_token = await baseline_login(email)
+    report("login (baseline)")
+    await baseline_refresh(refresh_token)
+    report("refresh (baseline)")
+
+    res = await login(UserLogin(Email=email, Password="bench"), settings)
+    report("login")
+    await settle()
+
+    await verify_token(VerfiyData(token=json.loads(res.body)["refresh_token"]), settings)
+    report("refresh")
+    await settle()
+
+    await on_shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,71 @@
+"""Count TCP connections per request: bare `requests` vs the pooled upstream session.
+
+    python -m benchmarks.upstream_handshakes --requests 200
+"""
+import argparse
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+import requests
+
+from app.core.upstream import build_session
+
+
+class CountingHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # 允許 keep-alive
+    disable_nagle_algorithm = True
+    connections = 0
+    lock = threading.Lock()
+
+    def setup(self):
+        super().setup()
+        with CountingHandler.lock:
+            CountingHandler.connections += 1
+
+    def do_GET(self):
+        body = b'{"detect_records": []}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def run(label: str, get, url: str, n: int):
+    CountingHandler.connections = 0
+    start = time.perf_counter()
+    for _ in range(n):
+        get(url).json()
+    elapsed = time.perf_counter() - start
+    print(
+        f"{label:<8} requests={n} connections={CountingHandler.connections} "
+        f"handshakes/request={CountingHandler.connections / n:.3f} "
+        f"avg={elapsed / n * 1000:.2f}ms"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), CountingHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/db/devices/bench/detect_records"
+
+    session = build_session(SimpleNamespace(
+        UPSTREAM_POOL_CONNECTIONS=4,
+        UPSTREAM_POOL_MAXSIZE=32,
+        UPSTREAM_POOL_BLOCK=True,
+    ))
+
+    run("before", requests.get, url, args.requests)
+    run("after", session.get, url, args.requests)
+
+    session.close()
+    server.shutdown()
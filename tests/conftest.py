@@ -0,0 +1,30 @@
+import os
+
+# Settings 的必填欄位，測試不會連到真的服務
+for key, value in {
+    "GOOGLE_CLIENT_ID": "test",
+    "GOOGLE_CLIENT_SECRET": "test",
+    "GOOGLE_REDIRECT_URI": "http://localhost/callback",
+    "JWT_SECRET_KEY": "test-secret",
+    "AWS_REGION": "us-east-1",
+    "AWS_ACCESS_KEY_ID": "test",
+    "AWS_SECRET_ACCESS_KEY": "test",
+    "DEVICE_SECRET_KEY": "test-device-secret",
+    "DYNAMODB_SCHEMA_CACHE": "",
+}.items():
+    os.environ.setdefault(key, value)
+
+
+import pytest
+
+
+@pytest.fixture
+def dynamodb():
+    """moto 模擬的 DynamoDB，資料表由 init_tables 建立；沒有安裝 moto 就跳過。"""
+    moto = pytest.importorskip("moto")
+    with moto.mock_aws():
+        from app.core.createTable import init_tables
+        from app.core.db import get_dynamodb
+
+        init_tables(get_dynamodb())
+        yield get_dynamodb()
@@ -0,0 +1,81 @@
+import asyncio
+import json
+import time
+
+from app.core.config import get_settings
+from app.models.bottle import DetectRecordEvent, RecordEventType
+from app.routes.api import bottle as bottle_route
+from app.routes.api.device import detect_record_event
+
+BOTTLE_ID = "5b0f5d6e-7d4c-4a55-9d8e-3f2f4d3c2b1a"
+
+
+def record(record_id: str, detect_time: float):
+    return {"detect_record_id": record_id, "detectTime": detect_time, "origPhotoUrl": f"{record_id}.jpg", "detect_record_state": {}, "env_record_state": {}}
+
+
+def put_bottle(dynamodb, detect_time: float, verified_at: int = 0):
+    dynamodb.Table("bottle").put_item(Item={
+        "id": BOTTLE_ID, "user_id": "u", "name": "b", "device_id": "d1", "total_scans": 1,
+        "curr_detect_record_id": "r1", "curr_detect_time": int(detect_time), "snapshot_verified_at": verified_at,
+    })
+
+
+def upstream(monkeypatch, latest):
+    calls = []
+    monkeypatch.setattr(bottle_route, "get_last_detect_record", lambda device_id, settings: calls.append("last") or latest)
+    monkeypatch.setattr(bottle_route, "find_detect_record", lambda device_id, record_id, settings: calls.append(record_id) or latest)
+    return calls
+
+
+def bottle_info(if_none_match=None):
+    return asyncio.run(bottle_route.get_bottle_info(BOTTLE_ID, settings=get_settings(), user={"user_id": "u"}, if_none_match=if_none_match))
+
+
+def record_detail(if_none_match=None):
+    return asyncio.run(bottle_route.get_bottle_history_detail(BOTTLE_ID, "r1", user={"user_id": "u"}, settings=get_settings(), if_none_match=if_none_match))
+
+
+def test_verified_snapshot_answers_304_without_upstream(dynamodb, monkeypatch):
+    # 很久沒有掃描的瓶子也一樣：看的是 snapshot 上次確認的時間，不是偵測時間
+    detect_time = int(time.time()) - 7 * 86400
+    put_bottle(dynamodb, detect_time)
+    calls = upstream(monkeypatch, record("r1", detect_time))
+
+    etag = bottle_info().headers["etag"]
+    assert calls == ["last"]
+    assert bottle_info(etag).status_code == 304
+    assert bottle_info(etag).status_code == 304
+    assert calls == ["last"]
+
+
+def test_stale_snapshot_is_checked_and_repaired(dynamodb, monkeypatch):
+    settings = get_settings()
+    detect_time = int(time.time()) - 86400
+    put_bottle(dynamodb, detect_time, verified_at=int(time.time()) - settings.SNAPSHOT_MAX_STALENESS - 60)
+    # 上游有一筆沒收到事件的新紀錄
+    calls = upstream(monkeypatch, record("r2", detect_time + 30))
+
+    response = bottle_info()
+    assert response.status_code == 200 and json.loads(response.body)["detect_state_id"] == "r2"
+    assert calls == ["last"]
+    bottle = dynamodb.Table("bottle").get_item(Key={"id": BOTTLE_ID})["Item"]
+    assert bottle["curr_detect_record_id"] == "r2"
+    assert bottle["snapshot_verified_at"] >= int(time.time()) - 5
+    # 修正後的 snapshot 可以直接回 304
+    assert bottle_info(response.headers["etag"]).status_code == 304
+    assert calls == ["last"]
+
+
+def test_record_etag_changes_after_delete_event(dynamodb, monkeypatch):
+    put_bottle(dynamodb, int(time.time()))
+    calls = upstream(monkeypatch, record("r1", time.time()))
+
+    etag = record_detail().headers["etag"]
+    assert record_detail(etag).status_code == 304
+    assert calls == ["r1"]
+
+    # 刪除事件只送到一個 worker，其他 worker 也要從 DynamoDB 看到版本改變
+    event = DetectRecordEvent(event=RecordEventType.DELETED, detect_record={"detect_record_id": "r0"})
+    asyncio.run(detect_record_event("d1", event, caller={"device_id": "d1"}, settings=get_settings()))
+    assert record_detail(etag).status_code == 200
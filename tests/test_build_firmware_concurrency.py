@@ -0,0 +1,87 @@
+import os
+import stat
+from concurrent.futures import ThreadPoolExecutor
+
+from app.core.config import get_settings
+from app.lib import build_firmware
+
+# 假的 arduino-cli：把 workspace 的 secrets.h 當成編譯結果，同一個 build path 同時被兩個編譯使用就失敗
+FAKE_ARDUINO_CLI = """#!/bin/sh
+while [ $# -gt 0 ]; do
+  case "$1" in
+    --build-path) build="$2"; shift 2 ;;
+    --output-dir) out="$2"; shift 2 ;;
+    --fqbn|--build-cache-path) shift 2 ;;
+    compile) shift ;;
+    *) sketch="$1"; shift ;;
+  esac
+done
+mkdir "$build/.busy" || { echo "build path in use: $build" >&2; exit 1; }
+echo "$build" >> "$BUILD_LOG"
+sleep 0.2
+name=$(basename "$sketch")
+for part in bootloader partitions; do echo "$part" > "$out/$name.ino.$part.bin"; done
+cp "$sketch/secrets.h" "$out/$name.ino.bin"
+rmdir "$build/.busy"
+"""
+
+# 假的 esptool merge_bin：依序串接各段
+FAKE_PYTHON3 = """#!/bin/sh
+while [ $# -gt 0 ]; do
+  case "$1" in
+    -o) out="$2"; shift 2 ;;
+    0x*) cat "$2" >> "$out"; shift 2 ;;
+    *) shift ;;
+  esac
+done
+"""
+
+
+def install(bin_dir, name, content):
+    path = bin_dir / name
+    path.write_text(content)
+    path.chmod(path.stat().st_mode | stat.S_IEXEC)
+
+
+def test_concurrent_builds_use_separate_workspaces(tmp_path, monkeypatch):
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    install(bin_dir, "arduino-cli", FAKE_ARDUINO_CLI)
+    install(bin_dir, "python3", FAKE_PYTHON3)
+    build_log = tmp_path / "builds.log"
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setenv("MODAL_IMAGE_ID", "test")  # 直接執行指令，不經過 docker
+    monkeypatch.setenv("BUILD_LOG", str(build_log))
+    monkeypatch.setattr(build_firmware, "_slots", None)
+
+    sketch = tmp_path / build_firmware.SKETCH_NAME
+    sketch.mkdir()
+    (sketch / f"{build_firmware.SKETCH_NAME}.ino").write_text("void setup() {}\n")
+
+    slots, builds = 3, 8
+    settings = get_settings().model_copy(update={
+        "FILE_FOLDER": str(tmp_path / "device-files"),
+        "FIRMWARE_BUILD_WORKERS": slots,
+        "FIRMWARE_WORKSPACE_PATH": str(tmp_path / "workspace"),
+        "FIRMWARE_BUILD_PATH": str(tmp_path / "build-cache" / "sketch"),
+        "FIRMWARE_BUILD_CACHE_PATH": str(tmp_path / "build-cache" / "core"),
+    })
+
+    devices = [f"device-{i}" for i in range(builds)]
+    with ThreadPoolExecutor(max_workers=builds) as pool:
+        results = list(pool.map(lambda device_id: build_firmware.run_build(device_id, f"// secrets of {device_id}\n", settings), devices))
+
+    for device_id, path in zip(devices, results):
+        assert path == os.path.abspath(tmp_path / "device-files" / device_id / f"{device_id}.bin")
+        with open(path) as f:
+            firmware = f.read()
+        assert f"secrets of {device_id}" in firmware
+        assert firmware.count("secrets of") == 1
+
+    used = build_log.read_text().split()
+    assert len(used) == builds
+    assert len(set(used)) == slots
+    # 原始碼目錄不會被寫入 secrets.h
+    assert not (sketch / "secrets.h").exists()
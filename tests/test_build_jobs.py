@@ -0,0 +1,40 @@
+import asyncio
+from datetime import datetime
+
+from app.core.config import get_settings
+from app.lib.build_jobs import BuildQueue, get_build_job
+from app.models.bottle import BuildJob, Status
+
+
+def put_job(dynamodb, age: int, status: Status = Status.IN_PROGRESS) -> BuildJob:
+    now = int(datetime.now().timestamp())
+    job = BuildJob(id=f"job-{age}-{status.value}", user_id="u", device_id="d", status=status, instance="old-host:1", updated_at=now - age)
+    dynamodb.Table("build_job").put_item(Item=job.dict())
+    return job
+
+
+def test_orphaned_job_is_marked_failed(dynamodb):
+    settings = get_settings().model_copy(update={"BUILD_JOB_STALE_AFTER": 60})
+    stale = put_job(dynamodb, age=600)
+    fresh = put_job(dynamodb, age=10)
+    done = put_job(dynamodb, age=600, status=Status.COMPLETED)
+
+    job = asyncio.run(get_build_job(stale.id, settings))
+    assert job.status == Status.FAILED and "old-host:1" in job.error
+    assert dynamodb.Table("build_job").get_item(Key={"id": stale.id})["Item"]["status"] == Status.FAILED.value
+
+    assert asyncio.run(get_build_job(fresh.id, settings)).status == Status.IN_PROGRESS
+    assert asyncio.run(get_build_job(done.id, settings)).status == Status.COMPLETED
+
+
+def test_heartbeat_keeps_running_job_alive(dynamodb):
+    job = put_job(dynamodb, age=600)
+
+    async def beat():
+        task = asyncio.create_task(BuildQueue(1)._heartbeat(job.id, 0))
+        await asyncio.sleep(0.2)
+        task.cancel()
+
+    asyncio.run(beat())
+    settings = get_settings().model_copy(update={"BUILD_JOB_STALE_AFTER": 60})
+    assert asyncio.run(get_build_job(job.id, settings)).status == Status.IN_PROGRESS
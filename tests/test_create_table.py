@@ -0,0 +1,22 @@
+import pytest
+
+from app.core import createTable
+from app.core.createTable import SCHEMA_MARKER_ID, SCHEMA_TABLE, init_tables, schema_fingerprint
+
+
+def test_schema_marker_skips_checks_on_a_fresh_instance(dynamodb, tmp_path, monkeypatch):
+    # fixture 已經跑過一次 init_tables，新的 container 沒有本機檔案也只需要讀 schema_meta
+    marker = dynamodb.Table(SCHEMA_TABLE).get_item(Key={"id": SCHEMA_MARKER_ID})["Item"]
+    assert marker["fingerprint"] == schema_fingerprint("PROVISIONED")
+
+    def list_tables(client):
+        raise AssertionError("schema 沒變動不應該再檢查資料表")
+
+    monkeypatch.setattr(createTable, "_list_tables", list_tables)
+    cache_path = tmp_path / "schema"
+    init_tables(dynamodb, cache_path=str(cache_path))
+    assert cache_path.read_text() == marker["fingerprint"]
+
+    # schema 變動 (例如換 billing mode) 時要重新檢查
+    with pytest.raises(AssertionError):
+        init_tables(dynamodb, billing_mode="PAY_PER_REQUEST")
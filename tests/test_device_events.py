@@ -0,0 +1,42 @@
+from fastapi.testclient import TestClient
+from jose import jwt
+
+from app.core.config import get_settings
+from app.lib.auth import DATA_SERVICE_SCOPE
+from app.main import bio_app
+
+
+def device_token(**claims) -> dict:
+    settings = get_settings()
+    token = jwt.encode(claims, settings.DEVICE_SECRET_KEY, algorithm=settings.DEVICE_ALGORITHM)
+    return {"Authorization": f"Bearer {token}"}
+
+
+def post_event(headers, device_id="d1"):
+    event = {"event": "created", "detect_record": {"detect_record_id": "r1", "detectTime": 100, "isFromDevice": True}}
+    return TestClient(bio_app).post(f"/api/v1/device/{device_id}/records", json=event, headers=headers)
+
+
+def put_bottle(dynamodb):
+    dynamodb.Table("bottle").put_item(Item={"id": "b1", "user_id": "u", "name": "b", "device_id": "d1", "total_scans": 0})
+
+
+def test_token_for_another_device_is_rejected(dynamodb):
+    put_bottle(dynamodb)
+    response = post_event(device_token(device_id="d2"))
+    assert response.status_code == 403
+    bottle = dynamodb.Table("bottle").get_item(Key={"id": "b1"})["Item"]
+    assert "curr_detect_record_id" not in bottle and bottle["total_scans"] == 0
+
+    # 沒有任何裝置 claim 的 token 也不行
+    assert post_event(device_token(foo="bar")).status_code == 403
+
+
+def test_own_device_and_data_service_are_accepted(dynamodb, monkeypatch):
+    import app.lib.snapshot as snapshot
+    monkeypatch.setattr(snapshot, "find_bottle_and_env_state", lambda *args: ({}, {}))
+    put_bottle(dynamodb)
+
+    assert post_event(device_token(device_id="d1")).status_code == 200
+    assert post_event(device_token(sub="svc", scope=f"records {DATA_SERVICE_SCOPE}")).status_code == 200
+    assert dynamodb.Table("bottle").get_item(Key={"id": "b1"})["Item"]["total_scans"] == 1
@@ -0,0 +1,77 @@
+import hashlib
+import struct
+from functools import reduce
+from operator import xor
+
+import pytest
+
+from app.lib.firmware_patch import (ESP_CHECKSUM_MAGIC, ESP_HEADER_SIZE, ESP_IMAGE_MAGIC, SECRETS_MAGIC, SECRETS_SIZE,
+                                    pack_secrets, patch_firmware)
+
+APP_OFFSET = 0x100
+VALUES = {"WIFI_SSID": "lab", "WIFI_PASSWORD": "pw", "DEVICE_ID": "device-1", "AWS_CERT_CA": "-----BEGIN CERTIFICATE-----"}
+
+
+def build_image(segments, append_digest=True) -> bytes:
+    """照 esptool 的格式組出 app image：header、segment、16 bytes 對齊的 checksum、SHA256。"""
+    header = bytearray(ESP_HEADER_SIZE)
+    header[0], header[1] = ESP_IMAGE_MAGIC, len(segments)
+    header[ESP_HEADER_SIZE - 1] = 1 if append_digest else 0
+    image = bytearray(header)
+    for i, data in enumerate(segments):
+        image += struct.pack("<II", 0x3F400000 + i * 0x10000, len(data)) + data
+    image += b"\x00" * (15 - len(image) % 16)
+    image.append(reduce(xor, b"".join(segments), ESP_CHECKSUM_MAGIC))
+    if append_digest:
+        image += hashlib.sha256(image).digest()
+    # bootloader / partition table 的位置
+    return b"\xaa" * APP_OFFSET + bytes(image)
+
+
+def placeholder() -> bytes:
+    return SECRETS_MAGIC + b"\x00" * (SECRETS_SIZE - len(SECRETS_MAGIC))
+
+
+@pytest.mark.parametrize("append_digest", [True, False])
+def test_patch_replaces_region_and_fixes_checksum(append_digest):
+    segments = [b"\x01\x02\x03" * 7, b"code" + placeholder() + b"more-rodata", b"\x10" * 5]
+    template = build_image(segments, append_digest)
+
+    patched = patch_firmware(template, VALUES, app_offset=APP_OFFSET)
+
+    region = pack_secrets(VALUES)
+    expected = build_image([segments[0], b"code" + region + b"more-rodata", segments[2]], append_digest)
+    assert patched == expected
+    assert region in patched and placeholder() not in patched
+    assert len(patched) == len(template)
+
+
+def test_missing_placeholder_raises():
+    template = build_image([b"no secrets here" * 10])
+    with pytest.raises(ValueError):
+        patch_firmware(template, VALUES, app_offset=APP_OFFSET)
+
+
+def test_duplicated_placeholder_raises():
+    template = build_image([placeholder(), placeholder()])
+    with pytest.raises(ValueError):
+        patch_firmware(template, VALUES, app_offset=APP_OFFSET)
+
+
+def test_placeholder_across_segments_raises():
+    # 跨兩個 segment 的 magic 不是編譯出來的 struct
+    region = placeholder()
+    template = build_image([region[:100], region[100:]])
+    with pytest.raises(ValueError):
+        patch_firmware(template, VALUES, app_offset=APP_OFFSET)
+
+
+def test_not_an_app_image_raises():
+    with pytest.raises(ValueError):
+        patch_firmware(b"\x00" * 0x200, VALUES, app_offset=APP_OFFSET)
+
+
+def test_value_longer_than_reserved_raises():
+    template = build_image([placeholder()])
+    with pytest.raises(ValueError):
+        patch_firmware(template, {"WIFI_SSID": "x" * 64}, app_offset=APP_OFFSET)
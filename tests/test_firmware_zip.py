@@ -0,0 +1,55 @@
+import asyncio
+import io
+import os
+import zipfile
+
+from fastapi.responses import FileResponse
+
+from app.core.config import get_settings
+from app.lib import build_firmware
+from app.routes.api.device import download_device_firmware_zip
+
+
+def make_sketch(root):
+    sketch = root / build_firmware.SKETCH_NAME
+    sketch.mkdir()
+    (sketch / f"{build_firmware.SKETCH_NAME}.ino").write_text("void setup() {}\n")
+    (sketch / "secrets.h").write_text("// 不應該被打包\n")
+    return sketch
+
+
+def test_template_is_read_once_until_invalidated(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    sketch = make_sketch(tmp_path)
+    build_firmware.invalidate_zip_template()
+
+    walks = []
+    entries = build_firmware._sketch_entries
+    monkeypatch.setattr(build_firmware, "_sketch_entries", lambda: walks.append(1) or entries())
+
+    first = b"".join(build_firmware.stream_zip("#define A 1\n"))
+    b"".join(build_firmware.stream_zip("#define A 2\n"))
+    assert len(walks) == 1
+    with zipfile.ZipFile(io.BytesIO(first)) as zf:
+        assert zf.read(f"{build_firmware.SKETCH_NAME}/secrets.h") == b"#define A 1\n"
+        assert zf.namelist().count(f"{build_firmware.SKETCH_NAME}/secrets.h") == 1
+
+    (sketch / f"{build_firmware.SKETCH_NAME}.ino").write_text("void loop() {}\n")
+    build_firmware.invalidate_zip_template()
+    with zipfile.ZipFile(io.BytesIO(b"".join(build_firmware.stream_zip("")))) as zf:
+        assert zf.read(f"{build_firmware.SKETCH_NAME}/{build_firmware.SKETCH_NAME}.ino") == b"void loop() {}\n"
+    assert len(walks) == 2
+    build_firmware.invalidate_zip_template()
+
+
+def test_zip_falls_back_to_legacy_archive(tmp_path):
+    settings = get_settings().model_copy(update={"FILE_FOLDER": str(tmp_path)})
+    os.makedirs(tmp_path / "old-device")
+    (tmp_path / "old-device" / "old-device.zip").write_bytes(b"PK legacy")
+
+    response = asyncio.run(download_device_firmware_zip("old-device", settings=settings, user={}))
+    assert isinstance(response, FileResponse)
+    assert response.path == f"{tmp_path}/old-device/old-device.zip"
+
+    missing = asyncio.run(download_device_firmware_zip("no-device", settings=settings, user={}))
+    assert missing.status_code == 404
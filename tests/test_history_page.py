@@ -0,0 +1,144 @@
+import pytest
+
+import app.lib.data as data
+from app.core.config import get_settings
+from app.lib.state_cache import DetectRecordCache
+
+
+def record(n):
+    return {"detect_record_id": f"r{n}", "detectTime": float(n), "bottleStateID": "s"}
+
+
+HISTORY = [record(n) for n in range(1, 11)]
+
+
+class FakeResponse:
+    def __init__(self, records):
+        self.records = records
+
+    def json(self):
+        return {"detect_records": self.records}
+
+
+class PagingService:
+    """支援 order=desc / limit / before 的資料服務。"""
+
+    def __init__(self):
+        self.calls = []
+
+    def get(self, url, params=None):
+        params = params or {}
+        self.calls.append(params)
+        records = sorted(HISTORY, key=lambda x: (x["detectTime"], x["detect_record_id"]), reverse=True)
+        if "before" in params:
+            position = (params["before"], params["before_id"])
+            records = [x for x in records if (x["detectTime"], x["detect_record_id"]) < position]
+        if "limit" in params:
+            records = records[:params["limit"]]
+        return FakeResponse(records)
+
+
+class LegacyService(PagingService):
+    """忽略所有分頁參數，整份歷史由舊到新回傳。"""
+
+    def get(self, url, params=None):
+        self.calls.append(params or {})
+        return FakeResponse(list(HISTORY))
+
+
+class DescendingLegacyService(PagingService):
+    """忽略所有分頁參數，但整份歷史剛好由新到舊回傳。"""
+
+    def get(self, url, params=None):
+        self.calls.append(params or {})
+        return FakeResponse(sorted(HISTORY, key=lambda x: x["detectTime"], reverse=True))
+
+
+@pytest.fixture
+def service(monkeypatch, request):
+    fake = request.param()
+    monkeypatch.setattr(data, "get_session", lambda settings: fake)
+    monkeypatch.setattr(data, "_page_params_retry_at", 0.0)
+    return fake
+
+
+@pytest.mark.parametrize("service", [PagingService, LegacyService], indirect=True)
+def test_pages_walk_newest_first(service):
+    settings = get_settings()
+    seen, cursor = [], None
+    while True:
+        page, cursor = data.get_bottle_detect_state_page("d1", 3, cursor, settings)
+        seen.extend(x["detect_record_id"] for x in page)
+        if not cursor:
+            break
+    assert seen == [f"r{n}" for n in range(10, 0, -1)]
+
+
+@pytest.mark.parametrize("service", [PagingService, LegacyService, DescendingLegacyService], indirect=True)
+@pytest.mark.parametrize("offset, limit", [(0, 3), (2, 8), (3, 3), (9, 5), (12, 5)])
+def test_offset_pages_are_sliced_locally(service, offset, limit):
+    # 舊版 App 的 s/e：回應筆數比要求少時看不出 s/e 有沒有被套用，一律在本地切
+    page, _ = data.get_bottle_detect_state_page("d1", limit, None, get_settings(), offset=offset)
+    expected = [f"r{n}" for n in range(10, 0, -1)][offset:offset + limit]
+    assert [x["detect_record_id"] for x in page] == expected
+
+
+def test_paging_is_retried_after_interval(monkeypatch):
+    fake = LegacyService()
+    monkeypatch.setattr(data, "get_session", lambda settings: fake)
+    monkeypatch.setattr(data, "_page_params_retry_at", 0.0)
+    now = [1000.0]
+    monkeypatch.setattr(data.time, "monotonic", lambda: now[0])
+    settings = get_settings().model_copy(update={"HISTORY_PAGING_RETRY": 60})
+
+    data.get_bottle_detect_state_page("d1", 3, None, settings)
+    data.get_bottle_detect_state_page("d1", 3, None, settings)
+    now[0] += 61
+    data.get_bottle_detect_state_page("d1", 3, None, settings)
+    # 不支援時只在間隔到了之後才再帶分頁參數試一次
+    assert [bool(call) for call in fake.calls] == [True, False, False, True, False]
+
+
+def test_legacy_service_detected_once(monkeypatch):
+    fake = LegacyService()
+    monkeypatch.setattr(data, "get_session", lambda settings: fake)
+    monkeypatch.setattr(data, "_page_params_retry_at", 0.0)
+    settings = get_settings()
+
+    last = data.get_bottle_detect_state_page("d1", 1, None, settings)[0]
+    assert last[0]["detect_record_id"] == "r10"
+    data.get_bottle_detect_state_page("d1", 1, None, settings)
+    # 第一次帶分頁參數、發現不支援後改抓整份歷史，之後直接抓整份
+    assert [bool(call) for call in fake.calls] == [True, False, False]
+
+
+class FakeStatusResponse:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+    def json(self):
+        return {"message": "Not Found"}
+
+
+class NoSingleRecordService(LegacyService):
+    """沒有 /detect_records/{id}，單筆查詢回 404。"""
+
+    def get(self, url, params=None):
+        if "/detect_records/" in url:
+            return FakeStatusResponse(404)
+        return super().get(url, params)
+
+
+def test_single_record_falls_back_to_full_history(monkeypatch):
+    fake = NoSingleRecordService()
+    monkeypatch.setattr(data, "get_session", lambda settings: fake)
+    settings = get_settings()
+    cache = DetectRecordCache(settings)
+    monkeypatch.setattr(data, "get_record_cache", lambda settings: cache)
+
+    assert data.get_detect_record("d1", "r4", settings)["detectTime"] == 4.0
+    assert data.get_detect_record("d1", "missing", settings) is None
+    # 整份歷史已經填進快取，之後的單筆查詢不用再打上游
+    calls = len(fake.calls)
+    assert data.get_detect_record("d1", "r7", settings)["detect_record_id"] == "r7"
+    assert len(fake.calls) == calls
@@ -0,0 +1,18 @@
+import time
+
+from app.lib.bottle_events import status_delta
+from app.lib.snapshot import seen_recently
+
+
+def test_last_seen_expires_after_window():
+    now = time.time()
+    assert seen_recently({"last_seen": int(now) - 30}, 600)
+    assert not seen_recently({"last_seen": int(now) - 601}, 600)
+    # 舊資料只有 is_connected，不能一直當成在線
+    assert not seen_recently({"is_connected": True}, 600)
+
+
+def test_status_delta_reports_connection_only_for_device_records():
+    snapshot = {"curr_bottle_status": 0, "curr_detect_time": 1, "scanned_at": 1}
+    assert "isConnected" not in status_delta("b", snapshot)
+    assert status_delta("b", {**snapshot, "last_seen": int(time.time())})["isConnected"] is True
@@ -0,0 +1,46 @@
+from fastapi.testclient import TestClient
+
+from app.core.config import get_settings
+from app.lib.auth import require_user
+from app.main import bio_app
+from app.routes.api import device as device_route
+
+JPEG = b"\xff\xd8\xff\xe0" + b"\x00" * 64
+
+
+def test_manual_update_returns_bottle_single_info(tmp_path, monkeypatch):
+    settings = get_settings().model_copy(update={"UPLOAD_DIRECTORY": str(tmp_path)})
+    scanned = {}
+
+    def manual_scan_bottle(file, temperature, humidity, settings):
+        scanned["image"] = file.file.read()
+        return {"status_code": 200, "detect_record_id": "m1", "orgPhotoUrl": "http://data/m1.jpg", "bottleStateID": "s1", "envStateID": "e1"}
+
+    def download_file_requests(url, save_path):
+        with open(save_path, "wb") as f:
+            f.write(b"ai")
+
+    monkeypatch.setattr(device_route, "manual_scan_bottle", manual_scan_bottle)
+    monkeypatch.setattr(device_route, "download_file_requests", download_file_requests)
+    monkeypatch.setattr(device_route, "find_bottle_and_env_state", lambda *args: ({"isAbnormal": 0, "type": "正常", "advice": "保持"}, {}))
+    bio_app.dependency_overrides[require_user] = lambda: {"user_id": "u"}
+    bio_app.dependency_overrides[get_settings] = lambda: settings
+    try:
+        response = TestClient(bio_app).post(
+            "/api/v1/device/manualUpdate",
+            params={"temperature": 24.5, "humidity": 60},
+            files={"file": ("shot.jpg", JPEG, "image/jpeg")},
+        )
+    finally:
+        bio_app.dependency_overrides.clear()
+
+    assert response.status_code == 200, response.text
+    body = response.json()
+    assert body["detect_state_id"] == "m1" and body["name"] is None
+    assert body["bottleState"] == {"bottle_status": "good", "bottle_status_text": "正常", "bottle_desc": "保持"}
+    assert body["displayState"]["temperature"] == 24.5 and isinstance(body["displayState"]["time"], int)
+    assert scanned["image"] == JPEG
+    with open(body["oriimageUri"], "rb") as f:
+        assert f.read() == JPEG
+    with open(body["AIimageUri"], "rb") as f:
+        assert f.read() == b"ai"
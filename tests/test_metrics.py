@@ -0,0 +1,18 @@
+from fastapi.testclient import TestClient
+
+from app.core.config import get_settings
+from app.lib.token_cache import get_token_cache
+from app.main import bio_app
+
+
+def test_metrics_report_cache_hit_rates():
+    cache = get_token_cache(get_settings())
+    before = cache.stats()
+    cache.get("not-a-cached-token")
+
+    response = TestClient(bio_app).get("/metrics")
+    assert response.status_code == 200
+    body = response.json()
+    assert set(body) >= {"token_cache", "state_cache", "record_cache", "presence", "bottle_stream"}
+    assert body["token_cache"]["misses"] == before["misses"] + 1
+    assert "hit_rate" in body["state_cache"] and "hit_rate" in body["presence"]
@@ -0,0 +1,52 @@
+import asyncio
+import json
+import time
+
+from app.core.config import get_settings
+from app.lib import data
+from app.lib.presence import PresenceRegistry
+from app.routes.api import bottle as bottle_route
+
+
+def put_bottle(dynamodb, device_id: str, last_seen: int = 0):
+    dynamodb.Table("bottle").put_item(Item={
+        "id": f"bottle-{device_id}", "user_id": "u", "name": device_id, "device_id": device_id,
+        "curr_detect_time": 1, "last_seen": last_seen,
+    })
+
+
+def dashboard(monkeypatch, registry, live):
+    calls = []
+
+    def device_is_connected(device_id, settings):
+        calls.append(device_id)
+        if live[device_id] is None:
+            raise ConnectionError("upstream down")
+        return live[device_id]
+
+    monkeypatch.setattr(data, "device_is_connected", device_is_connected)
+    monkeypatch.setattr(bottle_route, "get_presence", lambda settings: registry)
+    response = asyncio.run(bottle_route.get_bottle(user={"user_id": "u"}, settings=get_settings(), if_none_match=None))
+    states = {item["name"]: item["isConnected"] for item in json.loads(response.body)["bottles"]}
+    return states, sorted(calls)
+
+
+def test_registry_miss_falls_back_to_live_lookup(dynamodb, monkeypatch):
+    put_bottle(dynamodb, "fresh", last_seen=int(time.time()) - 10)
+    put_bottle(dynamodb, "stale", last_seen=int(time.time()) - 3600)
+    put_bottle(dynamodb, "offline")
+    put_bottle(dynamodb, "broken")
+    live = {"stale": True, "offline": False, "broken": None}
+
+    # presence 沒啟用：registry 一律不知道
+    registry = PresenceRegistry(get_settings())
+    states, calls = dashboard(monkeypatch, registry, live)
+    assert states == {"fresh": True, "stale": True, "offline": False, "broken": False}
+    assert calls == ["broken", "offline", "stale"]
+
+    # presence 連上之後，有事件或上游查過 (ttl 內) 的裝置就不用再問上游；查詢失敗的下次再問
+    registry.set_live(True)
+    registry.mark("offline", True)
+    states, calls = dashboard(monkeypatch, registry, live)
+    assert states == {"fresh": True, "stale": True, "offline": True, "broken": False}
+    assert calls == ["broken"]
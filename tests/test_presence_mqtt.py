@@ -0,0 +1,106 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+from app.core.config import get_settings
+from app.lib.mqtt import CONNACK, PUBLISH, MQTTSubscriber, packet, parse_publish, read_packet
+from app.lib.presence import PresenceRegistry
+from benchmarks.presence_broker import StandInBroker
+
+
+def read(raw: bytes):
+    async def run():
+        reader = asyncio.StreamReader()
+        reader.feed_data(raw)
+        reader.feed_eof()
+        return await read_packet(reader)
+
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize("size", [0, 1, 127, 128, 16383, 16384, 200000])
+def test_remaining_length_round_trip(size):
+    body = bytes(range(256)) * (size // 256) + bytes(size % 256)
+    assert read(packet(PUBLISH, body)) == (PUBLISH, body)
+
+
+def test_parse_publish_qos0_and_qos1():
+    topic = "biocherish/d1/status".encode()
+    qos0 = b"\x00" + bytes([len(topic)]) + topic + b"offline"
+    assert parse_publish(PUBLISH, qos0) == ("biocherish/d1/status", b"offline", 0, None)
+    qos1 = b"\x00" + bytes([len(topic)]) + topic + b"\x12\x34" + b"online"
+    assert parse_publish(PUBLISH | 0x02, qos1) == ("biocherish/d1/status", b"online", 1, 0x1234)
+
+
+async def wait_until(condition, timeout: float = 5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        await asyncio.sleep(0.01)
+
+
+def lifecycle(event: str, device_id: str, timestamp_ms: int) -> tuple:
+    return f"$aws/events/presence/{event}/{device_id}", json.dumps({"clientId": device_id, "timestamp": timestamp_ms}).encode()
+
+
+def test_registry_follows_events_from_the_broker():
+    registry = PresenceRegistry(get_settings())
+
+    async def run():
+        broker = StandInBroker()
+        server = await asyncio.start_server(broker.handle, "127.0.0.1", 0)
+        subscriber = MQTTSubscriber(
+            host="127.0.0.1", port=server.sockets[0].getsockname()[1], client_id="test",
+            topics=["$aws/events/presence/+/+", "biocherish/+/heartbeat", "biocherish/+/status"],
+            on_message=registry.on_message, on_state=registry.set_live,
+        )
+        task = asyncio.create_task(subscriber.run())
+        await asyncio.wait_for(broker.subscribed.wait(), timeout=5)
+        # SUBACK 讀到之後才算連上
+        await wait_until(lambda: registry.live)
+        assert registry.live
+
+        now_ms = int(time.time() * 1000)
+        broker.publish(*lifecycle("connected", "a", now_ms))
+        broker.publish(*lifecycle("connected", "b", now_ms))
+        broker.publish(*lifecycle("disconnected", "b", now_ms + 1))
+        # 重連後才到的舊 disconnected 不能蓋掉較新的 connected
+        broker.publish(*lifecycle("connected", "c", now_ms))
+        broker.publish(*lifecycle("disconnected", "c", now_ms - 1000))
+        broker.publish("biocherish/d/heartbeat", b"{}")
+        broker.publish("biocherish/e/status", b"offline")
+        # 超過 127 bytes 的封包，remaining length 要用多個 byte
+        broker.publish("biocherish/f/status", b"online" + b" " * 300)
+
+        await wait_until(lambda: broker.acked >= 8)
+        states = registry.online(["a", "b", "c", "d", "e", "f", "unknown"])
+
+        task.cancel()
+        server.close()
+        await asyncio.gather(task, return_exceptions=True)
+        return broker.acked, states
+
+    acked, states = asyncio.run(run())
+    assert acked == 8
+    assert states == {"a": True, "b": False, "c": True, "d": True, "e": False, "f": True, "unknown": None}
+    # 訂閱中斷後不再相信 registry，呼叫端改問上游
+    assert registry.live is False
+    assert registry.get("a") is None
+
+
+def test_refused_connection_raises():
+    async def refuse(reader, writer):
+        await read_packet(reader)
+        writer.write(packet(CONNACK, b"\x00\x05"))  # not authorized
+
+    async def run():
+        server = await asyncio.start_server(refuse, "127.0.0.1", 0)
+        subscriber = MQTTSubscriber("127.0.0.1", server.sockets[0].getsockname()[1], "test", ["t"], on_message=lambda t, p: None)
+        try:
+            await subscriber._session()
+        finally:
+            server.close()
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(run())
@@ -0,0 +1,55 @@
+import asyncio
+import uuid
+
+from app.core.config import get_settings
+from app.lib.scan_events import count_scan_event
+from app.models.bottle import RecordEventType
+
+CREATED, DELETED = RecordEventType.CREATED, RecordEventType.DELETED
+
+
+def make_bottle(dynamodb, **extra):
+    bottle = {"id": str(uuid.uuid4()), "user_id": "u", "name": "b", "device_id": "d1", **extra}
+    dynamodb.Table("bottle").put_item(Item=bottle)
+    return bottle
+
+
+def total(dynamodb, bottle):
+    return dynamodb.Table("bottle").get_item(Key={"id": bottle["id"]})["Item"].get("total_scans")
+
+
+def count(bottle, record_id, event):
+    return asyncio.run(count_scan_event(bottle, record_id, event, get_settings()))
+
+
+def test_retried_events_count_once(dynamodb):
+    bottle = make_bottle(dynamodb, total_scans=0)
+
+    assert count(bottle, "r1", CREATED) is True
+    assert count(bottle, "r1", CREATED) is False
+    assert total(dynamodb, bottle) == 1
+
+    assert count(bottle, "r1", DELETED) is True
+    assert count(bottle, "r1", DELETED) is False
+    # 刪除後才到的重送 created 也不能再加回去
+    assert count(bottle, "r1", CREATED) is False
+    assert total(dynamodb, bottle) == 0
+
+
+def test_delete_of_record_created_before_markers(dynamodb):
+    bottle = make_bottle(dynamodb, total_scans=5)
+
+    assert count(bottle, "old", DELETED) is True
+    assert count(bottle, "old", DELETED) is False
+    assert total(dynamodb, bottle) == 4
+
+
+def test_legacy_bottle_still_records_marker(dynamodb):
+    bottle = make_bottle(dynamodb)
+
+    assert count(bottle, "r1", CREATED) is False
+    assert total(dynamodb, bottle) is None
+    # 回填之後重送的 created 不會重複計數
+    dynamodb.Table("bottle").update_item(Key={"id": bottle["id"]}, UpdateExpression="SET total_scans = :t", ExpressionAttributeValues={":t": 1})
+    assert count(bottle, "r1", CREATED) is False
+    assert total(dynamodb, bottle) == 1
@@ -0,0 +1,32 @@
+import app.lib.state_cache as state_cache
+from app.core.config import get_settings
+from app.lib.state_cache import DetectRecordCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_record_cache_expires_after_ttl(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(state_cache.time, "monotonic", clock)
+    cache = DetectRecordCache(get_settings().model_copy(update={"RECORD_CACHE_TTL": 60}))
+
+    cache.put("d1", {"detect_record_id": "r1"})
+    assert cache.get("d1", "r1") == {"detect_record_id": "r1"}
+
+    # 刪除事件送到別的 worker 時，這裡只能等 TTL 到期
+    clock.now += 61
+    assert cache.get("d1", "r1") is None
+    assert cache.stats()["size"] == 0
+
+
+def test_record_cache_returns_copies():
+    cache = DetectRecordCache(get_settings())
+    cache.put("d1", {"detect_record_id": "r1"})
+    cache.get("d1", "r1")["detect_record_state"] = {"type": "x"}
+    assert "detect_record_state" not in cache.get("d1", "r1")
@@ -0,0 +1,62 @@
+import asyncio
+import json
+
+import pytest
+
+from app.middlewares.response import TimestampJSONMiddleware
+
+
+def run(chunks, content_type=b"application/json", content_length=True):
+    """用指定的 body 分段跑一次 middleware，回傳 (headers, body)。"""
+    body = b"".join(chunks)
+
+    async def app(scope, receive, send):
+        headers = [(b"content-type", content_type)]
+        if content_length:
+            headers.append((b"content-length", str(len(body)).encode()))
+        await send({"type": "http.response.start", "status": 200, "headers": headers})
+        for i, chunk in enumerate(chunks):
+            await send({"type": "http.response.body", "body": chunk, "more_body": i < len(chunks) - 1})
+
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(TimestampJSONMiddleware(app)({"type": "http"}, None, send))
+    headers = dict(sent[0]["headers"])
+    return headers, b"".join(m.get("body", b"") for m in sent[1:])
+
+
+@pytest.mark.parametrize("content_length", [True, False])
+def test_injects_timestamp(content_length):
+    headers, body = run([b'{"a":', b'1}'], content_length=content_length)
+    data = json.loads(body)
+    assert data["a"] == 1 and isinstance(data["timestamp"], int)
+    if content_length:
+        assert int(headers[b"content-length"]) == len(body)
+
+
+@pytest.mark.parametrize("content_length", [True, False])
+def test_keeps_existing_timestamp(content_length):
+    # "timestamp" 被切在兩段之間也要認得
+    headers, body = run([b'{"a":1,"time', b'stamp":5}'], content_length=content_length)
+    assert body == b'{"a":1,"timestamp":5}'
+    assert body.count(b'"timestamp"') == 1
+    if content_length:
+        assert int(headers[b"content-length"]) == len(body)
+
+
+def test_nested_timestamp_still_injects_top_level():
+    _, body = run([b'{"item":{"timestamp":5}}'])
+    data = json.loads(body)
+    assert data["item"] == {"timestamp": 5} and isinstance(data["timestamp"], int)
+
+
+def test_empty_object_and_non_object():
+    _, body = run([b"{}"])
+    assert list(json.loads(body)) == ["timestamp"]
+    _, body = run([b"[1,2]"])
+    assert body == b"[1,2]"
+    _, body = run([b"plain"], content_type=b"text/plain")
+    assert body == b"plain"
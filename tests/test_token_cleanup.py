@@ -0,0 +1,52 @@
+import asyncio
+from datetime import datetime
+
+from app.lib import token_cleanup
+from app.lib.auth import issue_tokens
+from app.lib.token_cleanup import prune_access_tokens
+
+
+def put_token(dynamodb, token_id: str, user_id: str, version=None, expires_in: int = 3600):
+    item = {"id": token_id, "user_id": user_id, "refresh_token": token_id, "expires_at": int(datetime.now().timestamp()) + expires_in}
+    if version is not None:
+        item["token_version"] = version
+    dynamodb.Table("access_token").put_item(Item=item)
+
+
+def token_ids(dynamodb):
+    return {item["id"] for item in dynamodb.Table("access_token").scan()["Items"]}
+
+
+def test_missing_token_version_counts_as_zero(dynamodb):
+    # 舊資料的使用者沒有 token_version，不能因此把所有 token 刪掉
+    dynamodb.Table("user").put_item(Item={"id": "legacy"})
+    put_token(dynamodb, "legacy-old", "legacy")
+    put_token(dynamodb, "legacy-v0", "legacy", version=0)
+    put_token(dynamodb, "legacy-expired", "legacy", version=0, expires_in=-10)
+
+    assert asyncio.run(prune_access_tokens("legacy")) == 1
+    assert token_ids(dynamodb) == {"legacy-old", "legacy-v0"}
+
+
+def test_only_the_given_user_is_pruned(dynamodb):
+    dynamodb.Table("user").put_item(Item={"id": "a", "token_version": 3})
+    dynamodb.Table("user").put_item(Item={"id": "b", "token_version": 3})
+    put_token(dynamodb, "a-2", "a", version=2)
+    put_token(dynamodb, "a-3", "a", version=3)
+    put_token(dynamodb, "b-2", "b", version=2)
+
+    assert asyncio.run(prune_access_tokens("a")) == 1
+    assert token_ids(dynamodb) == {"a-3", "b-2"}
+
+
+def test_issue_tokens_prunes_superseded_versions(dynamodb):
+    dynamodb.Table("user").put_item(Item={"id": "u", "token_version": 1})
+    put_token(dynamodb, "u-1", "u", version=1)
+
+    async def login():
+        await issue_tokens("u", 1)
+        await asyncio.gather(*token_cleanup._tasks)
+
+    asyncio.run(login())
+    tokens = dynamodb.Table("access_token").scan()["Items"]
+    assert [token["token_version"] for token in tokens] == [2]
@@ -0,0 +1,78 @@
+import io
+
+from fastapi import FastAPI, UploadFile
+from fastapi.testclient import TestClient
+from starlette.datastructures import Headers
+
+from app.core.config import get_settings
+from app.exceptions import exceptions
+from app.lib.file import upload_file
+from app.middlewares.upload import UploadSizeLimitMiddleware
+
+JPEG = b"\xff\xd8\xff\xe0" + b"\x00" * 100
+
+
+def make_client(max_size: int):
+    app = FastAPI()
+    handled = []
+
+    @app.post("/upload")
+    async def upload(file: UploadFile):
+        handled.append(file.filename)
+        return {"size": len(await file.read())}
+
+    for cls, fn in exceptions:
+        app.exception_handler(cls)(fn)
+    app.add_middleware(UploadSizeLimitMiddleware, max_size=max_size)
+    return TestClient(app), handled
+
+
+def multipart(data: bytes):
+    boundary = "limit-test"
+    body = (
+        f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"a.jpg\"\r\n"
+        f"Content-Type: image/jpeg\r\n\r\n"
+    ).encode() + data + f"\r\n--{boundary}--\r\n".encode()
+    return body, {"Content-Type": f"multipart/form-data; boundary={boundary}"}
+
+
+def test_content_length_over_limit_is_rejected_before_the_route():
+    client, handled = make_client(1024)
+    body, headers = multipart(b"x" * 2048)
+    response = client.post("/upload", content=body, headers=headers)
+    assert response.status_code == 413
+    assert response.json() == {"message": "Request body exceeds upload limit"}
+    assert handled == []
+
+
+def test_chunked_upload_is_counted_while_receiving():
+    client, handled = make_client(1024)
+    body, headers = multipart(b"x" * 4096)
+
+    def chunks():
+        for i in range(0, len(body), 256):
+            yield body[i:i + 256]
+
+    response = client.post("/upload", content=chunks(), headers=headers)
+    assert response.status_code == 413
+    assert handled == []
+
+
+def test_upload_within_limit_passes():
+    client, handled = make_client(1024)
+    body, headers = multipart(b"x" * 100)
+    response = client.post("/upload", content=body, headers=headers)
+    assert response.status_code == 200 and response.json() == {"size": 100}
+    assert handled == ["a.jpg"]
+
+
+def test_same_second_uploads_do_not_overwrite(tmp_path):
+    settings = get_settings().model_copy(update={"UPLOAD_DIRECTORY": str(tmp_path)})
+
+    def image():
+        return UploadFile(io.BytesIO(JPEG), filename="photo.jpg", headers=Headers({"content-type": "image/jpeg"}))
+
+    first = upload_file("u", image(), "original", settings)
+    second = upload_file("u", image(), "original", settings)
+    assert first != second
+    assert open(first, "rb").read() == open(second, "rb").read() == JPEG